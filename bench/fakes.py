@@ -0,0 +1,582 @@
+"""In-process stand-ins for the Google Cloud clients used by main.py.
+
+Every service has a Profile with a per-call latency, a per-megabyte cost,
+a payload limit, an error rate and a quota, so the app can be load tested offline
+with realistic and reproducible API behaviour. install() must run before
+main creates its first client.
+"""
+import base64
+import datetime
+import io
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from google.api_core.exceptions import (
+    InvalidArgument, NotFound, ResourceExhausted, ServiceUnavailable)
+
+
+@dataclass
+class Profile:
+    """Simulated behaviour of one service"""
+    latency: float = 0.0  # Seconds per call
+    per_mb: float = 0.0  # Extra seconds per megabyte of payload
+    max_payload: int = 0  # Bytes per request, 0 for unlimited
+    error_rate: float = 0.0  # Probability of a retryable failure per call
+    quota: int = 0  # Calls per minute, enforced per second, 0 for unlimited
+
+
+# Defaults roughly follow the documented limits and observed latencies
+PROFILES = {
+    "gcs": Profile(latency=0.02, per_mb=0.05),
+    "docai": Profile(latency=1.5, per_mb=0.5, max_payload=20 * 1024 * 1024),
+    "dlp": Profile(latency=0.25, per_mb=1.0, max_payload=512 * 1024),
+    "nl": Profile(latency=0.2, max_payload=1024 * 1024),
+    "bq": Profile(latency=0.1, per_mb=0.2, max_payload=10 * 1024 * 1024),
+}
+CALLS = {service: 0 for service in PROFILES}
+THROTTLED = {service: 0 for service in PROFILES}
+_recent_calls = {service: [] for service in PROFILES}
+_calls_lock = threading.Lock()
+
+NAME_PATTERN = re.compile(r"\b(?:Mr\.|Mrs\.|Dr\.) [A-Z][a-z]+ [A-Z][a-z]+")
+PHONE_PATTERN = re.compile(r"\b\d{3}-\d{3}-\d{4}\b")
+DRUGS = [
+    ("Paracetamol 500", "paracetamol"),
+    ("Amoxicillin 250", "amoxicillin trihydrate"),
+    ("Metformin SR", "metformin hydrochloride"),
+    ("Atorvastatin 10", "atorvastatin calcium"),
+    ("Azithral 500", "azithromycin"),
+    ("Pantocid DSR", "pantoprazole + domperidone"),
+    ("Augmentin 625", "amoxicillin + clavulanic acid"),
+    ("Losartan H", "losartan potassium + hydrochlorothiazide"),
+]
+
+
+def configure(service, **settings):
+    """Change the profile of one service"""
+    for key, value in settings.items():
+        setattr(PROFILES[service], key, type(getattr(PROFILES[service], key))(value))
+
+
+def simulate(service, size=0):
+    """Sleep, enforce the payload limit and fail at random like the service would"""
+    profile = PROFILES[service]
+    with _calls_lock:
+        CALLS[service] += 1
+        if profile.quota:
+            now = time.monotonic()
+            recent = _recent_calls[service]
+            recent[:] = [at for at in recent if now - at < 1.0]
+            if len(recent) >= max(1, profile.quota // 60):
+                THROTTLED[service] += 1
+                raise ResourceExhausted(f"Quota exceeded for {service}")
+            recent.append(now)
+    if profile.max_payload and size > profile.max_payload:
+        raise InvalidArgument(
+            f"{service} payload of {size} bytes exceeds {profile.max_payload}")
+    delay = profile.latency + profile.per_mb * size / (1024 * 1024)
+    if delay:
+        time.sleep(delay * random.uniform(0.8, 1.2))
+    if profile.error_rate and random.random() < profile.error_rate:
+        raise ServiceUnavailable(f"Simulated {service} failure")
+
+
+class Row(dict):
+    """BigQuery row supporting both key and attribute access"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+# Google Cloud Storage
+
+STORE = {}
+_store_lock = threading.Lock()
+
+
+class FakeBlob:
+    def __init__(self, name, bucket=None):
+        self.name = name
+        self.bucket = bucket
+        entry = STORE.get(name)
+        self.size = len(entry[0]) if entry else None
+        self.time_created = entry[1] if entry else None
+        self.updated = self.time_created
+
+    def _put(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        simulate("gcs", len(data))
+        with _store_lock:
+            STORE[self.name] = (data, datetime.datetime.now(datetime.timezone.utc))
+        self.size = len(data)
+        self.time_created = self.updated = STORE[self.name][1]
+
+    def _get(self):
+        if self.name not in STORE:
+            raise NotFound(self.name)
+        data = STORE[self.name][0]
+        simulate("gcs", len(data))
+        return data
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self._put(data)
+
+    def upload_from_file(self, file_obj, content_type=None, **kwargs):
+        self._put(file_obj.read())
+
+    def download_as_bytes(self, **kwargs):
+        return self._get()
+
+    def download_as_text(self, **kwargs):
+        return self._get().decode("utf-8")
+
+    def exists(self, **kwargs):
+        simulate("gcs")
+        return self.name in STORE
+
+    def reload(self, **kwargs):
+        simulate("gcs")
+        if self.name not in STORE:
+            raise NotFound(self.name)
+        self.size = len(STORE[self.name][0])
+        self.time_created = self.updated = STORE[self.name][1]
+
+    def delete(self, **kwargs):
+        simulate("gcs")
+        with _store_lock:
+            STORE.pop(self.name, None)
+
+    def open(self, mode="rb", chunk_size=None, **kwargs):
+        if "w" in mode:
+            return FakeWriter(self)
+        return io.BytesIO(self._get())
+
+
+class FakeWriter:
+    """Resumable upload that pays the GCS cost per chunk"""
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        simulate("gcs", len(data))
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.blob._put(b"".join(self.parts))
+        self.closed = True
+
+
+class FakePages(list):
+    """Listing result that can be walked page by page"""
+
+    page_size = 1000
+
+    @property
+    def pages(self):
+        for start in range(0, len(self), self.page_size):
+            simulate("gcs")
+            yield self[start:start + self.page_size]
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class FakeBucket:
+    def __init__(self, name):
+        self.name = name
+
+    def blob(self, name, **kwargs):
+        return FakeBlob(name, self)
+
+    def copy_blob(self, blob, destination_bucket, new_name=None, **kwargs):
+        data = blob._get()
+        copy = FakeBlob(new_name or blob.name, destination_bucket)
+        with _store_lock:
+            STORE[copy.name] = (data, datetime.datetime.now(datetime.timezone.utc))
+        return copy
+
+    def list_blobs(self, prefix=None, start_offset=None, max_results=None,
+                   page_size=None, **kwargs):
+        names = sorted(name for name in list(STORE)
+                       if (not prefix or name.startswith(prefix))
+                       and (not start_offset or name >= start_offset))
+        if max_results:
+            names = names[:max_results]
+        listing = FakePages(FakeBlob(name, self) for name in names)
+        listing.page_size = page_size or FakePages.page_size
+        return listing
+
+
+class FakeStorageClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name):
+        return FakeBucket(name)
+
+    def get_bucket(self, name):
+        return FakeBucket(name)
+
+    def list_blobs(self, bucket, prefix=None, **kwargs):
+        return FakeBucket(bucket).list_blobs(prefix=prefix, **kwargs)
+
+
+# BigQuery
+
+TABLES = {}
+
+
+class FakeQueryJob:
+    errors = None
+
+    def __init__(self, rows=()):
+        self.rows = [Row(row) for row in rows]
+        self.job_id = f"bench_{random.getrandbits(48):012x}"
+        self.state = "DONE"
+        self.error_result = None
+
+    def result(self, *args, **kwargs):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeBigQueryClient:
+    project = "bench-project"
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def dataset(self, dataset_id):
+        from google.cloud import bigquery
+        return bigquery.DatasetReference(self.project, dataset_id)
+
+    def get_table(self, table_id):
+        simulate("bq")
+        return SimpleNamespace(schema=[], modified=None, table_id=str(table_id),
+                               num_rows=len(table_rows(str(table_id).rsplit(".", 1)[-1])))
+
+    def create_table(self, table, exists_ok=False, **kwargs):
+        simulate("bq")
+        return table
+
+    def get_job(self, job_id, **kwargs):
+        return FakeQueryJob()
+
+    def insert_rows_json(self, table, rows, row_ids=None, **kwargs):
+        simulate("bq", sum(len(str(row)) for row in rows))
+        TABLES.setdefault(str(table), []).extend(rows)
+        return []
+
+    def load_table_from_json(self, rows, table_id, job_config=None, **kwargs):
+        rows = list(rows)
+        simulate("bq", sum(len(str(row)) for row in rows))
+        TABLES.setdefault(str(table_id), []).extend(rows)
+        return FakeQueryJob()
+
+    def query(self, query, job_config=None, **kwargs):
+        simulate("bq")
+        return FakeQueryJob(answer_query(query, job_config))
+
+
+def table_rows(name):
+    """Rows written to every fake table with this name, whatever its dataset"""
+    return [row for table_id, rows in list(TABLES.items())
+            if table_id.rsplit(".", 1)[-1] == name for row in list(rows)]
+
+
+def query_parameter(job_config, name):
+    for parameter in getattr(job_config, "query_parameters", None) or []:
+        if parameter.name == name:
+            return parameter.values if hasattr(parameter, "values") else parameter.value
+    return None
+
+
+def timestamp(value):
+    return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def recorded_objects(query, job_config):
+    """Answer the reconciliation queries from the latest row of each object"""
+    table = re.search(r"\.(\w+_meta_direct)`", query).group(1)
+    latest = {}
+    for row in table_rows(table):
+        current = latest.get(row["filename"])
+        if current is None or timestamp(row["created"]) >= timestamp(current["created"]):
+            latest[row["filename"]] = row
+    rows = [row for row in latest.values() if not row.get("deleted")]
+    if "@names" in query:
+        names = set(query_parameter(job_config, "names"))
+        watermark = query_parameter(job_config, "watermark")
+        return [{"filename": row["filename"]} for row in rows
+                if row["filename"] in names and timestamp(row["created"]) > watermark]
+    prefix = query_parameter(job_config, "prefix")
+    after = query_parameter(job_config, "after")
+    until = query_parameter(job_config, "until")
+    listed_at = query_parameter(job_config, "listed_at")
+    return [{"filename": row["filename"]} for row in rows
+            if row["filename"].startswith(prefix) and row["filename"] > after
+            and (until is None or row["filename"] <= until)
+            and timestamp(row["created"]) < listed_at]
+
+
+def pending_extraction():
+    """Latest text of each document that has no medicines row for its hash"""
+    latest = {}
+    for row in table_rows("deidentified_text"):
+        latest[row["filename"]] = row
+    analyzed = {(row["filename"], row["text_hash"]) for row in table_rows("document_medicines")}
+    rows = []
+    for filename, row in latest.items():
+        if (filename, row["text_hash"]) in analyzed:
+            continue
+        compressed = row.get("compressed_text")
+        rows.append({
+            "filename": filename,
+            "deidentified_text": row["deidentified_text"],
+            "compressed_text": base64.b64decode(compressed) if compressed else None,
+            "recordstamp": datetime.datetime.fromisoformat(row["recordstamp"]).replace(
+                tzinfo=datetime.timezone.utc),
+            "text_hash": row["text_hash"],
+        })
+    return rows
+
+
+def answer_query(query, job_config=None):
+    """Rows for the queries the app depends on, derived from the fake stores"""
+    if "document_medicines" in query and "deidentified_text" in query:
+        return pending_extraction()
+    if "medicines_found" in query:
+        filename = query_parameter(job_config, "filename")
+        documents = {row["filename"]: row for row in table_rows("document_medicines")
+                     if row["filename"] == filename}
+        return [{"filename": row["filename"],
+                 "medicine_names": [medicine["name"] for medicine in row["medicines"]]}
+                for row in documents.values() if row["medicines"]]
+    if "_meta_direct" in query:
+        return recorded_objects(query, job_config)
+    if "SELECT DISTINCT filename" in query:
+        prefix = query_parameter(job_config, "prefix") or ""
+        return [{"filename": row["filename"], "sha256": row["sha256"], "size": row["size"]}
+                for row in table_rows("file_timings")
+                if row["status"] != "failed" and row["filename"].startswith(prefix)]
+    if "watermark" in query:
+        return [{"watermark": None}]
+    if "drug_name" in query:
+        return [{"drug_name": name, "composition": composition}
+                for name, composition in DRUGS]
+    if "deidentified_view" in query:
+        return [{"file_name": name[len("deidentified/"):], "size": len(data),
+                 "created": created}
+                for name, (data, created) in list(STORE.items())
+                if name.startswith("deidentified/")]
+    if "file_processed_dash" in query:
+        counts = {}
+        for name in list(STORE):
+            if "/" in name:
+                continue
+            kind = name.rsplit(".", 1)[-1]
+            row = counts.setdefault(kind, {
+                "Content_Type": kind, "Unprocessed_Count": 0,
+                "Processed_Count": 0, "Deidentified_Count": 0})
+            if f"deidentified/{name}.txt" in STORE:
+                row["Deidentified_Count"] += 1
+                row["Processed_Count"] += 1
+            else:
+                row["Unprocessed_Count"] += 1
+        return list(counts.values())
+    return []
+
+
+# Document AI
+
+TEXT_OBJECT = re.compile(rb"\((.*?)\) Tj")
+
+
+class FakeDocumentAIClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def processor_path(self, project, location, processor):
+        return f"projects/{project}/locations/{location}/processors/{processor}"
+
+    def process_document(self, request=None, **kwargs):
+        raw = request.raw_document
+        content = raw.content
+        simulate("docai", len(content))
+        if raw.mime_type == "application/pdf":
+            pages = max(1, content.count(b"/Type /Page") - content.count(b"/Type /Pages"))
+            text = b"\n".join(TEXT_OBJECT.findall(content)).decode("latin-1")
+        else:
+            pages = 1
+            text = synthetic_text(random.Random(len(content)), 60)
+        document = SimpleNamespace(text=text, pages=[SimpleNamespace()] * pages)
+        return SimpleNamespace(document=document)
+
+    def batch_process_documents(self, request=None, **kwargs):
+        from google.cloud import documentai
+        source = request.input_documents.gcs_documents.documents[0]
+        output = request.document_output_config.gcs_output_config.gcs_uri
+        content = STORE[source.gcs_uri.split("/", 3)[3]][0]
+        raw = SimpleNamespace(content=content, mime_type=source.mime_type)
+        result = self.process_document(SimpleNamespace(raw_document=raw))
+        document = documentai.Document(
+            text=result.document.text,
+            pages=[documentai.Document.Page() for _ in result.document.pages])
+        name = f"{output.split('/', 3)[3]}0/document-0.json"
+        with _store_lock:
+            STORE[name] = (documentai.Document.to_json(document).encode("utf-8"),
+                           datetime.datetime.now(datetime.timezone.utc))
+        return SimpleNamespace(result=lambda timeout=None: None)
+
+
+# Cloud DLP
+
+class FakeDlpClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def inspect_content(self, request=None, **kwargs):
+        text = request["item"]["value"]
+        simulate("dlp", len(text.encode("utf-8")))
+        findings = [SimpleNamespace(
+            location=SimpleNamespace(codepoint_range=SimpleNamespace(
+                start=match.start(), end=match.end())),
+            info_type=SimpleNamespace(name=info_type))
+            for pattern, info_type in ((NAME_PATTERN, "PERSON_NAME"),
+                                       (PHONE_PATTERN, "PHONE_NUMBER"))
+            for match in pattern.finditer(text)]
+        return SimpleNamespace(result=SimpleNamespace(
+            findings=findings, findings_truncated=False))
+
+    def deidentify_content(self, request=None, **kwargs):
+        item = request["item"]
+        if "value" in item:
+            simulate("dlp", len(item["value"].encode("utf-8")))
+            return SimpleNamespace(item=SimpleNamespace(value=redact(item["value"])))
+        texts = [row["values"][0]["string_value"] for row in item["table"]["rows"]]
+        simulate("dlp", sum(len(text.encode("utf-8")) for text in texts))
+        rows = [SimpleNamespace(values=[SimpleNamespace(string_value=redact(text))])
+                for text in texts]
+        return SimpleNamespace(item=SimpleNamespace(table=SimpleNamespace(rows=rows)))
+
+
+def redact(text):
+    text = NAME_PATTERN.sub("[PERSON_NAME]", text)
+    return PHONE_PATTERN.sub("[PHONE_NUMBER]", text)
+
+
+# Natural Language
+
+class FakeLanguageClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def analyze_entities(self, request=None, **kwargs):
+        from google.cloud import language_v1
+        content = request["document"].content
+        simulate("nl", len(content.encode("utf-8")))
+        entities = [SimpleNamespace(name=name, type=language_v1.Entity.Type.CONSUMER_GOOD)
+                    for name, _ in DRUGS if name in content]
+        return SimpleNamespace(entities=entities)
+
+
+# Synthetic documents
+
+WORDS = ("patient presented with mild fever and cough history of hypertension "
+         "advised rest fluids follow up in two weeks blood pressure normal "
+         "prescribed tablets twice daily after meals review reports").split()
+FIRST_NAMES = ["John", "Priya", "Maria", "Arjun", "Wei", "Fatima", "Carlos", "Anita"]
+LAST_NAMES = ["Smith", "Sharma", "Garcia", "Iyer", "Chen", "Khan", "Lopez", "Das"]
+
+
+def synthetic_text(rng, words):
+    """Clinical looking text with names, phone numbers and drug names"""
+    parts = []
+    for index in range(words):
+        if index % 25 == 0:
+            parts.append(f"Mr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}")
+        elif index % 40 == 7:
+            parts.append(f"{rng.randint(200, 999)}-{rng.randint(200, 999)}-{rng.randint(1000, 9999)}")
+        elif index % 30 == 13:
+            parts.append(rng.choice(DRUGS)[0])
+        else:
+            parts.append(rng.choice(WORDS))
+    return " ".join(parts)
+
+
+def synthetic_pdf(rng, pages, words_per_page=250, scanned=0.0):
+    """A valid multi-page PDF with a text layer.
+
+    A `scanned` share of the pages carries its text only in comments, so
+    PDF readers find no text layer while the fake OCR still reads it.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        lines = synthetic_text(rng, words_per_page).split(" ")
+        prefix = b"% " if rng.random() < scanned else b""
+        stream = b"BT /F1 10 Tf 50 780 Td 12 TL\n" + b"".join(
+            prefix + b"(" + " ".join(lines[i:i + 12]).encode("latin-1") + b") Tj T*\n"
+            for i in range(0, len(lines), 12)) + b"ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+                       % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                 % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def synthetic_png(rng, width, height):
+    """A noisy greyscale PNG, roughly the size of a scanned page"""
+    import struct
+    import zlib
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    rows = b"".join(b"\x00" + bytes(rng.choice((0, 255, 255, 255)) for _ in range(width))
+                    for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 6))
+            + chunk(b"IEND", b""))
+
+
+def install():
+    """Replace the client classes main.py instantiates with the fakes"""
+    from google.cloud import bigquery, dlp_v2, documentai, language_v1, storage
+    storage.Client = FakeStorageClient
+    bigquery.Client = FakeBigQueryClient
+    dlp_v2.DlpServiceClient = FakeDlpClient
+    language_v1.LanguageServiceClient = FakeLanguageClient
+    documentai.DocumentProcessorServiceClient = FakeDocumentAIClient
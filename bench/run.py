@@ -0,0 +1,398 @@
+"""Offline load test of the Obscurer API against simulated Google Cloud services.
+
+Run from the repository root:
+
+    python bench/run.py --files 200 --concurrency 16
+    python bench/run.py --latency docai=3 --error-rate dlp=0.02 --json after.json --baseline before.json
+
+The run has three phases. Upload posts synthetic PDFs, images and text
+files to /upload. Drain waits for the pipeline to finish them. Read hits
+/fetch, /download, /search and the reporting endpoints. Throughput, p50/p99
+latency and errors are reported per endpoint, with end to end pipeline
+throughput and peak RSS.
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes  # noqa: E402
+
+READ_ENDPOINTS = ("fetch", "download", "download_gzip", "processed_files_list",
+                  "count_files_processed", "fetch_medicine_names", "search")
+
+
+def parse_settings(values, cast):
+    """Turn ['docai=1.5', 'dlp=0.2'] into {'docai': 1.5, 'dlp': 0.2}"""
+    settings = {}
+    for value in values or []:
+        service, _, setting = value.partition("=")
+        if service not in fakes.PROFILES:
+            raise SystemExit(f"Unknown service '{service}', expected one of {sorted(fakes.PROFILES)}")
+        settings[service] = cast(setting)
+    return settings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100, help="files to upload")
+    parser.add_argument("--batch", type=int, default=5, help="files per /upload request")
+    parser.add_argument("--ingest", choices=("upload", "tar", "zip", "bucket"), default="upload",
+                        help="send the files with /upload, or in one /ingest call as an"
+                             " archive or a bucket prefix")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--reads", type=int, default=200, help="requests in the read phase")
+    parser.add_argument("--mix", default="pdf=0.5,png=0.3,txt=0.2",
+                        help="share of each synthetic file type")
+    parser.add_argument("--pdf-pages", type=int, default=3)
+    parser.add_argument("--pdf-scanned", type=float, default=0.3,
+                        help="share of PDF pages without a text layer")
+    parser.add_argument("--image-size", type=int, default=600, help="image width and height in pixels")
+    parser.add_argument("--text-words", type=int, default=400)
+    parser.add_argument("--latency", action="append", metavar="SERVICE=SECONDS")
+    parser.add_argument("--per-mb", action="append", metavar="SERVICE=SECONDS")
+    parser.add_argument("--max-payload", action="append", metavar="SERVICE=BYTES")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=P")
+    parser.add_argument("--quota", action="append", metavar="SERVICE=PER_MINUTE")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--log-level", default="WARNING", help="log level of the app while running")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier --json report to compare against")
+    return parser.parse_args(argv)
+
+
+def make_documents(args):
+    """Synthetic (filename, content, content_type) uploads in the requested mix"""
+    rng = random.Random(args.seed)
+    mix = {kind: float(share) for kind, share in
+           (item.split("=") for item in args.mix.split(","))}
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=args.files)
+    documents = []
+    for index, kind in enumerate(kinds):
+        if kind == "pdf":
+            content = fakes.synthetic_pdf(rng, args.pdf_pages, scanned=args.pdf_scanned)
+            content_type = "application/pdf"
+        elif kind == "png":
+            content = fakes.synthetic_png(rng, args.image_size, args.image_size)
+            content_type = "image/png"
+        else:
+            content = fakes.synthetic_text(rng, args.text_words).encode("utf-8")
+            content_type = "text/plain"
+        documents.append((f"bench_{index:05d}.{kind}", content, content_type))
+    return documents
+
+
+class Recorder:
+    """Latencies and errors per endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.started = {}
+        self.finished = {}
+
+    def record(self, endpoint, started, ok):
+        now = time.monotonic()
+        self.latencies.setdefault(endpoint, []).append(now - started)
+        self.started[endpoint] = min(self.started.get(endpoint, started), started)
+        self.finished[endpoint] = max(self.finished.get(endpoint, now), now)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self):
+        report = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            elapsed = self.finished[endpoint] - self.started[endpoint]
+            report[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            }
+        return report
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+class RssSampler(threading.Thread):
+    """Track peak resident memory of this process while the run is going"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, current_rss())
+            time.sleep(self.interval)
+
+
+def current_rss():
+    """Resident set size in bytes, from /proc when available"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+async def drive(client, recorder, concurrency, requests):
+    """Send (endpoint, method, url, kwargs) requests with a fixed number of clients"""
+    pending = iter(requests)
+
+    async def worker():
+        for endpoint, method, url, kwargs in pending:
+            started = time.monotonic()
+            try:
+                response = await client.request(method, url, **kwargs)
+                await response.aread()
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            recorder.record(endpoint, started, ok)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def wait_for_pipeline(main):
+    """Wait until every queued file has been processed and its rows written"""
+    while pipeline_busy(main):
+        await asyncio.sleep(0.05)
+    await main.bq_writer.flush()
+    await main.run_blocking(main.search_index.flush)
+    # Run the debounced medicine extraction now so reads can see its results
+    await main.analyze_and_insert_data()
+
+
+def pipeline_busy(main):
+    status = main.pipeline.status()
+    return (status["queued"] or status["reserved"]
+            or any(stage["busy"] for stage in status["stages"].values())
+            or main.pipeline.queue._unfinished_tasks
+            or any(main.job_store.counts().get(state)
+                   for state in ("queued", "running", "retrying")))
+
+
+def search_query(rng):
+    """A word, boolean or phrase query over the synthetic text"""
+    word, other = rng.sample(fakes.WORDS, 2)
+    drug = rng.choice(fakes.DRUGS)[0].split()[0]
+    return rng.choice([word, f"{drug} AND [PERSON_NAME]", f'"{word} {other}"',
+                       f"{word} OR {other}", f"{drug} -{word}"])
+
+
+def ingest_requests(args, documents):
+    """Requests that send the documents in, per the --ingest mode"""
+    if args.ingest == "bucket":
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for name, content, _ in documents:
+            fakes.STORE[f"backfill/{name}"] = (content, now)
+        return [("ingest", "POST", "/ingest",
+                 {"params": {"source_bucket": "bench-source", "prefix": "backfill/"}})]
+    if args.ingest in ("tar", "zip"):
+        archive = io.BytesIO()
+        if args.ingest == "zip":
+            with zipfile.ZipFile(archive, "w") as writer:
+                for name, content, _ in documents:
+                    writer.writestr(name, content)
+        else:
+            with tarfile.open(fileobj=archive, mode="w:gz") as writer:
+                for name, content, _ in documents:
+                    member = tarfile.TarInfo(name)
+                    member.size = len(content)
+                    writer.addfile(member, io.BytesIO(content))
+        filename = f"backfill.{'zip' if args.ingest == 'zip' else 'tar.gz'}"
+        return [("ingest", "POST", "/ingest", {
+            "files": [("archive", (filename, archive.getvalue(), "application/octet-stream"))]})]
+    uploads = []
+    for start in range(0, len(documents), args.batch):
+        batch = documents[start:start + args.batch]
+        uploads.append(("upload", "POST", "/upload", {
+            "files": [("files", document) for document in batch]}))
+    return uploads
+
+
+async def run(args):
+    import logging
+
+    import httpx
+    import main
+
+    logging.getLogger().setLevel(args.log_level)
+    documents = make_documents(args)
+    uploads = ingest_requests(args, documents)
+    rng = random.Random(args.seed)
+    names = [name for name, _, _ in documents]
+    reads = []
+    for _ in range(args.reads):
+        endpoint = rng.choice(READ_ENDPOINTS)
+        name = rng.choice(names)
+        if endpoint == "fetch":
+            reads.append((endpoint, "POST", "/fetch", {"params": {"name": name}}))
+        elif endpoint == "download":
+            reads.append((endpoint, "POST", "/download", {"params": {"name": name[:9]}}))
+        elif endpoint == "download_gzip":
+            reads.append((endpoint, "POST", "/download",
+                          {"params": {"name": name[:9], "gzip": "true"}}))
+        elif endpoint == "search":
+            reads.append((endpoint, "GET", "/search", {"params": {"q": search_query(rng)}}))
+        elif endpoint == "fetch_medicine_names":
+            reads.append((endpoint, "POST", "/fetch_medicine_names",
+                          {"params": {"filename": name}}))
+        else:
+            reads.append((endpoint, "POST", f"/{endpoint}", {}))
+
+    recorder = Recorder()
+    sampler = RssSampler()
+    sampler.start()
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                     timeout=None) as client:
+            started = time.monotonic()
+            await drive(client, recorder, args.concurrency, uploads)
+            uploaded = time.monotonic()
+            await wait_for_pipeline(main)
+            drained = time.monotonic()
+            await drive(client, recorder, args.concurrency, reads)
+            finished = time.monotonic()
+            metrics = (await client.get("/metrics")).text
+            cold_start = (await client.get("/ready")).json()["cold_start"]
+    sampler.running = False
+    sampler.join()
+
+    input_bytes = sum(len(content) for _, content, _ in documents)
+    return {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("json", "baseline", "log_level")},
+        "profiles": {service: vars(profile) for service, profile in fakes.PROFILES.items()},
+        "pipeline": {
+            "files": len(documents),
+            "input_mb": round(input_bytes / 1024 / 1024, 2),
+            "upload_seconds": round(uploaded - started, 3),
+            "drain_seconds": round(drained - uploaded, 3),
+            "files_per_second": round(len(documents) / (drained - started), 2),
+            "read_seconds": round(finished - drained, 3),
+        },
+        "endpoints": recorder.summary(),
+        "api_calls": dict(fakes.CALLS),
+        "api_throttled": dict(fakes.THROTTLED),
+        "tables_written": {
+            table_id.rsplit(".", 1)[-1]: {
+                "rows": len(rows),
+                "kb": round(sum(len(json.dumps(row, default=str)) for row in rows) / 1024, 1)}
+            for table_id, rows in list(fakes.TABLES.items())},
+        "cold_start_seconds": cold_start,
+        "peak_rss_mb": round(max(sampler.peak, current_rss()) / 1024 / 1024, 1),
+        "stage_seconds": metric_totals(metrics, "obscurer_stage_duration_seconds_sum", "stage"),
+        "files_by_status": metric_totals(metrics, "obscurer_files_processed_total", "status"),
+    }
+
+
+def metric_totals(metrics, name, label):
+    """Sum a /metrics series by one of its labels"""
+    totals = {}
+    for line in metrics.splitlines():
+        if line.startswith(name + "{"):
+            series, value = line.rsplit(" ", 1)
+            key = series.split(f'{label}="', 1)[1].split('"', 1)[0]
+            totals[key] = round(totals.get(key, 0) + float(value), 3)
+    return totals
+
+
+def print_report(report, baseline=None):
+    def delta(current, previous):
+        if not previous or current is None:
+            return ""
+        return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+    base = baseline or {}
+    pipeline = report["pipeline"]
+    base_pipeline = base.get("pipeline", {})
+    print(f"Pipeline: {pipeline['files']} files, {pipeline['input_mb']} MB, "
+          f"{pipeline['files_per_second']} files/s"
+          f"{delta(pipeline['files_per_second'], base_pipeline.get('files_per_second'))}, "
+          f"upload {pipeline['upload_seconds']}s, drain {pipeline['drain_seconds']}s")
+    print(f"Peak RSS: {report['peak_rss_mb']} MB"
+          f"{delta(report['peak_rss_mb'], base.get('peak_rss_mb'))}")
+    print("Cold start: " + ", ".join(f"{phase}={seconds}s"
+                                     for phase, seconds in report["cold_start_seconds"].items()))
+    print(f"{'endpoint':<24}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in report["endpoints"].items():
+        previous = base.get("endpoints", {}).get(endpoint, {})
+        print(f"{endpoint:<24}{stats['requests']:>9}{stats['errors']:>8}"
+              f"{stats['throughput_rps']:>10}{stats['p50_ms']:>10}{stats['p99_ms']:>10}"
+              f"{delta(stats['p99_ms'], previous.get('p99_ms'))}")
+    print("API calls: " + ", ".join(f"{service}={count}"
+                                    for service, count in report["api_calls"].items()))
+    throttled = {service: count for service, count in report.get("api_throttled", {}).items()
+                 if count}
+    if throttled:
+        print("API calls over quota: " + ", ".join(f"{service}={count}"
+                                                   for service, count in throttled.items()))
+    print("BigQuery rows written: " + ", ".join(
+        f"{table}={stats['rows']} ({stats['kb']} KB)"
+        for table, stats in report.get("tables_written", {}).items()))
+    print("Files: " + ", ".join(f"{status}={int(count)}"
+                                for status, count in report["files_by_status"].items()))
+    print("Stage seconds: " + ", ".join(f"{stage}={seconds}"
+                                        for stage, seconds in report["stage_seconds"].items()))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    for option, setting, cast in (("latency", "latency", float), ("per_mb", "per_mb", float),
+                                  ("max_payload", "max_payload", int),
+                                  ("error_rate", "error_rate", float),
+                                  ("quota", "quota", int)):
+        for service, value in parse_settings(getattr(args, option), cast).items():
+            fakes.configure(service, **{setting: value})
+
+    # Fresh caches, job store and search index so runs do not reuse results of an earlier run
+    workdir = tempfile.mkdtemp(prefix="obscurer_bench_")
+    os.environ.setdefault("CACHE_DIR", os.path.join(workdir, "cache"))
+    os.environ.setdefault("JOB_DB_PATH", os.path.join(workdir, "jobs.sqlite3"))
+    os.environ.setdefault("SEARCH_DIR", os.path.join(workdir, "search"))
+    # Retry failed jobs quickly so injected errors don't dominate the run time
+    os.environ.setdefault("JOB_RETRY_BASE", "0.2")
+    os.environ.setdefault("JOB_POLL_SECONDS", "0.1")
+    fakes.install()
+    report = asyncio.run(run(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,51 @@
+import time
+STARTED_AT = time.monotonic()  # Taken before the heavy imports to time cold starts
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from google.cloud import storage, bigquery, dlp_v2, language_v1, documentai
-from google.protobuf.json_format import MessageToDict
+from google.cloud import bigquery
 import os
 import io
 import asyncio
 import logging
 from typing import List
-from google.cloud.bigquery.schema import SchemaField
 import datetime
 import uuid
 from google.api_core.client_options import ClientOptions
-from starlette.responses import StreamingResponse
-from io import StringIO
-import pandas as pd
+from google.api_core.exceptions import (
+    NotFound, InvalidArgument, ResourceExhausted, TooManyRequests,
+    ServiceUnavailable, DeadlineExceeded, InternalServerError)
+from starlette.responses import StreamingResponse, PlainTextResponse, JSONResponse
 import json
 import glob
+import functools
+import hashlib
+import zlib
+import base64
+import random
+import re
+import threading
+import multiprocessing
+import sqlite3
+import tarfile
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
+
+from search import SearchIndex
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start the pipeline and background services for the app's lifetime"""
+    await start_pipeline()
+    yield
+    await stop_pipeline()
+
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Obscurer",
     description="Obscurer is a data pipeline application that uses FastAPI and Google Cloud Platform to perform text extraction and PII deidentification on PDF documents or images in the healthcare domain. It also helps identify documents that contain medicine names or compositions.",
     version="1.0.0",
@@ -37,15 +66,126 @@ PRIMARY_BQ_TABLE = "raw_files"
 DRUG_DB_TABLE = "drug_database"
 REPORTING_DATASET = "obscurer_reporting"
 
-gcs_client = storage.Client(project=PROJECT_ID)
-bq_client = bigquery.Client(project=PROJECT_ID)
-language_client = language_v1.LanguageServiceClient()
-dlp_client = dlp_v2.DlpServiceClient()
-sql_files = glob.glob("./sql/*.sql")
-
-table_ref = bq_client.dataset(BQ_DATASET).table(PRIMARY_BQ_TABLE)
-table = bq_client.get_table(table_ref)
-schema = table.schema
+# Pipeline executor settings
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", 4))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 100))
+PIPELINE_THREADS = int(os.environ.get("PIPELINE_THREADS", 16))
+PIPELINE_RETRY_AFTER = 30  # Seconds suggested to clients when the queue is full
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Must be a multiple of 256 KiB for resumable uploads
+# Document AI sharding settings
+DOCAI_SHARD_PAGES = int(os.environ.get("DOCAI_SHARD_PAGES", 15))  # Online OCR page limit
+DOCAI_BATCH_PAGES = int(os.environ.get("DOCAI_BATCH_PAGES", 0))  # 0 keeps every document online
+DOCAI_BATCH_PREFIX = "docai-batch/"
+DOCAI_BATCH_TIMEOUT = 1800  # Seconds to wait for a batch operation
+PDF_TEXT_LAYER = os.environ.get("PDF_TEXT_LAYER", "true").lower() == "true"
+PDF_TEXT_MIN_CHARS = 20  # Fewer extracted characters marks a page as scanned
+# Image pre-processing settings
+IMAGE_PREPROCESS = os.environ.get("IMAGE_PREPROCESS", "true").lower() == "true"
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))  # Processes in the image pool
+IMAGE_MIN_BYTES = 256 * 1024  # Smaller images are sent to OCR as uploaded
+IMAGE_TARGET_DPI = 300
+IMAGE_MAX_SIDE = 3508  # Long side of an A4 page at 300 DPI
+# Job store settings
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "/tmp/obscurer_jobs.sqlite3")
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BASE = float(os.environ.get("JOB_RETRY_BASE", 5))  # Seconds before the first retry, doubled for each later one
+JOB_RETRY_MAX = 600
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 2))  # How often due retries and unfinished jobs are started
+JOB_KEEP_DAYS = 7  # Finished jobs older than this are deleted
+# Bulk ingest settings
+INGEST_PREFIX = "ingest/"  # Uploaded archives wait here until their ingest job is done
+INGEST_BATCH_FILES = int(os.environ.get("INGEST_BATCH_FILES", 50))
+INGEST_BATCH_BYTES = 64 * 1024 * 1024  # A batch is cut early once its files reach this size
+INGEST_POLL_SECONDS = 0.5  # Pause while the pipeline queue has no room for a batch
+INGEST_ARCHIVE_NAME = re.compile(r"^(?:\.?/)+")  # Leading "./" and "/" of member paths
+# Content search index settings
+SEARCH_DIR = os.environ.get("SEARCH_DIR", "/tmp/obscurer_search")
+SEARCH_PREFIX = "search/"  # Segments and manifest are backed up here in the bucket
+SEARCH_BACKFILL_DOCS = 200  # Existing documents indexed per maintenance round
+SEARCH_MAX_PAGE_SIZE = 100
+# Content-addressed OCR/DLP result cache settings
+CACHE_DIR = os.environ.get("CACHE_DIR", "/tmp/obscurer_cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 512 * 1024 * 1024))
+CACHE_PREFIX = "cache/"
+CACHE_VERSION = "v2"  # Bump when OCR or DLP settings change the output
+STATE_PREFIX = "state/"
+INTERNAL_PREFIXES = (CACHE_PREFIX, STATE_PREFIX, DOCAI_BATCH_PREFIX, INGEST_PREFIX,
+                     SEARCH_PREFIX)
+# Ingested files can't be named like pipeline output or internal objects
+RESERVED_PREFIXES = INTERNAL_PREFIXES + ("processed/", "deidentified/")
+
+# BigQuery micro-batching writer settings
+BQ_FLUSH_ROWS = int(os.environ.get("BQ_FLUSH_ROWS", 500))
+BQ_FLUSH_BYTES = int(os.environ.get("BQ_FLUSH_BYTES", 5 * 1024 * 1024))
+BQ_FLUSH_SECONDS = float(os.environ.get("BQ_FLUSH_SECONDS", 2))
+BQ_LOAD_JOB_ROWS = int(os.environ.get("BQ_LOAD_JOB_ROWS", 5000))
+BQ_MAX_RETRIES = 5
+
+# Deidentified filename index and download settings
+INDEX_REFRESH_SECONDS = int(os.environ.get("INDEX_REFRESH_SECONDS", 900))
+INDEX_REFRESH_PAGES = int(os.environ.get("INDEX_REFRESH_PAGES", 50))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Reporting endpoint cache settings
+REPORT_CACHE_TTL = float(os.environ.get("REPORT_CACHE_TTL", 30))
+REPORT_CACHE_STALE = float(os.environ.get("REPORT_CACHE_STALE", 300))
+
+# Materialized reporting table settings
+REPORTING_REFRESH_SQL = "./sql/refresh/file_status_merge.sql"
+REPORTING_TABLE_SQL = "./sql/file_status.sql"
+REPORTING_BACKFILL_SINCE = datetime.date(1970, 1, 1)  # Full history when file_status is new
+REPORTING_REFRESH_DAYS = int(os.environ.get("REPORTING_REFRESH_DAYS", 1))
+REPORTING_REFRESH_DEBOUNCE = float(os.environ.get("REPORTING_REFRESH_DEBOUNCE", 60))
+
+# Instrumentation settings
+TIMINGS_TABLE = "file_timings"
+LOOP_LAG_INTERVAL = 0.5  # Seconds between event loop lag probes
+
+# Metadata table settings
+META_RECONCILE_SECONDS = int(os.environ.get("META_RECONCILE_SECONDS", 3600))
+META_RECONCILE_PAGES = int(os.environ.get("META_RECONCILE_PAGES", 20))
+META_RECONCILE_LAG = datetime.timedelta(minutes=5)
+# Deidentification engine settings
+DLP_MAX_REQUEST_BYTES = 400 * 1024  # DLP rejects requests above 0.5 MB
+DLP_CHUNK_CHARS = 100 * 1000  # Fits the request limit even at 4 bytes per char
+DLP_CHUNK_OVERLAP = 500  # Characters of context shared by neighbouring chunks
+DLP_BATCH_TEXT_BYTES = 16 * 1024  # Texts up to this size are batched together
+DLP_BATCH_MAX_ITEMS = 100
+DLP_BATCH_LINGER = 0.05  # Seconds to wait for more small texts before sending
+# Medicine extraction settings
+DRUG_NAME_COLUMN = "drug_name"
+DRUG_COMPOSITION_COLUMN = "composition"  # e.g. "Metformin Hydrochloride + Glimepiride"
+DRUG_DB_REFRESH_SECONDS = int(os.environ.get("DRUG_DB_REFRESH_SECONDS", 600))
+NL_SECOND_PASS = os.environ.get("NL_SECOND_PASS", "false").lower() == "true"
+MEDICINES_TABLE = "document_medicines"  # One row per analyzed document text
+MEDICINE_MAX_OFFSETS = 100  # Offsets kept per medicine, the count covers every mention
+TEXT_COMPRESS_BYTES = int(os.environ.get("TEXT_COMPRESS_BYTES", 1024 * 1024))
+EXTRACTION_DEBOUNCE = float(os.environ.get("EXTRACTION_DEBOUNCE", 10))
+EXTRACTION_LAG = datetime.timedelta(minutes=10)  # Allowance for late streaming rows
+STAGE_LIMITS = {
+    "gcs": int(os.environ.get("STAGE_LIMIT_GCS", 8)),
+    "docai": int(os.environ.get("STAGE_LIMIT_DOCAI", 4)),
+    "dlp": int(os.environ.get("STAGE_LIMIT_DLP", 4)),
+    "bq": int(os.environ.get("STAGE_LIMIT_BQ", 4)),
+}
+# API rate governor settings, quotas are requests per minute (0 for no bucket)
+API_QUOTAS = {
+    "docai": int(os.environ.get("DOCAI_QUOTA_PER_MINUTE", 120)),
+    "dlp": int(os.environ.get("DLP_QUOTA_PER_MINUTE", 600)),
+    "nl": int(os.environ.get("NL_QUOTA_PER_MINUTE", 600)),
+}
+API_MAX_CONCURRENCY = {
+    "docai": STAGE_LIMITS["docai"],
+    "dlp": STAGE_LIMITS["dlp"],
+    "nl": int(os.environ.get("STAGE_LIMIT_NL", 2)),
+}
+API_RETRIES = int(os.environ.get("API_RETRIES", 4))
+API_RETRY_BASE = 0.5  # Seconds, the jittered backoff doubles per attempt
+API_RETRY_MAX = 30
+API_BACKOFF_FACTOR = 0.7  # Rate and concurrency kept after a throttled call
+API_LATENCY_FACTOR = 3  # Latency over this multiple of the best seen stops the concurrency limit growing
+# Startup settings
+WARMUP_RETRY_SECONDS = 30  # Pause between attempts to warm a failing backend
 
 # Configure logging
 logging.basicConfig(
@@ -58,185 +198,2467 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class ClientRegistry:
+    """Google Cloud clients created on first use and shared by the whole app.
+
+    Each client is built by its factory the first time it is needed, which
+    also defers importing its SDK, so a cold start only pays for the
+    services it actually touches. The lifespan warms every client in the
+    background after startup and closes them on shutdown.
+    """
+
+    def __init__(self):
+        self.factories = {}
+        self.clients = {}
+        self.seconds = {}
+        self.errors = {}
+        self._locks = {}
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+        self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        """The shared client, created on the first call from any thread"""
+        client = self.clients.get(name)
+        if client is not None:
+            return client
+        with self._locks[name]:
+            if name not in self.clients:
+                started = time.monotonic()
+                try:
+                    self.clients[name] = self.factories[name]()
+                except Exception as e:
+                    self.errors[name] = str(e)
+                    raise
+                self.seconds[name] = round(time.monotonic() - started, 3)
+                self.errors.pop(name, None)
+                logger.info(
+                    f"SUCCESS: Created {name} client in {self.seconds[name]}s")
+            return self.clients[name]
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get("factories", ()):
+            return self.get(name)
+        raise AttributeError(name)
+
+    def close(self):
+        """Release the transports of every client created so far"""
+        for name, client in list(self.clients.items()):
+            close = getattr(client, "close", None)
+            if close is None:
+                close = getattr(getattr(client, "transport", None), "close", None)
+            try:
+                if close is not None:
+                    close()
+            except Exception as e:
+                logger.error(f"CAUTION: Couldn't close {name} client: {e}")
+        self.clients.clear()
+
+    def status(self):
+        return {name: {"ready": name in self.clients,
+                       "seconds": self.seconds.get(name),
+                       "error": self.errors.get(name)}
+                for name in self.factories}
+
+
+def create_storage_client():
+    from google.cloud import storage
+    return storage.Client(project=PROJECT_ID)
+
+
+def create_bigquery_client():
+    return bigquery.Client(project=PROJECT_ID)
+
+
+def create_language_client():
+    from google.cloud import language_v1
+    return language_v1.LanguageServiceClient()
+
+
+def create_dlp_client():
+    from google.cloud import dlp_v2
+    return dlp_v2.DlpServiceClient()
+
+
+def create_documentai_client():
+    from google.cloud import documentai
+    return documentai.DocumentProcessorServiceClient(
+        client_options=ClientOptions(
+            api_endpoint=f"{LOCATION}-documentai.googleapis.com"))
+
+
+clients = ClientRegistry()
+clients.register("gcs", create_storage_client)
+clients.register("bq", create_bigquery_client)
+clients.register("language", create_language_client)
+clients.register("dlp", create_dlp_client)
+clients.register("docai", create_documentai_client)
+
+# PII handled by Google Cloud DLP, shared by every deidentification request
+DLP_PARENT = f"projects/{PROJECT_ID}/locations/global"
+DLP_INSPECT_CONFIG = {
+    "info_types": [
+        {"name": "PHONE_NUMBER"},
+        {"name": "EMAIL_ADDRESS"},
+        {"name": "PERSON_NAME"},
+        {"name": "LOCATION"},
+        {"name": "AGE"},
+    ]
+}
+DLP_DEIDENTIFY_CONFIG = {
+    "info_type_transformations": {
+        "transformations": [
+            {"primitive_transformation": {
+                "replace_with_info_type_config": {}}}
+        ]
+    }
+}
+
+# Salt and ester suffixes dropped to get the base name of a composition
+DRUG_SALT_SUFFIXES = [
+    "hydrochloride", "hcl", "hydrobromide", "sodium", "potassium", "calcium",
+    "magnesium", "sulfate", "sulphate", "phosphate", "maleate", "tartrate",
+    "citrate", "succinate", "fumarate", "mesylate", "besylate", "acetate",
+    "bromide", "chloride", "dihydrate", "monohydrate", "trihydrate",
+]
+DRUG_SALT_ABBREVIATIONS = {"hydrochloride": "hcl", "sulphate": "sulfate"}
+
+# Metadata tables and the bucket prefix each one describes
+META_TABLES = {
+    "raw_file_meta_direct": "",
+    "processed_meta_direct": "processed/",
+    "deidentified_meta_direct": "deidentified/",
+}
+DEIDENTIFIED_TEXT_SCHEMA = [
+    bigquery.SchemaField("filename", "STRING"),
+    bigquery.SchemaField("deidentified_text", "STRING"),
+    bigquery.SchemaField("recordstamp", "TIMESTAMP"),
+    bigquery.SchemaField("text_hash", "STRING"),
+    # zlib compressed text of documents over TEXT_COMPRESS_BYTES, which
+    # leave deidentified_text empty
+    bigquery.SchemaField("compressed_text", "BYTES"),
+]
+MEDICINES_SCHEMA = [
+    bigquery.SchemaField("filename", "STRING", mode="REQUIRED"),
+    # The analyzed text is the deidentified_text row with this hash
+    bigquery.SchemaField("text_hash", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("recordstamp", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("extracted_at", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("medicines", "RECORD", mode="REPEATED", fields=[
+        bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("count", "INTEGER", mode="REQUIRED"),
+        bigquery.SchemaField("offsets", "INTEGER", mode="REPEATED"),
+    ]),
+]
+META_SCHEMA = [
+    bigquery.SchemaField("filename", "STRING"),
+    bigquery.SchemaField("size", "INTEGER"),
+    bigquery.SchemaField("created", "TIMESTAMP"),
+    # Set on the row reconciliation appends for an object no longer in the bucket
+    bigquery.SchemaField("deleted", "BOOLEAN"),
+]
+# Stages with their own column in the per-file timings table
+TIMED_STAGES = ("upload_gcs_write", "cache_lookup", "image_preprocess", "docai", "dlp",
+                "gcs_write")
+TIMINGS_SCHEMA = [
+    bigquery.SchemaField("filename", "STRING"),
+    bigquery.SchemaField("sha256", "STRING"),
+    bigquery.SchemaField("mime_type", "STRING"),
+    bigquery.SchemaField("size", "INTEGER"),
+    bigquery.SchemaField("pages", "INTEGER"),
+    bigquery.SchemaField("ocr_input_size", "INTEGER"),
+    bigquery.SchemaField("status", "STRING"),
+    bigquery.SchemaField("queue_seconds", "FLOAT"),
+    bigquery.SchemaField("total_seconds", "FLOAT"),
+] + [bigquery.SchemaField(f"{stage}_seconds", "FLOAT") for stage in TIMED_STAGES] + [
+    bigquery.SchemaField("finished_at", "TIMESTAMP"),
+]
+
+# Sizes of the DIB header that follows the 14 byte header of a BMP file
+BMP_HEADER_SIZES = (12, 40, 52, 56, 64, 108, 124)
+# Mime types accepted by Document AI, keyed by file extension
+EXTENSION_MIME_TYPES = {
+    "pdf": "application/pdf",
+    "gif": "image/gif",
+    "tiff": "image/tiff",
+    "tif": "image/tiff",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "bmp": "image/bmp",
+    "webp": "image/webp",
+    "txt": "text/plain",
+}
+
+
+@dataclass
+class PipelineJob:
+    """A single uploaded file travelling through the pipeline"""
+    filename: str
+    content: bytes  # A bytearray for files streamed in by /upload
+    sha256: str
+    mime_type: str
+    size: int
+    id: Optional[str] = None
+    queued_at: float = 0.0
+    pages: int = 0
+    ocr_input_size: Optional[int] = None
+    timings: dict = field(default_factory=dict)
+
+
+def sniff_mime_type(head, filename=""):
+    """Guess the mime type from the leading bytes, falling back to the extension"""
+    if head.startswith(b"%PDF"):
+        return "application/pdf"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return "image/tiff"
+    # "BM" alone also starts text such as "BMI 31.2", check the DIB header size too
+    if head.startswith(b"BM") and int.from_bytes(head[14:18], "little") in BMP_HEADER_SIZES:
+        return "image/bmp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    extension = filename.split(".")[-1].lower()
+    if extension in EXTENSION_MIME_TYPES:
+        return EXTENSION_MIME_TYPES[extension]
+    try:
+        # A partial multi-byte character at the end of the sample is fine
+        head.decode("utf-8")
+        return "text/plain"
+    except UnicodeDecodeError as e:
+        if e.start >= len(head) - 3:
+            return "text/plain"
+    return "application/octet-stream"
+
+
+class Metric:
+    """Prometheus style metric with one series per label set"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}",
+                 f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for values, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{self._label_text(values)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self.series[values] = self.series.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    """Value read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels, callback):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def render(self):
+        with self._lock:
+            self.series = dict(self.callback())
+        return super().render()
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=(
+            0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *values):
+        with self._lock:
+            counts, total, count = self.series.get(values, ([0] * len(self.buckets), 0.0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.series[values] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}",
+                 f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self.series.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(
+                        f"{self.name}_bucket{self._label_text(values, [('le', bound)])} {bucket}")
+                lines.append(
+                    f"{self.name}_bucket{self._label_text(values, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{self._label_text(values)} {round(total, 6)}")
+                lines.append(f"{self.name}_count{self._label_text(values)} {count}")
+        return lines
+
+
+METRICS = []
+STAGE_SECONDS = Histogram(
+    "obscurer_stage_duration_seconds",
+    "Wall clock time spent in each pipeline stage", ("stage",))
+STAGE_WAIT_SECONDS = Histogram(
+    "obscurer_stage_wait_seconds",
+    "Time spent waiting for a stage concurrency slot", ("stage",))
+QUEUE_WAIT_SECONDS = Histogram(
+    "obscurer_queue_wait_seconds",
+    "Time files spend in the ingest queue before a worker picks them up")
+FILE_SECONDS = Histogram(
+    "obscurer_file_duration_seconds",
+    "Processing time of a file from worker pickup to deidentified output",
+    ("mime_type",))
+LOOP_LAG_SECONDS = Histogram(
+    "obscurer_event_loop_lag_seconds",
+    "Delay of the event loop in waking up a periodic timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+FILES_PROCESSED = Counter(
+    "obscurer_files_processed_total",
+    "Files that left the pipeline by outcome", ("mime_type", "status"))
+BYTES_PROCESSED = Counter(
+    "obscurer_bytes_processed_total",
+    "Uploaded bytes handled by the pipeline", ("mime_type",))
+PAGES_PROCESSED = Counter(
+    "obscurer_pages_processed_total",
+    "Pages returned by Document AI")
+PAGES_BY_PATH = Counter(
+    "obscurer_pages_by_path_total",
+    "Document pages by how their text was read, text_layer or ocr", ("path",))
+IMAGE_BYTES = Counter(
+    "obscurer_image_bytes_total",
+    "Bytes of pre-processed images before and after shrinking", ("version",))
+DOCAI_REQUESTS = Counter(
+    "obscurer_docai_requests_total",
+    "Document AI requests by processing mode", ("mode",))
+API_THROTTLED = Counter(
+    "obscurer_api_throttled_total",
+    "Calls rejected by a Google API for exceeding its quota", ("api",))
+API_RETRIES_TOTAL = Counter(
+    "obscurer_api_retries_total",
+    "Retried Google API calls by the error that caused the retry", ("api", "error"))
+
+
+@contextmanager
+def stage_timer(stage, timings=None):
+    """Time a block into the stage histogram and an optional per-file dict"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed, 6)
+
+
+class ResultCache:
+    """Two tier cache of OCR and deidentified text keyed by content hash.
+
+    Entries live on local disk under an LRU policy bounded by `max_bytes`
+    and are backed by objects under the `cache/` prefix of the bucket, so
+    duplicates are recognised across instances and restarts.
+    """
+
+    def __init__(self, directory, max_bytes, prefix, version):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.version = version
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.counters = {"local_hits": 0, "gcs_hits": 0, "misses": 0,
+                         "coalesced": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _key(self, sha256, kind):
+        return f"{self.version}-{sha256}-{kind}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def _load(self):
+        """Index what is already on disk, oldest access first"""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".txt"):
+                stat = entry.stat()
+                found.append((stat.st_atime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.counters["evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _store_local(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.total_bytes += len(data)
+            self._evict()
+
+    def get(self, sha256, kind):
+        """Return cached text or None, checking local disk then GCS"""
+        key = self._key(sha256, kind)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            local = key in self.entries
+            if local:
+                self.entries.move_to_end(key)
+        if local:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                with self._lock:
+                    self.counters["local_hits"] += 1
+                return data.decode("utf-8")
+            except FileNotFoundError:
+                with self._lock:
+                    self.total_bytes -= self.entries.pop(key, 0)
+        blob = clients.gcs.bucket(GCS_BUCKET).blob(f"{self.prefix}{key}.txt")
+        try:
+            data = blob.download_as_bytes()
+        except Exception as e:
+            if not isinstance(e, NotFound):
+                logger.error(f"CAUTION: Cache lookup failed for {key}: {e}")
+            with self._lock:
+                self.counters["misses"] += 1
+            return None
+        self._store_local(key, data)
+        with self._lock:
+            self.counters["gcs_hits"] += 1
+        return data.decode("utf-8")
+
+    def put(self, sha256, kind, text):
+        """Store text in both tiers"""
+        key = self._key(sha256, kind)
+        data = text.encode("utf-8")
+        with self._lock:
+            if not self._loaded:
+                self._load()
+        self._store_local(key, data)
+        blob = clients.gcs.bucket(GCS_BUCKET).blob(f"{self.prefix}{key}.txt")
+        try:
+            blob.upload_from_string(data, content_type="text/plain")
+        except Exception as e:
+            logger.error(f"CAUTION: Couldn't store cache entry {key}: {e}")
+        with self._lock:
+            self.counters["stores"] += 1
+
+    def count(self, counter):
+        """Increment one of the cache counters"""
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        """Hit/miss counters and local tier occupancy"""
+        with self._lock:
+            lookups = (self.counters["local_hits"] + self.counters["gcs_hits"]
+                       + self.counters["misses"])
+            hits = lookups - self.counters["misses"]
+            return dict(self.counters,
+                        hit_ratio=round(hits / lookups, 4) if lookups else 0.0,
+                        local_entries=len(self.entries),
+                        local_bytes=self.total_bytes,
+                        local_max_bytes=self.max_bytes)
+
+
+result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES,
+                           CACHE_PREFIX, CACHE_VERSION)
+
+
+RETRYABLE_ERRORS = (ResourceExhausted, TooManyRequests, ServiceUnavailable,
+                    DeadlineExceeded, InternalServerError)
+
+
+class RateGovernor:
+    """Paces the calls made to one Google API.
+
+    A token bucket holds the request rate under the known quota and a
+    concurrency limit is adjusted AIMD-style: it grows by one slot per
+    window of successful calls and is cut back when the API answers with
+    RESOURCE_EXHAUSTED. Latency well above the best seen only holds the
+    limit where it is, as a multi-page shard is slow without any congestion.
+    Throttled calls also cut the rate and mark just below it as a ceiling
+    the rate quickly climbs back to and only slowly probes past, so
+    throughput settles under the real limit instead of oscillating around
+    it. Transient errors are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, api, per_minute, max_concurrency):
+        self.api = api
+        self.quota = per_minute / 60
+        self.rate = self.quota
+        # Highest rate known to be safe, lowered when the API throttles
+        self.ceiling = self.quota
+        self.max_limit = max_concurrency
+        self.limit = float(max_concurrency)
+        self.inflight = 0
+        # Bursts are capped at one second of quota
+        self.burst = max(1.0, self.quota)
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.latency = None
+        self.best_latency = None
+        self.backed_off = 0.0
+        self.loop = None
+        self._slots = None
+
+    def start(self):
+        """Bind the governor to the running event loop"""
+        self.loop = asyncio.get_running_loop()
+        self._slots = asyncio.Condition()
+
+    async def call(self, run):
+        """Await `run()` under the limits, retrying transient errors"""
+        for attempt in range(API_RETRIES + 1):
+            await self._acquire()
+            start = time.monotonic()
+            try:
+                result = await run()
+            except RETRYABLE_ERRORS as e:
+                throttled = isinstance(e, (ResourceExhausted, TooManyRequests))
+                await self._release(time.monotonic() - start, throttled)
+                if attempt == API_RETRIES:
+                    raise
+                API_RETRIES_TOTAL.inc(self.api, type(e).__name__)
+                await asyncio.sleep(random.uniform(
+                    0, min(API_RETRY_MAX, API_RETRY_BASE * 2 ** attempt)))
+                continue
+            except BaseException:
+                await self._release(None, False)
+                raise
+            await self._release(time.monotonic() - start, False)
+            return result
+
+    def call_blocking(self, func, *args, **kwargs):
+        """Run a blocking call under the limits from a thread outside the loop"""
+        async def run():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(func, *args, **kwargs))
+        return asyncio.run_coroutine_threadsafe(self.call(run), self.loop).result()
+
+    async def _acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+        if not self.quota:
+            return
+        # Reserve the next token, sleeping until it has accumulated
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    async def _release(self, elapsed, throttled):
+        now = time.monotonic()
+        slow = False
+        if elapsed is not None and not throttled:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            # Let the baseline drift up slowly so one lucky call doesn't pin it
+            self.best_latency = min(self.best_latency or self.latency, self.latency) * 1.001
+            slow = self.latency > API_LATENCY_FACTOR * self.best_latency
+        if throttled:
+            if now - self.backed_off > (self.latency or 1.0):
+                # Back off at most once per round trip, in-flight calls share the signal
+                self.backed_off = now
+                API_THROTTLED.inc(self.api)
+                self.limit = max(1.0, self.limit * API_BACKOFF_FACTOR)
+                self.ceiling = max(self.quota * 0.05, self.rate * 0.95)
+                self.rate = max(self.quota * 0.05, self.rate * API_BACKOFF_FACTOR)
+                self.tokens = min(self.tokens, 0.0)
+                logger.info(
+                    f"ATTENTION: {self.api} quota exceeded, pacing at"
+                    f" {self.rate * 60:.0f}/min with {int(self.limit)} concurrent calls")
+        else:
+            if not slow:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if self.rate < self.ceiling:
+                # Recover quickly up to the last safe rate, then probe slowly above it
+                self.rate = min(self.ceiling, self.rate + self.quota / 20)
+            else:
+                self.ceiling = self.rate = min(self.quota, self.rate + self.quota / 500)
+        async with self._slots:
+            self.inflight -= 1
+            self._slots.notify_all()
+
+    def status(self):
+        return {"rate_per_minute": round(self.rate * 60, 1),
+                "quota_per_minute": round(self.quota * 60, 1),
+                "concurrency_limit": int(self.limit), "inflight": self.inflight}
+
+
+governors = {api: RateGovernor(api, API_QUOTAS[api], API_MAX_CONCURRENCY[api])
+             for api in API_QUOTAS}
+
+
+class PipelineExecutor:
+    """Bounded ingest queue drained by a fixed pool of workers.
+
+    Blocking SDK calls are run on a dedicated thread pool so that the event
+    loop keeps serving requests, and each stage has its own concurrency limit.
+    Stages calling a quota-limited API are paced by that API's governor.
+    """
+
+    def __init__(self, workers, queue_size, threads, stage_limits):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.threads = threads
+        self.stage_limits = stage_limits
+        self.queue = None
+        self.executor = None
+        self.semaphores = {}
+        self.busy = {stage: 0 for stage in stage_limits}
+        self.reserved = 0
+        self._tasks = []
+
+    async def start(self):
+        """Create the queue, thread pool and worker tasks on the running loop"""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix="pipeline")
+        self.semaphores = {stage: asyncio.Semaphore(limit)
+                           for stage, limit in self.stage_limits.items()}
+        for governor in governors.values():
+            governor.start()
+        self._tasks = [asyncio.create_task(self._worker(i))
+                       for i in range(self.workers)]
+        logger.info(
+            f"SUCCESS: Pipeline started with {self.workers} workers, queue size {self.queue_size}")
+
+    async def stop(self, timeout=60):
+        """Drain queued work for up to `timeout` seconds, then stop workers"""
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"CAUTION: Pipeline stopped with {self.queue.qsize()} files still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    def free_slots(self):
+        """Number of jobs that can still be queued without blocking"""
+        if self.queue is None:
+            return 0
+        return self.queue.maxsize - self.queue.qsize() - self.reserved
+
+    def try_reserve(self, count):
+        """Reserve queue slots for a batch; False when the queue is too full"""
+        if count > self.free_slots():
+            return False
+        self.reserved += count
+        return True
+
+    def release(self, count):
+        """Give back reserved slots that will not be used"""
+        self.reserved = max(0, self.reserved - count)
+
+    def submit(self, job):
+        """Queue a job using a slot previously taken with try_reserve"""
+        self.release(1)
+        job.queued_at = time.monotonic()
+        self.queue.put_nowait(job)
+
+    async def run_stage(self, stage, func, *args, timings=None, **kwargs):
+        """Run a blocking call on the pipeline pool under the stage's limit.
+
+        With `timings`, the call itself is timed under the stage's name,
+        without the time spent waiting for a slot.
+        """
+        loop = asyncio.get_running_loop()
+        waited = time.monotonic()
+
+        async def run():
+            STAGE_WAIT_SECONDS.observe(time.monotonic() - waited, stage)
+            self.busy[stage] += 1
+            try:
+                call = loop.run_in_executor(
+                    self.executor, functools.partial(func, *args, **kwargs))
+                if timings is None:
+                    return await call
+                with stage_timer(stage, timings):
+                    return await call
+            finally:
+                self.busy[stage] -= 1
+
+        if stage in governors:
+            return await governors[stage].call(run)
+        async with self.semaphores[stage]:
+            return await run()
+
+    def status(self):
+        """Snapshot of queue depth and stage occupancy"""
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "reserved": self.reserved,
+            "stages": {stage: {"busy": self.busy[stage], "limit": limit}
+                       for stage, limit in self.stage_limits.items()},
+            "apis": {api: governor.status() for api, governor in governors.items()},
+        }
+
+    async def _worker(self, worker_id):
+        """Pull jobs off the queue until cancelled"""
+        while True:
+            job = await self.queue.get()
+            job.timings["queue"] = round(time.monotonic() - job.queued_at, 6)
+            QUEUE_WAIT_SECONDS.observe(job.timings["queue"])
+            try:
+                await run_file_job(job)
+            except Exception as e:
+                logger.error(
+                    f"CAUTION: Pipeline worker {worker_id} failed on {job.filename}: {e}")
+            finally:
+                self.queue.task_done()
+
+
+class BigQueryWriter:
+    """Shared background writer that micro-batches rows per BigQuery table.
+
+    Rows are buffered per table and flushed when a row count, byte size or
+    time threshold is reached. Flushes use one streaming insert, or a load
+    job for large batches of tables with a registered schema, and only the
+    rows BigQuery reports as failed are retried.
+    """
+
+    def __init__(self, flush_rows, flush_bytes, flush_seconds, load_job_rows,
+                 max_retries):
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.load_job_rows = load_job_rows
+        self.max_retries = max_retries
+        self.buffers = {}
+        self.buffer_bytes = {}
+        self.schemas = {}
+        self.counters = {"rows": 0, "insert_requests": 0, "load_jobs": 0,
+                         "retried_rows": 0, "failed_rows": 0}
+        # Writes run on pool threads, the counters are shared with the loop
+        self._lock = threading.Lock()
+        self.listeners = []
+        self._task = None
+        self._flushes = set()
+
+    def add_listener(self, callback):
+        """Call `callback(table_id)` on the event loop after each flush"""
+        self.listeners.append(callback)
+
+    def register_schema(self, table_id, schema):
+        """Allow large flushes to this table to go through load jobs"""
+        self.schemas[table_id] = schema
+
+    def insert(self, table_id, row):
+        """Buffer a JSON-serializable row; must be called on the event loop"""
+        self.buffers.setdefault(table_id, []).append((str(uuid.uuid4()), row))
+        self.buffer_bytes[table_id] = (self.buffer_bytes.get(table_id, 0)
+                                       + len(json.dumps(row, default=str)))
+        if (len(self.buffers[table_id]) >= self.flush_rows
+                or self.buffer_bytes[table_id] >= self.flush_bytes):
+            task = asyncio.create_task(self.flush(table_id))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def flush(self, table_id=None):
+        """Write buffered rows of one or all tables"""
+        for name in [table_id] if table_id else list(self.buffers):
+            rows = self.buffers.pop(name, [])
+            self.buffer_bytes.pop(name, None)
+            if rows:
+                with stage_timer("bq_insert"):
+                    await run_blocking(self._write, name, rows)
+                for callback in self.listeners:
+                    callback(name)
+
+    def _write(self, table_id, rows):
+        """Blocking write of one batch with retries of the failed rows"""
+        with self._lock:
+            self.counters["rows"] += len(rows)
+        if len(rows) >= self.load_job_rows and table_id in self.schemas:
+            try:
+                self._load(table_id, [row for _, row in rows])
+                return
+            except Exception as e:
+                logger.error(
+                    f"CAUTION: Load job into {table_id} failed, streaming instead: {e}")
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self.counters["retried_rows"] += len(rows)
+                time.sleep(min(2 ** attempt, 30) * (0.5 + random.random() / 2))
+            try:
+                with self._lock:
+                    self.counters["insert_requests"] += 1
+                errors = clients.bq.insert_rows_json(
+                    table_id, [row for _, row in rows],
+                    row_ids=[row_id for row_id, _ in rows])
+            except Exception as e:
+                logger.error(
+                    f"CAUTION: Streaming insert into {table_id} failed: {e}")
+                continue
+            retry = []
+            for error in errors:
+                reasons = {item.get("reason") for item in error.get("errors", [])}
+                if reasons <= {"stopped", "backendError", "timeout"}:
+                    retry.append(rows[error["index"]])
+                else:
+                    with self._lock:
+                        self.counters["failed_rows"] += 1
+                    logger.error(
+                        f"CAUTION: Error occured while adding row to {table_id}: {error}")
+            if not retry:
+                logger.info(
+                    f"SUCCESS: Added {len(rows)} rows to {table_id}")
+                return
+            rows = retry
+        with self._lock:
+            self.counters["failed_rows"] += len(rows)
+        logger.error(
+            f"CAUTION: Gave up adding {len(rows)} rows to {table_id}")
+
+    def _load(self, table_id, rows):
+        job_config = bigquery.LoadJobConfig(
+            schema=self.schemas[table_id],
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+        load_job = clients.bq.load_table_from_json(
+            rows, table_id, job_config=job_config)
+        load_job.result()  # Wait for the job to complete
+        with self._lock:
+            self.counters["load_jobs"] += 1
+        logger.info(
+            f"SUCCESS: Loaded {len(rows)} rows into {table_id}")
+
+    async def start(self):
+        """Flush periodically in the background"""
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Stop the periodic flush and write what is left"""
+        if self._task:
+            self._task.cancel()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+    def status(self):
+        """Buffered rows per table and write counters"""
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(counters,
+                    buffered={name: len(rows)
+                              for name, rows in self.buffers.items()})
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"CAUTION: BigQuery writer flush failed: {e}")
+
+
+bq_writer = BigQueryWriter(BQ_FLUSH_ROWS, BQ_FLUSH_BYTES, BQ_FLUSH_SECONDS,
+                           BQ_LOAD_JOB_ROWS, BQ_MAX_RETRIES)
+
+
+class CoalescedTask:
+    """Run an async function in the background, folding bursts of requests.
+
+    Requests arriving while a run is scheduled are absorbed by it, and
+    requests arriving while it runs cause exactly one follow-up run.
+    """
+
+    def __init__(self, func, debounce):
+        self.func = func
+        self.debounce = debounce
+        self.running = False
+        self.pending = False
+        self.runs = 0
+
+    def request(self):
+        """Ask for a run without waiting for it"""
+        self.pending = True
+        if not self.running:
+            self.running = True
+            asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(self.debounce)
+                self.pending = False
+                self.runs += 1
+                await self.func()
+        finally:
+            self.running = False
+
+
+pipeline = PipelineExecutor(
+    PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE, PIPELINE_THREADS, STAGE_LIMITS)
+
+
+class PermanentJobError(Exception):
+    """A job failure that retrying can't fix"""
+
+
+# Failures that end a job at once instead of being retried
+PERMANENT_ERRORS = (PermanentJobError, UnicodeDecodeError, InvalidArgument, NotFound,
+                    tarfile.TarError, zipfile.BadZipFile)
+
+
+class JobStore:
+    """SQLite record of background jobs and the progress of their stages.
+
+    A job is written before its work starts and updated as each stage
+    runs, so a restarted process can resume what was queued, running or
+    waiting for a retry, and clients can follow a job through /jobs/{id}.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                next_attempt REAL NOT NULL)""")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS job_stages (
+                job_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempt INTEGER NOT NULL,
+                seconds REAL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (job_id, stage))""")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, next_attempt)")
+        logger.info(f"SUCCESS: Job store opened at {self.path}")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self.db.execute(query, params).fetchall()
+
+    def create(self, kind, name, payload=None, job_id=None):
+        """Store a new queued job and return its id"""
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, name, payload, state, created, updated, next_attempt)"
+            " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, name, json.dumps(payload or {}), now, now, now))
+        return job_id
+
+    def start(self, job_id):
+        """Mark a job running and count the attempt"""
+        self._execute(
+            "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ?"
+            " WHERE id = ?", (time.time(), job_id))
+
+    def stage(self, job_id, stage, state, seconds=None):
+        """Record the state of one stage of a job"""
+        self._execute(
+            "INSERT OR REPLACE INTO job_stages (job_id, stage, state, attempt, seconds, updated)"
+            " SELECT id, ?, ?, attempts, ?, ? FROM jobs WHERE id = ?",
+            (stage, state, None if seconds is None else round(seconds, 3),
+             time.time(), job_id))
+
+    def progress(self, job_id, payload):
+        """Replace the payload of a running job, e.g. with its progress and cursor"""
+        self._execute(
+            "UPDATE jobs SET payload = ?, updated = ? WHERE id = ?",
+            (json.dumps(payload), time.time(), job_id))
+
+    def file_hashes(self, prefix=""):
+        """(name, sha256, size) of the file jobs named under `prefix` that haven't failed"""
+        rows = self._execute(
+            "SELECT name, json_extract(payload, '$.sha256') AS sha256,"
+            " json_extract(payload, '$.size') AS size FROM jobs"
+            " WHERE kind = 'file' AND state != 'failed' AND substr(name, 1, ?) = ?",
+            (len(prefix), prefix))
+        return {(row["name"], row["sha256"], row["size"]) for row in rows}
+
+    def finish(self, job_id, state="done", error=None):
+        self._execute(
+            "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?",
+            (state, error, time.time(), job_id))
+
+    def fail(self, job_id, error, retryable=True):
+        """Schedule a retry with backoff, or fail the job when out of attempts.
+
+        Returns the delay before the retry, or None when the job failed.
+        """
+        attempts = self._execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,))[0][0]
+        if not retryable or attempts >= JOB_MAX_ATTEMPTS:
+            self.finish(job_id, "failed", str(error))
+            return None
+        delay = min(JOB_RETRY_BASE * 2 ** (attempts - 1), JOB_RETRY_MAX)
+        delay *= 0.5 + random.random() / 2
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET state = 'retrying', error = ?, updated = ?, next_attempt = ?"
+            " WHERE id = ?", (str(error), now, now + delay, job_id))
+        return delay
+
+    def due(self):
+        """Unfinished jobs whose next attempt is due, oldest first"""
+        rows = self._execute(
+            "SELECT * FROM jobs WHERE state IN ('queued', 'running', 'retrying')"
+            " AND next_attempt <= ? ORDER BY next_attempt", (time.time(),))
+        return [self._record(row) for row in rows]
+
+    def get(self, job_id):
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        record = self._record(rows[0])
+        record["stages"] = {
+            row["stage"]: {"state": row["state"], "attempt": row["attempt"],
+                           "seconds": row["seconds"],
+                           "updated": self._timestamp(row["updated"])}
+            for row in self._execute(
+                "SELECT * FROM job_stages WHERE job_id = ? ORDER BY rowid", (job_id,))}
+        return record
+
+    def counts(self):
+        if self.db is None:
+            return {}
+        return {row["state"]: row["jobs"] for row in self._execute(
+            "SELECT state, COUNT(*) AS jobs FROM jobs GROUP BY state")}
+
+    def purge(self, days):
+        """Delete finished jobs last updated more than `days` ago"""
+        cutoff = time.time() - days * 86400
+        self._execute(
+            "DELETE FROM job_stages WHERE job_id IN (SELECT id FROM jobs"
+            " WHERE state IN ('done', 'skipped', 'failed') AND updated < ?)", (cutoff,))
+        self._execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'skipped', 'failed') AND updated < ?",
+            (cutoff,))
+
+    @staticmethod
+    def _timestamp(seconds):
+        return datetime.datetime.fromtimestamp(
+            seconds, datetime.timezone.utc).isoformat()
+
+    def _record(self, row):
+        record = dict(row)
+        record["payload"] = json.loads(record["payload"])
+        for key in ("created", "updated", "next_attempt"):
+            record[key] = self._timestamp(record[key])
+        return record
+
+
+job_store = JobStore(JOB_DB_PATH)
+# Ids of jobs queued or running in this process
+active_jobs = set()
+
+
+@contextmanager
+def job_stage(job_id, stage):
+    """Record a stage of a stored job as running, then done or failed"""
+    job_store.stage(job_id, stage, "running")
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        job_store.stage(job_id, stage, "failed", time.monotonic() - start)
+        raise
+    job_store.stage(job_id, stage, "done", time.monotonic() - start)
+
+
+async def run_file_job(job):
+    """Process a queued file and record the outcome in the job store"""
+    job_store.start(job.id)
+    try:
+        status = await process_file(job)
+    except Exception as e:
+        delay = job_store.fail(job.id, e, not isinstance(e, PERMANENT_ERRORS))
+        if delay is None:
+            logger.error(f"CAUTION: Job {job.id} for '{job.filename}' failed: {e}")
+        else:
+            logger.info(
+                f"ATTENTION: Job {job.id} for '{job.filename}' will be retried in {delay:.0f}s: {e}")
+    else:
+        if status == "done":
+            job_store.finish(job.id)
+        else:
+            job_store.finish(job.id, "skipped", status)
+    finally:
+        active_jobs.discard(job.id)
+
+
+async def resume_file_job(record):
+    """Queue a stored file job again, reading the upload back from the bucket"""
+    payload = record["payload"]
+    content = None
+    try:
+        blob = clients.gcs.bucket(GCS_BUCKET).blob(record["name"])
+        content = await pipeline.run_stage("gcs", blob.download_as_bytes)
+    except NotFound:
+        job_store.finish(record["id"], "failed", "Uploaded file no longer exists")
+    except Exception as e:
+        logger.error(f"CAUTION: Couldn't resume job {record['id']}: {e}")
+        # The pipeline never starts this attempt, count it so the job runs out
+        job_store.start(record["id"])
+        job_store.fail(record["id"], e)
+    if content is not None and hashlib.sha256(content).hexdigest() != payload["sha256"]:
+        job_store.finish(record["id"], "skipped", "File was replaced by a newer upload")
+        content = None
+    if content is None:
+        pipeline.release(1)
+        active_jobs.discard(record["id"])
+        return
+    job = PipelineJob(id=record["id"], filename=record["name"], content=content,
+                      sha256=payload["sha256"], mime_type=payload["mime_type"],
+                      size=len(content))
+    logger.info(f"Resuming job {job.id} for '{job.filename}'")
+    pipeline.submit(job)
+
+
+async def run_background_job(record):
+    """Run a stored metadata or schema job and record the outcome"""
+    job_store.start(record["id"])
+    try:
+        await JOB_HANDLERS[record["kind"]](record)
+    except Exception as e:
+        delay = job_store.fail(record["id"], e, not isinstance(e, PERMANENT_ERRORS))
+        logger.error(
+            f"CAUTION: {record['kind']} job {record['id']} failed"
+            f"{'' if delay is None else f', retrying in {delay:.0f}s'}: {e}")
+    else:
+        job_store.finish(record["id"])
+    finally:
+        active_jobs.discard(record["id"])
+
+
+def start_background_job(kind, name, payload=None, job_id=None):
+    """Store a new metadata or schema job and start it"""
+    job_id = job_store.create(kind, name, payload, job_id)
+    active_jobs.add(job_id)
+    asyncio.create_task(run_background_job(job_store.get(job_id)))
+    return job_id
+
+
+async def dispatch_jobs():
+    """Start stored jobs that are due: retries and work left by an earlier process"""
+    purged = 0.0
+    while True:
+        try:
+            for record in job_store.due():
+                if record["id"] in active_jobs:
+                    continue
+                if record["kind"] != "file":
+                    active_jobs.add(record["id"])
+                    asyncio.create_task(run_background_job(record))
+                elif pipeline.try_reserve(1):
+                    active_jobs.add(record["id"])
+                    asyncio.create_task(resume_file_job(record))
+            if time.monotonic() - purged > 3600:
+                job_store.purge(JOB_KEEP_DAYS)
+                purged = time.monotonic()
+        except Exception as e:
+            logger.error(f"CAUTION: Job dispatch failed: {e}")
+        await asyncio.sleep(JOB_POLL_SECONDS)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call for a request handler on the default thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+async def start_pipeline():
+    """Start pipeline workers and background refreshers"""
+    cold_start["import"] = round(time.monotonic() - STARTED_AT, 3)
+    job_store.open()
+    bq_writer.register_schema(
+        f"{PROJECT_ID}.{BQ_DATASET}.deidentified_text", DEIDENTIFIED_TEXT_SCHEMA)
+    bq_writer.register_schema(
+        f"{PROJECT_ID}.{BQ_DATASET}.{TIMINGS_TABLE}", TIMINGS_SCHEMA)
+    await pipeline.start()
+    await bq_writer.start()
+    asyncio.create_task(refresh_drug_matcher())
+    asyncio.create_task(refresh_filename_index())
+    asyncio.create_task(monitor_loop_lag())
+    asyncio.create_task(warm_backends())
+    asyncio.create_task(dispatch_jobs())
+    asyncio.create_task(maintain_search_index())
+    if META_RECONCILE_SECONDS > 0:
+        asyncio.create_task(reconcile_metadata_periodically())
+    cold_start["startup"] = round(time.monotonic() - STARTED_AT, 3)
+    logger.info(
+        f"SUCCESS: Started {cold_start['startup']}s after process start")
+
+
+async def stop_pipeline():
+    """Drain and stop pipeline workers"""
+    await pipeline.stop()
+    await bq_writer.stop()
+    if search_index.ready:
+        try:
+            await run_blocking(search_index.flush)
+            await run_blocking(search_index.backup)
+        except Exception as e:
+            logger.error(f"CAUTION: Couldn't save search index: {e}")
+    job_store.close()
+    clients.close()
+    if image_pool is not None:
+        image_pool.shutdown(wait=False)
+
+
+# Seconds from process start to the end of each cold start phase
+cold_start = {}
+# Startup work besides client creation, with the seconds it took once done
+warmups = {"raw_files_schema": None, "metadata_tables": None}
+
+
+def fetch_raw_files_schema():
+    """Fetch the raw files table schema so the writer can use load jobs for it"""
+    table_ref = clients.bq.dataset(BQ_DATASET).table(PRIMARY_BQ_TABLE)
+    schema = clients.bq.get_table(table_ref).schema
+    bq_writer.register_schema(
+        f"{PROJECT_ID}.{BQ_DATASET}.{PRIMARY_BQ_TABLE}", schema)
+
+
+async def warm_backends():
+    """Create every client and run startup queries off the request path.
+
+    Failed steps are retried every WARMUP_RETRY_SECONDS, so a backend that
+    is down at startup does not stop the app from serving the others.
+    """
+    await asyncio.gather(*[run_blocking(clients.get, name)
+                           for name in clients.factories], return_exceptions=True)
+    steps = {"raw_files_schema": fetch_raw_files_schema,
+             "metadata_tables": create_metadata_tables}
+    while True:
+        for name, step in steps.items():
+            if warmups[name] is not None:
+                continue
+            started = time.monotonic()
+            try:
+                await run_blocking(step)
+                warmups[name] = round(time.monotonic() - started, 3)
+            except Exception as e:
+                logger.error(f"CAUTION: Couldn't warm up {name}: {e}")
+        for name in clients.factories:
+            if name not in clients.clients:
+                try:
+                    await run_blocking(clients.get, name)
+                except Exception as e:
+                    logger.error(f"CAUTION: Couldn't create {name} client: {e}")
+        if all(seconds is not None for seconds in warmups.values()) \
+                and len(clients.clients) == len(clients.factories):
+            cold_start["warm"] = round(time.monotonic() - STARTED_AT, 3)
+            logger.info(f"SUCCESS: All backends warm {cold_start['warm']}s after start")
+            return
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+
+class ColdStartTimer:
+    """ASGI middleware recording when the first request is answered"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "first_request" in cold_start:
+            return await self.app(scope, receive, send)
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start" and "first_request" not in cold_start:
+                cold_start["first_request"] = round(time.monotonic() - STARTED_AT, 3)
+                logger.info(
+                    f"SUCCESS: First request served {cold_start['first_request']}s after start")
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+app.add_middleware(ColdStartTimer)
+
+
+@app.get("/ready", tags=["Data Pipeline"], name="Backend Readiness")
+async def fetch_readiness():
+    """Endpoint is useful as a readiness check, 503 until every backend is warm"""
+    backends = clients.status()
+    for name, seconds in warmups.items():
+        backends[name] = {"ready": seconds is not None, "seconds": seconds}
+    backends["filename_index"] = {"ready": filename_index.ready}
+    backends["search_index"] = {"ready": search_index.ready}
+    ready = all(backend["ready"] for backend in backends.values())
+    return JSONResponse(
+        {"ready": ready, "backends": backends, "cold_start": cold_start},
+        status_code=200 if ready else 503)
+
+
+def record_upload(blob, filename, content_type, size):
+    """Queue the metadata rows of a file that was just stored in the bucket"""
+    record_metadata("raw_file_meta_direct", blob, size)
+    # Store metadata information in BigQuery
+    metadata = {
+        "uuid": str(uuid.uuid4()),
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "recordstamp": str(datetime.datetime.now()),
+        "operation": "I",
+    }
+    bq_writer.insert(
+        f"{PROJECT_ID}.{BQ_DATASET}.{PRIMARY_BQ_TABLE}", metadata)
+
+
+def queue_file_job(job, upload_seconds):
+    """Record a file job, then queue it on a slot taken with try_reserve"""
+    # Record the job before queueing so it survives a restart
+    job.id = job_store.create("file", job.filename, {
+        "sha256": job.sha256, "mime_type": job.mime_type, "size": job.size})
+    job_store.stage(job.id, "upload", "done", upload_seconds)
+    active_jobs.add(job.id)
+    # Hand the uploaded bytes straight over to the pipeline workers
+    pipeline.submit(job)
+
+
+async def stream_upload(file):
+    """Stream an uploaded file to Google Cloud Storage in a single pass.
+
+    The file is sent in UPLOAD_CHUNK_SIZE pieces through a resumable upload
+    while its SHA-256 and mime type are computed. Each piece is also copied
+    once into a buffer allocated at the upload's size, which is kept for the
+    processing stage so the bytes are not downloaded again.
+    """
+    digest = hashlib.sha256()
+    content = bytearray(file.size or 0)
+    size = 0
+    timings = {}
+    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    mime_type = sniff_mime_type(chunk[:512], file.filename)
+    blob = clients.gcs.bucket(GCS_BUCKET).blob(file.filename)
+    if not chunk:
+        with stage_timer("upload_gcs_write", timings):
+            await pipeline.run_stage(
+                "gcs", blob.upload_from_string, b"", content_type=mime_type)
+    else:
+        writer = blob.open(
+            "wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type=mime_type)
+        while chunk:
+            digest.update(chunk)
+            content[size:size + len(chunk)] = chunk
+            size += len(chunk)
+            with stage_timer("upload_gcs_write", timings):
+                await pipeline.run_stage("gcs", writer.write, chunk)
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        with stage_timer("upload_gcs_write", timings):
+            await pipeline.run_stage("gcs", writer.close)
+    # Only trims when the declared size was off
+    del content[size:]
+    record_upload(blob, file.filename, file.content_type or mime_type, size)
+    logger.info(
+        f"SUCCESS: '{file.filename}' uploaded to Google Cloud Storage")
+    return PipelineJob(filename=file.filename, content=content,
+                       sha256=digest.hexdigest(), mime_type=mime_type,
+                       size=size, timings=timings)
+
+
 @app.post("/upload", tags=["Data Pipeline"],
           name="Upload Multiple Files and Start Pipeline")
 async def upload_files(files: List[UploadFile] = File(...)):
     """Endpoint for uploading and start of data pipeline"""
+    if not pipeline.try_reserve(len(files)):
+        logger.info(
+            f"ATTENTION: Pipeline queue full, rejected batch of {len(files)} files")
+        raise HTTPException(
+            status_code=503,
+            detail="Processing queue is full. Please retry later",
+            headers={"Retry-After": str(PIPELINE_RETRY_AFTER)})
+    pending = len(files)
+    jobs = []
     try:
         for file in files:
             logger.info(f"Upload process started: {file.filename}")
-
-            # Store the uploaded file in Google Cloud Storage
-            blob = gcs_client.bucket(GCS_BUCKET).blob(file.filename)
-            blob.upload_from_file(file.file)
-            logger.info(
-                f"SUCCESS: '{file.filename}' uploaded to Google Cloud Storage")
-
-            # Store metadata information in BigQuery
-            metadata = {
-                "uuid": str(uuid.uuid4()),
-                "filename": file.filename,
-                "content_type": file.content_type,
-                "size": file.file.seek(0, os.SEEK_END),
-                "recordstamp": datetime.datetime.now(),
-                "operation": "I",
-            }
-            table = bq_client.dataset(BQ_DATASET).table(PRIMARY_BQ_TABLE)
-            row = (metadata,)
-            # Provide the table schema explicitly
-            bq_client.insert_rows(table, row, selected_fields=schema)
-
-            logger.info(
-                f"SUCCESS: Inserted metadata for file '{file.filename}' into BigQuery")
-
-            # Process the uploaded file asynchronously
-            asyncio.create_task(process_file(blob))
-        # Update Metadata info to BQ
-        asyncio.create_task(metadata_handler())
-        # Start Medicine Name Extraction Process
-        asyncio.create_task(analyze_and_insert_data())
-        return {"process": "Files uploaded and processing pipeline started."}
+            started = time.monotonic()
+            job = await stream_upload(file)
+            queue_file_job(job, time.monotonic() - started)
+            pending -= 1
+            jobs.append({"filename": job.filename, "job_id": job.id})
+        return {"process": "Files uploaded and processing pipeline started.",
+                "jobs": jobs}
     except Exception as e:
         logger.error(f"CAUTION: Error occured while upload: {e}")
         raise HTTPException(
             status_code=412,
             detail="Couldn't process request at this time. Please try again later")
+    finally:
+        pipeline.release(pending)
+
+
+@app.get("/pipeline_status", tags=["Data Pipeline"],
+         name="Pipeline Queue and Worker Status")
+async def fetch_pipeline_status():
+    """Endpoint is useful for checking queue depth and stage occupancy"""
+    return dict(pipeline.status(), jobs=job_store.counts())
+
+
+@app.get("/jobs/{job_id}", tags=["Data Pipeline"], name="Job Status and Stage Progress")
+async def fetch_job_status(job_id: str):
+    """Endpoint is useful for following an uploaded file or background job through its stages"""
+    record = job_store.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="No job found")
+    return record
+
+
+def archive_members(reader, archive_format, skip=0):
+    """Yield (name, content, None) for the regular files of a zip or tar archive.
+
+    Members are read one at a time from the stream, the first `skip` of
+    them were ingested by an earlier attempt and are passed over.
+    """
+    if archive_format == "zip":
+        with zipfile.ZipFile(reader) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir()]
+            for info in members[skip:]:
+                yield INGEST_ARCHIVE_NAME.sub("", info.filename), archive.read(info), None
+        return
+    # Stream mode reads the tar sequentially, compressed or not
+    with tarfile.open(fileobj=reader, mode="r|*") as archive:
+        index = 0
+        for member in archive:
+            if not member.isfile():
+                continue
+            if index >= skip:
+                yield INGEST_ARCHIVE_NAME.sub("", member.name), archive.extractfile(member).read(), None
+            index += 1
+
+
+def bucket_objects(bucket_name, prefix, start_offset=None):
+    """Yield (name, None, blob) for the objects under a prefix, in name order"""
+    bucket = clients.gcs.bucket(bucket_name)
+    for blob in bucket.list_blobs(prefix=prefix or None, start_offset=start_offset):
+        if blob.name != start_offset and not blob.name.endswith("/"):
+            yield blob.name, None, blob
+
+
+def ingest_source(payload):
+    """Iterator over the files of an ingest job, resuming after its progress"""
+    if payload["source"] == "bucket":
+        return bucket_objects(payload["bucket"], payload["prefix"], payload.get("cursor"))
+    reader = clients.gcs.bucket(GCS_BUCKET).blob(payload["archive"]).open(
+        "rb", chunk_size=UPLOAD_CHUNK_SIZE)
+    return archive_members(reader, payload["format"], payload["progress"]["seen"])
+
+
+def next_ingest_batch(files):
+    """Take up to INGEST_BATCH_FILES files, or fewer once they reach INGEST_BATCH_BYTES"""
+    batch = []
+    size = 0
+    for name, content, source in files:
+        batch.append((name, content, source))
+        # Bucket objects are downloaded later, count them at their listed size
+        size += len(content) if content is not None else source.size or 0
+        if len(batch) >= min(INGEST_BATCH_FILES, pipeline.queue_size) or size >= INGEST_BATCH_BYTES:
+            break
+    return batch
+
+
+def ingested_files(prefix=""):
+    """(name, sha256, size) of files named under `prefix` already uploaded that didn't fail processing"""
+    known = job_store.file_hashes(prefix)
+    rows = run_query(
+        f"SELECT DISTINCT filename, sha256, size FROM `{PROJECT_ID}.{BQ_DATASET}.{TIMINGS_TABLE}`"
+        " WHERE status != 'failed' AND STARTS_WITH(filename, @prefix)",
+        bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("prefix", "STRING", prefix)]))
+    known.update((row["filename"], row["sha256"], row["size"]) for row in rows)
+    return known
+
+
+async def ingest_file(name, content, source, mime_type, sha256):
+    """Store one file of a bulk ingest in the bucket and queue its job"""
+    started = time.monotonic()
+    timings = {}
+    blob = clients.gcs.bucket(GCS_BUCKET).blob(name)
+    with stage_timer("upload_gcs_write", timings):
+        if source is None:
+            await pipeline.run_stage(
+                "gcs", blob.upload_from_string, content, content_type=mime_type)
+        elif source.bucket.name != GCS_BUCKET:
+            # Copy between buckets server side instead of uploading the bytes again
+            await pipeline.run_stage(
+                "gcs", source.bucket.copy_blob, source, clients.gcs.bucket(GCS_BUCKET), name)
+    record_upload(blob, name, mime_type, len(content))
+    queue_file_job(PipelineJob(filename=name, content=content, sha256=sha256,
+                               mime_type=mime_type, size=len(content), timings=timings),
+                   time.monotonic() - started)
+
+
+async def run_ingest_job(record):
+    """Job handler for a bulk ingest, feeding the pipeline batch by batch.
+
+    Files already ingested with the same name and content are skipped.
+    Bucket objects with the name and size of an ingested file are skipped
+    before they are downloaded. The progress stored after each batch lets a
+    retried job carry on from where the last attempt stopped.
+    """
+    payload = record["payload"]
+    progress = payload.setdefault("progress", {
+        "seen": 0, "queued": 0, "skipped": 0, "reserved": 0, "unsupported": 0, "bytes": 0})
+    # Loaded once, one query per batch adds up over a large backfill
+    ingested = await run_blocking(ingested_files, payload.get("prefix") or "")
+    known = {(name, sha256) for name, sha256, _ in ingested}
+    known_sizes = {(name, size) for name, _, size in ingested}
+    files = await run_blocking(ingest_source, payload)
+    try:
+        while True:
+            batch = await run_blocking(next_ingest_batch, files)
+            if not batch:
+                break
+            fetched = [(name, content, source) for name, content, source in batch
+                       if content is not None or (name, source.size) not in known_sizes]
+            progress["skipped"] += len(batch) - len(fetched)
+            sources = [source for _, content, source in fetched if content is None]
+            if sources:
+                downloaded = iter(await asyncio.gather(*[
+                    pipeline.run_stage("gcs", source.download_as_bytes) for source in sources]))
+                fetched = [(name, next(downloaded) if content is None else content, source)
+                           for name, content, source in fetched]
+            hashes = await run_blocking(
+                lambda: [hashlib.sha256(content).hexdigest() for _, content, _ in fetched])
+            accepted = []
+            for (name, content, source), sha256 in zip(fetched, hashes):
+                mime_type = sniff_mime_type(content[:512], name)
+                if (name, sha256) in known:
+                    progress["skipped"] += 1
+                elif name.startswith(RESERVED_PREFIXES):
+                    progress["reserved"] += 1
+                elif (mime_type != "text/plain"
+                      and mime_type not in EXTENSION_MIME_TYPES.values()):
+                    progress["unsupported"] += 1
+                else:
+                    known.add((name, sha256))
+                    known_sizes.add((name, len(content)))
+                    accepted.append((name, content, source, mime_type, sha256))
+            # Wait for room in the queue so a backfill runs at pipeline speed
+            while accepted and not pipeline.try_reserve(len(accepted)):
+                await asyncio.sleep(INGEST_POLL_SECONDS)
+            results = await asyncio.gather(
+                *[ingest_file(*entry) for entry in accepted], return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                # Files that failed never used their slot, the batch is retried
+                pipeline.release(len(errors))
+                raise errors[0]
+            # Metadata rows are written once per batch
+            for table_name in (PRIMARY_BQ_TABLE, "raw_file_meta_direct"):
+                await bq_writer.flush(f"{PROJECT_ID}.{BQ_DATASET}.{table_name}")
+            progress["seen"] += len(batch)
+            progress["queued"] += len(accepted)
+            progress["bytes"] += sum(len(entry[1]) for entry in accepted)
+            if payload["source"] == "bucket":
+                payload["cursor"] = batch[-1][0]
+            job_store.progress(record["id"], payload)
+            logger.info(f"Ingest {record['id']} progress: {progress}")
+    finally:
+        await run_blocking(files.close)
+    if payload["source"] == "archive":
+        await pipeline.run_stage(
+            "gcs", clients.gcs.bucket(GCS_BUCKET).blob(payload["archive"]).delete)
+    logger.info(f"SUCCESS: Ingest {record['id']} finished: {progress}")
+
+
+def check_archive(file):
+    """Format of an uploaded archive, zip or tar, raising if it is neither"""
+    head = file.read(4)
+    file.seek(0)
+    if head == b"PK\x03\x04":
+        return "zip"
+    # Raises tarfile.ReadError unless the first member header can be read
+    with tarfile.open(fileobj=file, mode="r|*") as archive:
+        archive.next()
+    file.seek(0)
+    return "tar"
+
+
+@app.post("/ingest", tags=["Data Pipeline"], name="Bulk Ingest an Archive or Bucket Prefix")
+async def bulk_ingest(archive: Optional[UploadFile] = File(None),
+                      source_bucket: Optional[str] = None, prefix: str = ""):
+    """Endpoint for backfills of a zip/tar archive or every object under a bucket prefix"""
+    if (archive is None) == (source_bucket is None):
+        raise HTTPException(
+            status_code=400, detail="Send either an archive or a source_bucket")
+    job_id = str(uuid.uuid4())
+    try:
+        if archive is not None:
+            try:
+                archive_format = await run_blocking(check_archive, archive.file)
+            except tarfile.TarError:
+                raise HTTPException(
+                    status_code=400, detail="Archive must be a zip or tar file")
+            name = f"{INGEST_PREFIX}{job_id}/{archive.filename}"
+            blob = clients.gcs.bucket(GCS_BUCKET).blob(name, chunk_size=UPLOAD_CHUNK_SIZE)
+            await pipeline.run_stage("gcs", blob.upload_from_file, archive.file)
+            payload = {"source": "archive", "archive": name, "format": archive_format}
+            label = archive.filename
+        else:
+            payload = {"source": "bucket", "bucket": source_bucket, "prefix": prefix}
+            label = f"gs://{source_bucket}/{prefix}"
+        start_background_job("ingest", label, payload, job_id)
+        logger.info(f"Bulk ingest {job_id} started for {label}")
+        return {"process": "Bulk ingest started. Please check progress in sometime.",
+                "job_id": job_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"CAUTION: Error occured while starting bulk ingest: {e}")
+        raise HTTPException(
+            status_code=412,
+            detail="Couldn't process request at this time. Please try again later")
+
 
+def run_ocr(content, mime_type):
+    """Extract text and page count from a PDF or image with Document AI"""
+    from google.cloud import documentai
+    # Load Binary Data into Document AI RawDocument Object, which only
+    # takes bytes while uploads arrive as a bytearray
+    raw_document = documentai.RawDocument(
+        content=bytes(content), mime_type=mime_type)
 
-async def process_file(blob):
-    """Data Pipeline Process"""
+    # Configure the process request
+    RESOURCE_NAME = clients.docai.processor_path(
+        PROJECT_ID, LOCATION, PROCESSOR_ID)
+    request = documentai.ProcessRequest(
+        name=RESOURCE_NAME, raw_document=raw_document)
+
+    # Use the Document AI client to process the document
+    result = clients.docai.process_document(request=request)
+    DOCAI_REQUESTS.inc("online")
+    return result.document.text, len(result.document.pages)
+
+
+def split_document(content, mime_type):
+    """Split a document into segments that are read locally or OCRed.
+
+    Returns the page count, or None when it can't be read locally, and the
+    segments in page order: text taken from a PDF's text layer, or bytes of
+    at most DOCAI_SHARD_PAGES pages for Document AI. Scanned documents that
+    fit one request are returned whole.
+    """
     try:
-        logger.info(f"Currently processing file: {blob.name}")
-        # Read the file into memory
-        image_content = blob.download_as_bytes()
+        if mime_type == "application/pdf":
+            return split_pdf(content)
+        if mime_type == "image/tiff":
+            return split_tiff(content)
+    except ImportError as e:
+        logger.info(f"ATTENTION: Page sharding unavailable, {e}")
+    except Exception as e:
+        logger.error(f"CAUTION: Couldn't split {mime_type} document: {e}")
+    return None, [content]
 
-        # Determine the file extension from the blob name
-        file_extension = blob.name.split(".")[-1].lower()
 
-        # Skip Document AI processing for .txt files
-        if file_extension == "txt":
-            # Read the file content
-            text_content = blob.download_as_text()
-
-            # Remove PII information using Google Cloud DLP
-            dlp_request = {
-                "parent": f"projects/{PROJECT_ID}/locations/global",
-                "item": {"value": text_content},
-                "inspect_config": {
-                    "info_types": [
-                        {"name": "PHONE_NUMBER"},
-                        {"name": "EMAIL_ADDRESS"},
-                        {"name": "PERSON_NAME"},
-                        {"name": "LOCATION"},
-                        {"name": "AGE"},
-                    ]
-                },
-                "deidentify_config": {
-                    "info_type_transformations": {
-                        "transformations": [
-                            {"primitive_transformation": {
-                                "replace_with_info_type_config": {}}}
-                        ]
-                    }
-                },
-            }
-            dlp_response = dlp_client.deidentify_content(dlp_request)
-            deidentified_text = dlp_response.item.value
-
-            # Store the deidentified text in a different folder in the same
-            # bucket
-            deidentified_blob = gcs_client.bucket(
-                GCS_BUCKET).blob(f"deidentified/{blob.name}.txt")
-            deidentified_blob.upload_from_string(deidentified_text)
-            send_text_bq(blob.name, deidentified_text)
+def page_text(page):
+    """Text of a PDF page's text layer, or None when it looks scanned"""
+    try:
+        text = page.extract_text() or ""
+    except Exception:
+        return None
+    if len("".join(text.split())) < PDF_TEXT_MIN_CHARS:
+        return None
+    return text
+
+
+def split_pdf(content):
+    from pypdf import PdfReader, PdfWriter
+    reader = PdfReader(io.BytesIO(content))
+    if reader.is_encrypted:
+        reader.decrypt("")
+    count = len(reader.pages)
+    with stage_timer("text_layer"):
+        texts = ([page_text(page) for page in reader.pages] if PDF_TEXT_LAYER
+                 else [None] * count)
+    if count <= DOCAI_SHARD_PAGES and not any(texts):
+        return count, [content]
+
+    segments = []
+    scanned = []
+
+    def add_scanned():
+        for start in range(0, len(scanned), DOCAI_SHARD_PAGES):
+            writer = PdfWriter()
+            for scanned_page in scanned[start:start + DOCAI_SHARD_PAGES]:
+                writer.add_page(scanned_page)
+            output = io.BytesIO()
+            writer.write(output)
+            segments.append(output.getvalue())
+        scanned.clear()
+
+    for page, text in zip(reader.pages, texts):
+        if text is None:
+            scanned.append(page)
+        else:
+            add_scanned()
+            segments.append(text)
+    add_scanned()
+    return count, segments
+
+
+def split_tiff(content):
+    from PIL import Image, ImageSequence
+    with Image.open(io.BytesIO(content)) as image:
+        count = getattr(image, "n_frames", 1)
+        if count <= DOCAI_SHARD_PAGES:
+            return count, [content]
+        frames = [frame.copy() for frame in ImageSequence.Iterator(image)]
+    shards = []
+    for start in range(0, count, DOCAI_SHARD_PAGES):
+        output = io.BytesIO()
+        first, *rest = frames[start:start + DOCAI_SHARD_PAGES]
+        first.save(output, format="TIFF", save_all=True, append_images=rest,
+                   compression="tiff_lzw")
+        shards.append(output.getvalue())
+    return count, shards
+
+
+def run_batch_ocr(job):
+    """OCR a document stored in the bucket with a Document AI batch operation.
+
+    Results are written as JSON shards under DOCAI_BATCH_PREFIX, read back
+    in page order and removed. Shards left by an earlier attempt that failed
+    are removed first, so they aren't read back with the new ones.
+    """
+    from google.cloud import documentai
+    output_prefix = f"{DOCAI_BATCH_PREFIX}{job.sha256}/"
+    bucket = clients.gcs.bucket(GCS_BUCKET)
+    for blob in bucket.list_blobs(prefix=output_prefix):
+        blob.delete()
+    request = documentai.BatchProcessRequest(
+        name=clients.docai.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID),
+        input_documents=documentai.BatchDocumentsInputConfig(
+            gcs_documents=documentai.GcsDocuments(documents=[documentai.GcsDocument(
+                gcs_uri=f"gs://{GCS_BUCKET}/{job.filename}", mime_type=job.mime_type)])),
+        document_output_config=documentai.DocumentOutputConfig(
+            gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(
+                gcs_uri=f"gs://{GCS_BUCKET}/{output_prefix}")))
+    operation = clients.docai.batch_process_documents(request=request)
+    operation.result(timeout=DOCAI_BATCH_TIMEOUT)
+    DOCAI_REQUESTS.inc("batch")
+
+    blobs = [blob for blob in bucket.list_blobs(prefix=output_prefix)
+             if blob.name.endswith(".json")]
+    # Shards are named <document>-<n>.json, n counting from 0
+    blobs.sort(key=lambda blob: int(re.search(r"(\d+)\.json$", blob.name).group(1)))
+    texts = []
+    pages = 0
+    for blob in blobs:
+        document = documentai.Document.from_json(
+            blob.download_as_bytes(), ignore_unknown_fields=True)
+        texts.append(document.text)
+        pages += len(document.pages)
+        blob.delete()
+    logger.info(
+        f"SUCCESS: Batch OCR of '{job.filename}' returned {pages} pages in {len(blobs)} shards")
+    return "".join(texts), pages
+
+
+image_pool = None
+
+
+def shrink_image(content, mime_type):
+    """Downscale, grayscale and recompress an image for OCR.
+
+    Runs in the image process pool. Returns the smallest lossless encoding,
+    or JPEG for JPEG sources, unless the original is smaller already.
+    """
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(content)) as original:
+        if getattr(original, "n_frames", 1) > 1:
+            return content, mime_type
+        dpi = original.info.get("dpi", (0, 0))[0] or 0
+        image = ImageOps.exif_transpose(original)
+        scale = IMAGE_TARGET_DPI / dpi if dpi > IMAGE_TARGET_DPI else 1.0
+        scale = min(scale, IMAGE_MAX_SIDE / max(image.size))
+        if image.mode != "1":
+            image = image.convert("L")
+        if scale < 1:
+            image = image.resize((max(1, round(image.width * scale)),
+                                  max(1, round(image.height * scale))), Image.LANCZOS)
+        candidates = []
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        candidates.append((output.getvalue(), "image/png"))
+        if mime_type == "image/jpeg":
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=90, optimize=True)
+            candidates.append((output.getvalue(), "image/jpeg"))
+    smallest = min(candidates, key=lambda candidate: len(candidate[0]))
+    if len(smallest[0]) >= len(content):
+        return content, mime_type
+    return smallest
+
+
+async def preprocess_image(job):
+    """Bytes and mime type of the job's image to send to Document AI"""
+    if (not IMAGE_PREPROCESS or not job.mime_type.startswith("image/")
+            or job.size < IMAGE_MIN_BYTES):
+        return job.content, job.mime_type
+    global image_pool
+    if image_pool is None:
+        # Spawned workers don't inherit the gRPC channels of this process
+        image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        with stage_timer("image_preprocess", job.timings):
+            content, mime_type = await asyncio.get_running_loop().run_in_executor(
+                image_pool, shrink_image, job.content, job.mime_type)
+    except Exception as e:
+        logger.error(f"CAUTION: Couldn't preprocess image '{job.filename}': {e}")
+        return job.content, job.mime_type
+    job.ocr_input_size = len(content)
+    IMAGE_BYTES.inc("original", amount=job.size)
+    IMAGE_BYTES.inc("preprocessed", amount=len(content))
+    if len(content) < job.size:
+        logger.info(
+            f"SUCCESS: Reduced '{job.filename}' from {job.size} to {len(content)} bytes for OCR")
+    return content, mime_type
+
+
+async def ocr_document(job):
+    """Text of a job's document from its PDF text layer and Document AI.
+
+    Images are shrunk first. Scanned pages are OCRed in concurrent page
+    shards and the results are put back in page order between the locally
+    extracted pages. Only the Document AI calls are timed as docai, summed
+    over the shards.
+    """
+    content, mime_type = await preprocess_image(job)
+    pages, segments = await run_blocking(split_document, content, mime_type)
+    local_pages = sum(isinstance(segment, str) for segment in segments)
+    if local_pages:
+        PAGES_BY_PATH.inc("text_layer", amount=local_pages)
+    if DOCAI_BATCH_PAGES and pages and not local_pages and pages >= DOCAI_BATCH_PAGES:
+        text, ocr_pages = await pipeline.run_stage(
+            "docai", run_batch_ocr, job, timings=job.timings)
+        PAGES_BY_PATH.inc("ocr", amount=ocr_pages)
+        return text, ocr_pages
+    shards = [segment for segment in segments if not isinstance(segment, str)]
+    if len(shards) > 1 or local_pages:
+        logger.info(
+            f"Read {local_pages} pages of '{job.filename}' locally, OCR in {len(shards)} shards")
+    results = iter(await asyncio.gather(*[
+        pipeline.run_stage("docai", run_ocr, shard, mime_type, timings=job.timings)
+        for shard in shards]))
+    texts = []
+    ocr_pages = 0
+    for segment in segments:
+        if isinstance(segment, str):
+            texts.append(segment)
+        else:
+            text, shard_pages = next(results)
+            texts.append(text)
+            ocr_pages += shard_pages
+    if ocr_pages:
+        PAGES_BY_PATH.inc("ocr", amount=ocr_pages)
+    return "\n".join(texts), local_pages + ocr_pages
+
+
+def run_dlp(text_content):
+    """Remove PII information using Google Cloud DLP"""
+    dlp_request = {
+        "parent": DLP_PARENT,
+        "item": {"value": text_content},
+        "inspect_config": DLP_INSPECT_CONFIG,
+        "deidentify_config": DLP_DEIDENTIFY_CONFIG,
+    }
+    dlp_response = clients.dlp.deidentify_content(dlp_request)
+    return dlp_response.item.value
+
+
+def run_dlp_table(texts):
+    """Deidentify several texts with one DLP request, one table row per text"""
+    dlp_request = {
+        "parent": DLP_PARENT,
+        "item": {"table": {
+            "headers": [{"name": "text"}],
+            "rows": [{"values": [{"string_value": text}]} for text in texts],
+        }},
+        "inspect_config": DLP_INSPECT_CONFIG,
+        "deidentify_config": DLP_DEIDENTIFY_CONFIG,
+    }
+    dlp_response = clients.dlp.deidentify_content(dlp_request)
+    return [row.values[0].string_value
+            for row in dlp_response.item.table.rows]
+
+
+def run_dlp_inspect(text_content):
+    """Find PII in a text as (start, end, info_type) codepoint ranges.
+
+    Also returns whether DLP truncated the findings list.
+    """
+    dlp_request = {
+        "parent": DLP_PARENT,
+        "item": {"value": text_content},
+        "inspect_config": dict(DLP_INSPECT_CONFIG,
+                               limits={"max_findings_per_request": 2000}),
+    }
+    dlp_response = clients.dlp.inspect_content(dlp_request)
+    findings = [(finding.location.codepoint_range.start,
+                 finding.location.codepoint_range.end,
+                 finding.info_type.name)
+                for finding in dlp_response.result.findings]
+    return findings, dlp_response.result.findings_truncated
+
+
+def split_text(text, chunk_chars, overlap):
+    """Split text on safe boundaries into (core_start, core_end) ranges.
+
+    Cores cover the text without gaps; callers widen each core by `overlap`
+    characters on both sides so findings across a boundary are still seen.
+    """
+    ranges = []
+    start = 0
+    limit = chunk_chars - 2 * overlap
+    while len(text) - start > limit:
+        window = text[start + limit // 2:start + limit]
+        cut = -1
+        for separator in ("\n\n", "\n", ". ", " "):
+            cut = window.rfind(separator)
+            if cut != -1:
+                cut += len(separator)
+                break
+        end = start + limit // 2 + cut if cut != -1 else start + limit
+        ranges.append((start, end))
+        start = end
+    ranges.append((start, len(text)))
+    return ranges
+
+
+def replace_findings(text, findings):
+    """Replace PII findings with their info type, as DLP would.
+
+    Overlapping findings are merged into one replacement labelled with the
+    info type of the finding that starts first.
+    """
+    output = []
+    position = 0
+    for start, end, info_type in sorted(findings, key=lambda f: (f[0], -f[1])):
+        if start < position:
+            position = max(position, end)
+            continue
+        output.append(text[position:start])
+        output.append(f"[{info_type}]")
+        position = end
+    output.append(text[position:])
+    return "".join(output)
+
+
+class DlpBatcher:
+    """Coalesce small texts from concurrent jobs into table item requests"""
+
+    def __init__(self, max_items, max_bytes, linger):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self.pending = []
+        self.pending_bytes = 0
+        self._timer = None
+
+    async def submit(self, text):
+        """Queue a text for the next batch and wait for its deidentified form"""
+        future = asyncio.get_running_loop().create_future()
+        size = len(text.encode("utf-8"))
+        if self.pending and self.pending_bytes + size > self.max_bytes:
+            self._flush()
+        self.pending.append((text, future))
+        self.pending_bytes += size
+        if len(self.pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.pending:
+            batch, self.pending, self.pending_bytes = self.pending, [], 0
+            asyncio.create_task(self._send(batch))
+
+    async def _send(self, batch):
+        try:
+            texts = [text for text, _ in batch]
+            results = await pipeline.run_stage("dlp", run_dlp_table, texts)
+            logger.info(
+                f"SUCCESS: Deidentified {len(batch)} small texts in one DLP request")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+dlp_batcher = DlpBatcher(
+    DLP_BATCH_MAX_ITEMS, DLP_MAX_REQUEST_BYTES, DLP_BATCH_LINGER)
+
+
+async def deidentify_text(text_content):
+    """Deidentify a text of any size with as few DLP round-trips as possible.
+
+    Small texts share table requests with other jobs and medium texts go
+    out in a single deidentify request. Large texts are not deidentified
+    chunk by chunk, since overlapping chunks would be replaced twice: they
+    are inspected as overlapping chunks in parallel, and the findings are
+    replaced locally with their info type, as DLP_DEIDENTIFY_CONFIG does.
+    """
+    size = len(text_content.encode("utf-8"))
+    if size <= DLP_BATCH_TEXT_BYTES:
+        return await dlp_batcher.submit(text_content)
+    if size <= DLP_MAX_REQUEST_BYTES:
+        return await pipeline.run_stage("dlp", run_dlp, text_content)
+
+    ranges = split_text(text_content, DLP_CHUNK_CHARS, DLP_CHUNK_OVERLAP)
+    results = await asyncio.gather(*[
+        inspect_range(text_content, start, end) for start, end in ranges])
+    findings = set()
+    for chunk_findings in results:
+        findings.update(chunk_findings)
+    logger.info(
+        f"SUCCESS: Deidentified {size} bytes in {len(ranges)} parallel DLP chunks")
+    return replace_findings(text_content, findings)
+
+
+async def inspect_range(text_content, start, end):
+    """Inspect text[start:end] plus overlap and return findings in text offsets.
+
+    Ranges with more findings than one response holds are split in halves
+    until they fit, a range too small to split fails the job rather than
+    leaving PII in the text.
+    """
+    window_start = max(0, start - DLP_CHUNK_OVERLAP)
+    window_end = min(len(text_content), end + DLP_CHUNK_OVERLAP)
+    chunk_findings, truncated = await pipeline.run_stage(
+        "dlp", run_dlp_inspect, text_content[window_start:window_end])
+    if truncated:
+        if end - start <= 4 * DLP_CHUNK_OVERLAP:
+            raise PermanentJobError(
+                f"DLP findings of characters {start}-{end} exceed one response")
+        # Too many findings for one response, inspect both halves instead
+        middle = start + (end - start) // 2
+        halves = await asyncio.gather(
+            inspect_range(text_content, start, middle),
+            inspect_range(text_content, middle, end))
+        return halves[0] | halves[1]
+    return {(window_start + finding_start, window_start + finding_end, info_type)
+            for finding_start, finding_end, info_type in chunk_findings}
+
+
+inflight_results = {}
+
+
+async def cached_stage(job, kind, compute):
+    """Return the cached result for the job's content, running the stage on a miss.
+
+    Duplicates being processed at the same time wait for the first one
+    instead of calling the API again.
+    """
+    key = (job.sha256, kind)
+    if key in inflight_results:
+        logger.info(f"Waiting for in-flight {kind} result for '{job.filename}'")
+        result_cache.count("coalesced")
+        return await asyncio.shield(inflight_results[key])
+    future = asyncio.get_running_loop().create_future()
+    inflight_results[key] = future
+    try:
+        with stage_timer("cache_lookup", job.timings):
+            result = await pipeline.run_stage(
+                "gcs", result_cache.get, job.sha256, kind)
+        if result is not None:
             logger.info(
-                f"SUCCESS: Stored deidentified text for file '{blob.name}' in Google Cloud Storage")
+                f"SUCCESS: Reused cached {kind} result for '{job.filename}'")
         else:
-            mime_type = ""
-            # Set the mime_type based on the file extension
-            if file_extension == "pdf":
-                mime_type = "application/pdf"
-            elif file_extension == "gif":
-                mime_type = "image/gif"
-            elif file_extension in ["tiff", "tif"]:
-                mime_type = "image/tiff"
-            elif file_extension in ["jpg", "jpeg"]:
-                mime_type = "image/jpeg"
-            elif file_extension == "png":
-                mime_type = "image/png"
-            elif file_extension == "bmp":
-                mime_type = "image/bmp"
-            elif file_extension == "webp":
-                mime_type = "image/webp"
-            else:
-                logger.error(
-                    f"CAUTION: Unsupported file type: {file_extension}")
-                return
-
-            # Load Binary Data into Document AI RawDocument Object
-            raw_document = documentai.RawDocument(
-                content=image_content, mime_type=mime_type)
+            result = await compute()
+            if result:
+                await pipeline.run_stage(
+                    "gcs", result_cache.put, job.sha256, kind, result)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved when nobody else was waiting
+        future.exception()
+        raise
+    finally:
+        del inflight_results[key]
+
+
+async def process_file(job):
+    """Data Pipeline Process, returns "done" or why the file was skipped"""
+    started = time.monotonic()
+    status = "failed"
+    try:
+        logger.info(f"Currently processing file: {job.filename}")
+        # The uploaded bytes are handed over in memory by the upload stage
+        mime_type = job.mime_type
 
-            # Configure the process request
-            docai_client = documentai.DocumentProcessorServiceClient(
-                client_options=ClientOptions(
-                    api_endpoint=f"{LOCATION}-documentai.googleapis.com"))
-            RESOURCE_NAME = docai_client.processor_path(
-                PROJECT_ID, LOCATION, PROCESSOR_ID)
-            request = documentai.ProcessRequest(
-                name=RESOURCE_NAME, raw_document=raw_document)
+        # Skip Document AI processing for text files
+        if mime_type == "text/plain":
+            # Read the file content
+            text_content = job.content.decode("utf-8")
+        else:
+            if mime_type not in EXTENSION_MIME_TYPES.values():
+                logger.error(
+                    f"CAUTION: Unsupported file type: {mime_type}")
+                status = "unsupported"
+                return status
 
-            # Use the Document AI client to process the document
-            result = docai_client.process_document(request=request)
+            async def ocr():
+                text, job.pages = await ocr_document(job)
+                PAGES_PROCESSED.inc(amount=job.pages)
+                return text
 
-            document_object = result.document
-            annotations = document_object.text
+            with job_stage(job.id, "ocr"):
+                text_content = await cached_stage(job, "ocr", ocr)
+                if not text_content:
+                    status = "empty"
+                    return status
 
-            if annotations:
                 # Store the processed text in a different folder in the same
                 # bucket
-                processed_blob = gcs_client.bucket(
-                    GCS_BUCKET).blob(f"processed/{blob.name}.txt")
-                processed_blob.upload_from_string(annotations)
+                processed_blob = clients.gcs.bucket(
+                    GCS_BUCKET).blob(f"processed/{job.filename}.txt")
+                with stage_timer("gcs_write", job.timings):
+                    await pipeline.run_stage(
+                        "gcs", processed_blob.upload_from_string, text_content)
+                record_metadata("processed_meta_direct", processed_blob)
 
-                logger.info(
-                    f"SUCCESS: Stored processed text for file '{blob.name}' in Google Cloud Storage")
-
-                # Remove PII information using Google Cloud DLP
-                dlp_request = {
-                    "parent": f"projects/{PROJECT_ID}/locations/global",
-                    "item": {"value": annotations},
-                    "inspect_config": {
-                        "info_types": [
-                            {"name": "PHONE_NUMBER"},
-                            {"name": "EMAIL_ADDRESS"},
-                            {"name": "PERSON_NAME"},
-                            {"name": "LOCATION"},
-                            {"name": "AGE"},
-                        ]
-                    },
-                    "deidentify_config": {
-                        "info_type_transformations": {
-                            "transformations": [
-                                {"primitive_transformation": {
-                                    "replace_with_info_type_config": {}}}
-                            ]
-                        }
-                    },
-                }
-                dlp_response = dlp_client.deidentify_content(dlp_request)
-                deidentified_text = dlp_response.item.value
-
-                # Store the deidentified text in a different folder in the same
-                # bucket
-                deidentified_blob = gcs_client.bucket(
-                    GCS_BUCKET).blob(f"deidentified/{blob.name}.txt")
-                deidentified_blob.upload_from_string(deidentified_text)
-                send_text_bq(blob.name, deidentified_text)
-                logger.info(
-                    f"SUCCESS: Stored deidentified text for file '{blob.name}' in Google Cloud Storage")
+            logger.info(
+                f"SUCCESS: Stored processed text for file '{job.filename}' in Google Cloud Storage")
+
+        async def deidentify():
+            with stage_timer("dlp", job.timings):
+                return await deidentify_text(text_content)
+
+        with job_stage(job.id, "deidentify"):
+            deidentified_text = await cached_stage(job, "deid", deidentify)
+
+        # Store the deidentified text in a different folder in the same
+        # bucket
+        with job_stage(job.id, "store"):
+            deidentified_blob = clients.gcs.bucket(
+                GCS_BUCKET).blob(f"deidentified/{job.filename}.txt")
+            with stage_timer("gcs_write", job.timings):
+                await pipeline.run_stage(
+                    "gcs", deidentified_blob.upload_from_string, deidentified_text)
+            record_metadata("deidentified_meta_direct", deidentified_blob)
+            filename_index.add(deidentified_blob.name)
+            send_text_bq(job.filename, deidentified_text)
+            await run_blocking(search_index.add, job.filename, deidentified_text)
+        logger.info(
+            f"SUCCESS: Stored deidentified text for file '{job.filename}' in Google Cloud Storage")
+        status = "done"
+        # Start Medicine Name Extraction Process, bursts share one run
+        medicine_extraction.request()
+        return status
     except Exception as e:
         logger.error(f"CAUTION: Uploader script failed due to {e}")
+        raise
+    finally:
+        record_timings(job, status, time.monotonic() - started)
+
+
+def record_timings(job, status, elapsed):
+    """Update the file metrics and queue the file's timing row for BigQuery"""
+    FILE_SECONDS.observe(elapsed, job.mime_type)
+    FILES_PROCESSED.inc(job.mime_type, status)
+    BYTES_PROCESSED.inc(job.mime_type, amount=job.size)
+    row = {
+        "filename": job.filename,
+        "sha256": job.sha256,
+        "mime_type": job.mime_type,
+        "size": job.size,
+        "pages": job.pages,
+        "ocr_input_size": job.ocr_input_size,
+        "status": status,
+        "queue_seconds": job.timings.get("queue", 0.0),
+        "total_seconds": round(elapsed, 6),
+        "finished_at": str(datetime.datetime.now(datetime.timezone.utc)),
+    }
+    for stage in TIMED_STAGES:
+        row[f"{stage}_seconds"] = job.timings.get(stage, 0.0)
+    bq_writer.insert(f"{PROJECT_ID}.{BQ_DATASET}.{TIMINGS_TABLE}", row)
+
+
+async def monitor_loop_lag():
+    """Measure how late the event loop wakes up from a fixed sleep"""
+    while True:
+        expected = time.monotonic() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG_SECONDS.observe(max(0.0, time.monotonic() - expected))
+
+
+Gauge("obscurer_queue_depth", "Files waiting in the ingest queue", (),
+      lambda: [((), pipeline.queue.qsize() if pipeline.queue else 0)])
+Gauge("obscurer_stage_busy", "Calls currently running in each pipeline stage",
+      ("stage",), lambda: [((stage,), busy) for stage, busy in pipeline.busy.items()])
+Gauge("obscurer_bq_buffered_rows", "Rows waiting in the BigQuery writer", (),
+      lambda: [((), sum(len(rows) for rows in bq_writer.buffers.values()))])
+Gauge("obscurer_cold_start_seconds", "Seconds from process start to the end of each startup phase",
+      ("phase",), lambda: [((phase,), seconds) for phase, seconds in cold_start.items()])
+Gauge("obscurer_api_rate_limit", "Requests per minute a governor currently allows for each API",
+      ("api",), lambda: [((api,), governor.rate * 60) for api, governor in governors.items()])
+Gauge("obscurer_api_concurrency_limit", "Concurrent calls a governor currently allows for each API",
+      ("api",), lambda: [((api,), int(governor.limit)) for api, governor in governors.items()])
+Gauge("obscurer_api_inflight", "Calls currently in flight to each API",
+      ("api",), lambda: [((api,), governor.inflight) for api, governor in governors.items()])
+Gauge("obscurer_jobs", "Stored pipeline jobs in each state", ("state",),
+      lambda: [((state,), jobs) for state, jobs in job_store.counts().items()])
+Gauge("obscurer_search_documents", "Documents the content search index can return", (),
+      lambda: [((), len(search_index.latest))])
+Gauge("obscurer_search_segments", "Segment files of the content search index", (),
+      lambda: [((), len(search_index.segments))])
+
+
+@app.get("/metrics", tags=["Data Pipeline"], name="Prometheus Metrics",
+         response_class=PlainTextResponse)
+async def fetch_metrics():
+    """Endpoint is useful for scraping stage latencies, queue depth and throughput"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return PlainTextResponse("\n".join(lines) + "\n",
+                             media_type="text/plain; version=0.0.4")
+
+
+@app.get("/bq_writer_status", tags=["Data Pipeline"],
+         name="BigQuery Writer Buffers and Counters")
+async def fetch_bq_writer_status():
+    """Endpoint is useful for checking how rows are batched into BigQuery"""
+    return bq_writer.status()
+
+
+@app.get("/cache_stats", tags=["Data Pipeline"],
+         name="OCR and Deidentification Cache Statistics")
+async def fetch_cache_stats():
+    """Endpoint is useful for checking how many API calls the result cache saved"""
+    return dict(result_cache.stats(), report_cache=report_cache.counters)
+
+
+class FilenameIndex:
+    """In-memory index of deidentified object names for substring lookups.
+
+    The pipeline adds every object it writes, and a background refresh walks
+    the prefix a few pages at a time from a stored cursor to pick up writes
+    from other instances and drop deleted objects.
+    """
+
+    def __init__(self, prefix, suffix):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.names = set()
+        self.trigrams = {}
+        self.ready = False
+        self.passes = 0
+        self.cursor = None
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def add(self, name):
+        """Index an object name"""
+        if not name.endswith(self.suffix):
+            return
+        with self._lock:
+            if name in self.names:
+                return
+            self.names.add(name)
+            self._seen.add(name)
+            for i in range(len(name) - 2):
+                self.trigrams.setdefault(name[i:i + 3], set()).add(name)
+
+    def _remove(self, name):
+        self.names.discard(name)
+        for i in range(len(name) - 2):
+            bucket = self.trigrams.get(name[i:i + 3])
+            if bucket is not None:
+                bucket.discard(name)
+                if not bucket:
+                    del self.trigrams[name[i:i + 3]]
+
+    def lookup(self, query):
+        """Sorted object names containing `query`"""
+        with self._lock:
+            if len(query) < 3:
+                candidates = self.names
+            else:
+                buckets = [self.trigrams.get(query[i:i + 3], set())
+                           for i in range(len(query) - 2)]
+                candidates = set.intersection(*sorted(buckets, key=len))
+            return sorted(name for name in candidates if query in name)
+
+    def files(self):
+        """Indexed object names without the prefix and suffix"""
+        with self._lock:
+            return {name[len(self.prefix):-len(self.suffix)] for name in self.names}
+
+    def refresh(self, max_pages=None):
+        """Walk up to `max_pages` listing pages from the stored cursor"""
+        iterator = clients.gcs.bucket(GCS_BUCKET).list_blobs(
+            prefix=self.prefix, start_offset=self.cursor)
+        for page_number, page in enumerate(iterator.pages):
+            if max_pages is not None and page_number >= max_pages:
+                return False
+            for blob in page:
+                self.add(blob.name)
+                self._seen.add(blob.name)
+                self.cursor = blob.name
+        with self._lock:
+            # A full pass is complete, forget names that no longer exist
+            for name in self.names - self._seen:
+                self._remove(name)
+            self._seen = set()
+            self.cursor = None
+            self.ready = True
+            self.passes += 1
+        logger.info(
+            f"SUCCESS: Filename index holds {len(self.names)} deidentified files")
+        return True
+
+
+filename_index = FilenameIndex("deidentified/", ".txt")
+
+
+async def refresh_filename_index():
+    """Load the filename index, then keep walking the prefix in the background"""
+    while True:
+        try:
+            max_pages = INDEX_REFRESH_PAGES if filename_index.ready else None
+            finished = await run_blocking(filename_index.refresh, max_pages)
+        except Exception as e:
+            logger.error(f"CAUTION: Couldn't refresh filename index: {e}")
+            finished = True
+        if finished:
+            await asyncio.sleep(INDEX_REFRESH_SECONDS)
+        else:
+            await asyncio.sleep(1)
+
+
+def find_matching_files(name):
+    """Deidentified object names containing `name`"""
+    if filename_index.ready:
+        return filename_index.lookup(name)
+    # Index still loading, fall back to listing the prefix
+    blobs = clients.gcs.bucket(GCS_BUCKET).list_blobs(prefix="deidentified/")
+    return [blob.name for blob in blobs
+            if blob.name.endswith(".txt") and name in blob.name]
+
+
+def fetch_matching_texts(name):
+    """Download every deidentified text whose object name contains `name`"""
+    texts = []
+    for file in find_matching_files(name):
+        blob = clients.gcs.bucket(GCS_BUCKET).blob(file)
+        try:
+            texts.append(blob.download_as_text())
+        except NotFound:
+            continue
+    return texts
+
+
+def stream_matching_texts(files, compress=False):
+    """Yield the matched texts blob after blob in fixed size chunks"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    separator = b""
+    for file in files:
+        blob = clients.gcs.bucket(GCS_BUCKET).blob(file)
+        try:
+            with blob.open("rb", chunk_size=DOWNLOAD_CHUNK_SIZE) as reader:
+                piece = separator + reader.read(DOWNLOAD_CHUNK_SIZE)
+                while piece:
+                    if compressor:
+                        piece = compressor.compress(piece)
+                    if piece:
+                        yield piece
+                    piece = reader.read(DOWNLOAD_CHUNK_SIZE)
+        except NotFound:
+            continue
+        separator = b"\n"
+    if compressor:
+        yield compressor.flush()
 
 
 @app.post("/fetch", tags=["Stream Data"],
@@ -245,19 +2667,7 @@ async def fetch_processed_text(name: str):
     """Endpoint useful for fetching data as JSON"""
     logger.info(f"Currently fetching processed text for name: {name}")
 
-    # Fetch processed text from Google Cloud Storage based on name
-    blobs = gcs_client.bucket(GCS_BUCKET).list_blobs(prefix="deidentified/")
-    text_files = [blob.name for blob in blobs if blob.name.endswith(".txt")]
-
-    matching_files = []
-    for file in text_files:
-        if name in file:
-            matching_files.append(file)
-
-    texts = []
-    for file in matching_files:
-        blob = gcs_client.bucket(GCS_BUCKET).blob(file)
-        texts.append(blob.download_as_text())
+    texts = await run_blocking(fetch_matching_texts, name)
 
     logger.info(f"SUCCESS: Fetched processed text for name '{name}': {texts}")
 
@@ -266,116 +2676,320 @@ async def fetch_processed_text(name: str):
 
 @app.post("/download", tags=["Stream Data"],
           name="Download PII Deidentified Data")
-async def download_processed_text(name: str):
+async def download_processed_text(name: str, gzip: bool = False):
     """Endpoint useful for downloading text"""
     logger.info(f"Currently downloading processed text for name: {name}")
 
-    # Fetch processed text from Google Cloud Storage based on name
-    blobs = gcs_client.bucket(GCS_BUCKET).list_blobs(prefix="deidentified/")
-    text_files = [blob.name for blob in blobs if blob.name.endswith(".txt")]
-    matching_files = []
-    for file in text_files:
-        if name in file:
-            matching_files.append(file)
-
-    texts = []
-    for file in matching_files:
-        blob = gcs_client.bucket(GCS_BUCKET).blob(file)
-        texts.append(blob.download_as_text())
-
-    # Create a single text file containing all the fetched texts
-    combined_text = "\n".join(texts).encode()
-
-    # Create a file-like stream for the combined text
-    stream = io.BytesIO(combined_text)
+    files = await run_blocking(find_matching_files, name)
 
-    # Create a StreamingResponse to return the file as an attachment
+    # Stream the matching texts one after another as a single text file
+    filename = f"{name}_processed.txt.gz" if gzip else f"{name}_processed.txt"
     return StreamingResponse(
-        stream,
-        media_type="text/plain",
+        stream_matching_texts(files, gzip),
+        media_type="application/gzip" if gzip else "text/plain",
         headers={
-            "Content-Disposition": f"attachment; filename={name}_processed.txt"},
+            "Content-Disposition": f"attachment; filename={filename}"},
     )
 
 
-async def process_bucket(table_name, folder_name=None):
-    """Update metadata content for a given folder in a given BQ table"""
-    # Get the bucket
-    bucket = gcs_client.get_bucket(GCS_BUCKET)
+search_index = SearchIndex(SEARCH_DIR, SEARCH_PREFIX, lambda: clients.gcs.bucket(GCS_BUCKET))
+
+
+# Files listed by the filename index that were gone when the backfill fetched them
+search_backfill_misses = set()
+
+
+async def search_backfill_pending():
+    """Prune the search index to the indexed filenames, returns the files it misses"""
+    files = filename_index.files()
+    search_backfill_misses.intersection_update(files)
+    await run_blocking(search_index.prune, files)
+    return await run_blocking(search_index.missing, files - search_backfill_misses)
+
+
+async def backfill_search_index(filenames):
+    """Index deidentified files missing from the search index, returns how many were added"""
+    async def backfill(filename):
+        blob = clients.gcs.bucket(GCS_BUCKET).blob(f"deidentified/{filename}.txt")
+        try:
+            text = await pipeline.run_stage("gcs", blob.download_as_text)
+        except NotFound:
+            search_backfill_misses.add(filename)
+            return 0
+        await run_blocking(search_index.add, filename, text, replace=False)
+        return 1
+
+    return sum(await asyncio.gather(*[backfill(filename) for filename in filenames]))
+
+
+async def maintain_search_index():
+    """Open the search index, then keep flushing, merging, backing up and backfilling it.
+
+    Pruning and finding the files to backfill walk every indexed filename,
+    so they only run once per completed pass of the filename index.
+    """
+    while not search_index.ready:
+        try:
+            await run_blocking(search_index.open)
+        except Exception as e:
+            logger.error(f"CAUTION: Couldn't open search index: {e}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+    backfilled_pass = 0
+    pending = []
+    while True:
+        try:
+            if search_index.should_flush():
+                with stage_timer("search_flush"):
+                    await run_blocking(search_index.flush)
+            while await run_blocking(search_index.merge):
+                pass
+            await run_blocking(search_index.backup)
+            if filename_index.passes != backfilled_pass:
+                backfilled_pass = filename_index.passes
+                pending = await search_backfill_pending()
+            batch, pending = pending[:SEARCH_BACKFILL_DOCS], pending[SEARCH_BACKFILL_DOCS:]
+            await backfill_search_index(batch)
+        except Exception as e:
+            logger.error(f"CAUTION: Search index maintenance failed: {e}")
+        # Keep going while documents are left to backfill
+        await asyncio.sleep(0 if pending else 1)
+
+
+@app.get("/search", tags=["Stream Data"], name="Search PII Deidentified Data")
+async def search_processed_text(q: str, page: int = 1, page_size: int = 10):
+    """Endpoint useful for finding documents by content, e.g. metformin AND [AGE] or "chest pain" -covid"""
+    if page < 1 or not 1 <= page_size <= SEARCH_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"page must be at least 1 and page_size between 1 and {SEARCH_MAX_PAGE_SIZE}")
+    if not search_index.ready:
+        raise HTTPException(status_code=503, detail="Search index is still loading")
+    try:
+        with stage_timer("search"):
+            result = await run_blocking(
+                search_index.search, q, (page - 1) * page_size, page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return dict(result, page=page, page_size=page_size)
+
+
+def create_metadata_tables():
+    """Create the metadata, file timing, text and medicines tables if they don't exist"""
+    for table_name in META_TABLES:
+        table_id = f"{PROJECT_ID}.{BQ_DATASET}.{table_name}"
+        ensure_table(table_id, META_SCHEMA, "created")
+        bq_writer.register_schema(table_id, META_SCHEMA)
+    ensure_table(f"{PROJECT_ID}.{BQ_DATASET}.{TIMINGS_TABLE}",
+                 TIMINGS_SCHEMA, "finished_at")
+    ensure_table(f"{PROJECT_ID}.{BQ_DATASET}.deidentified_text",
+                 DEIDENTIFIED_TEXT_SCHEMA, "recordstamp")
+    # The schema views read it before the first extraction has run
+    ensure_table(f"{PROJECT_ID}.{BQ_DATASET}.{MEDICINES_TABLE}",
+                 MEDICINES_SCHEMA, "recordstamp")
+    logger.info("SUCCESS: Metadata tables are ready")
+
+
+def ensure_table(table_id, schema, partition_field):
+    """Create a partitioned table, or add the columns an existing one is missing"""
+    table = bigquery.Table(table_id, schema=schema)
+    table.time_partitioning = bigquery.TimePartitioning(field=partition_field)
+    table = clients.bq.create_table(table, exists_ok=True)
+    existing = {column.name for column in table.schema}
+    missing = [column for column in schema if column.name not in existing]
+    if existing and missing:
+        table.schema = list(table.schema) + missing
+        clients.bq.update_table(table, ["schema"])
+        logger.info(
+            f"SUCCESS: Added columns {[column.name for column in missing]} to {table_id}")
+
+
+def append_metadata_rows(table_name, rows):
+    """Append metadata rows to a BQ table with a load job"""
+    table_id = f"{PROJECT_ID}.{BQ_DATASET}.{table_name}"
+    job_config = bigquery.LoadJobConfig(
+        schema=META_SCHEMA,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+    load_job = clients.bq.load_table_from_json(
+        rows,
+        table_id,
+        job_config=job_config
+    )
+    load_job.result()  # Wait for the job to complete
 
-    # List all blobs in the bucket or folder
-    blobs = bucket.list_blobs(
-        prefix=folder_name) if folder_name else bucket.list_blobs()
+    if load_job.errors:
+        logger.error(
+            f"CAUTION: Error occurred while inserting rows: {load_job.errors}")
+        return False
+    logger.info(
+        f"SUCCESS: {len(rows)} metadata rows appended to BigQuery table {table_name}.")
+    return True
 
-    # Create a BigQuery table if it doesn't exist
-    table_id = f"{bq_client.project}.{BQ_DATASET}.{table_name}"
-    schema = [
-        bigquery.SchemaField("filename", "STRING"),
-        bigquery.SchemaField("size", "INTEGER"),
-        bigquery.SchemaField("created", "TIMESTAMP"),
-    ]
-    table = bigquery.Table(table_id, schema=schema)
-    table = bq_client.create_table(table, exists_ok=True)
 
-    # Process each blob and store metadata in BigQuery
-    rows_to_insert = []
-    for blob in blobs:
-        row = {
-            "filename": blob.name,
-            "size": blob.size,
-            "created": blob.time_created.isoformat(),  # Convert datetime to ISO 8601 string
-        }
-        rows_to_insert.append(row)
-
-    if rows_to_insert:
-        # Create a BigQuery table if it doesn't exist
-        table_id = f"{bq_client.project}.{BQ_DATASET}.{table_name}"
-        schema = [
-            bigquery.SchemaField("filename", "STRING"),
-            bigquery.SchemaField("size", "INTEGER"),
-            bigquery.SchemaField("created", "TIMESTAMP"),
-        ]
-        table = bigquery.Table(table_id, schema=schema)
-        table = bq_client.create_table(table, exists_ok=True)
+def metadata_row(blob, size=None):
+    """Metadata row describing an object in the bucket"""
+    created = blob.time_created or datetime.datetime.now(datetime.timezone.utc)
+    return {
+        "filename": blob.name,
+        "size": blob.size if size is None else size,
+        "created": created.isoformat(),  # Convert datetime to ISO 8601 string
+    }
 
-        # Insert rows into the BigQuery table and overwrite existing data
-        job_config = bigquery.LoadJobConfig(
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
-        load_job = bq_client.load_table_from_json(
-            rows_to_insert,
-            table_id,
-            job_config=job_config
-        )
-        load_job.result()  # Wait for the job to complete
 
-        if load_job.errors:
-            logger.error(
-                f"CAUTION: Error occurred while inserting rows: {load_job.errors}")
-        else:
-            logger.info(
-                f"SUCCESS: Metadata stored in BigQuery table {table_name}.")
-    else:
-        logger.info(
-            f"No files found in the specified bucket {GCS_BUCKET} / folder {folder_name}.")
+def record_metadata(table_name, blob, size=None):
+    """Queue a metadata row for an object the pipeline just wrote"""
+    bq_writer.insert(f"{PROJECT_ID}.{BQ_DATASET}.{table_name}",
+                     metadata_row(blob, size))
 
 
-async def metadata_handler():
-    """Runs metadata updation for each folder"""
+def load_reconcile_state():
+    """Listing cursor and created-time watermark of each metadata table"""
+    blob = clients.gcs.bucket(GCS_BUCKET).blob(
+        f"{STATE_PREFIX}metadata_reconcile.json")
     try:
-        await process_bucket("raw_file_meta_direct")
-        await process_bucket("processed_meta_direct", "processed")
-        await process_bucket("deidentified_meta_direct", "deidentified")
-    except Exception as e:
-        logger.error(f"CAUTION: Uploader script failed due to {e}")
+        return json.loads(blob.download_as_bytes())
+    except NotFound:
+        return {}
+
+
+def save_reconcile_state(state):
+    """Persist reconciliation progress so it survives restarts"""
+    blob = clients.gcs.bucket(GCS_BUCKET).blob(
+        f"{STATE_PREFIX}metadata_reconcile.json")
+    blob.upload_from_string(json.dumps(state), content_type="application/json")
+
+
+def reconcile_metadata(table_name, max_pages=None, full_scan=False):
+    """Append metadata rows for objects the pipeline didn't record itself.
+
+    Listing resumes from a stored object name cursor and stops after
+    `max_pages` pages, so a pass over a large bucket is spread across runs.
+    Only objects created after the previous completed pass and not yet in
+    the table are appended. Objects of the listed name range that the table
+    still shows but the bucket no longer holds get a `deleted` row, the
+    reporting views read the latest row of each object.
+    """
+    prefix = META_TABLES[table_name]
+    state = load_reconcile_state()
+    table_state = state.get(table_name, {})
+    if full_scan:
+        table_state = {}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if not table_state.get("cursor"):
+        table_state["cycle_start"] = now.isoformat()
+    watermark = table_state.get("watermark")
+    watermark = (datetime.datetime.fromisoformat(watermark) if watermark
+                 else datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc))
+
+    iterator = clients.gcs.bucket(GCS_BUCKET).list_blobs(
+        prefix=prefix or None, start_offset=table_state.get("cursor"))
+    candidates = {}
+    listed = set()
+    last_name = None
+    finished = True
+    for page_number, page in enumerate(iterator.pages):
+        if max_pages is not None and page_number >= max_pages:
+            finished = False
+            break
+        for blob in page:
+            last_name = blob.name
+            listed.add(blob.name)
+            if blob.name == table_state.get("cursor"):
+                continue
+            if not prefix and blob.name.startswith(INTERNAL_PREFIXES):
+                continue
+            if blob.time_created > watermark:
+                candidates[blob.name] = metadata_row(blob)
+
+    table_id = f"{PROJECT_ID}.{BQ_DATASET}.{table_name}"
+    names = list(candidates)
+    for start in range(0, len(names), 1000):
+        known = run_query(
+            f"SELECT DISTINCT filename FROM `{table_id}` "
+            "WHERE created > @watermark AND deleted IS NOT TRUE "
+            "AND filename IN UNNEST(@names)",
+            bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ScalarQueryParameter(
+                    "watermark", "TIMESTAMP", watermark),
+                bigquery.ArrayQueryParameter(
+                    "names", "STRING", names[start:start + 1000])]))
+        for row in known:
+            candidates.pop(row["filename"], None)
+
+    # Rows written after the listing started may describe objects it missed
+    recorded = run_query(
+        f"SELECT filename FROM (SELECT filename, created, deleted FROM `{table_id}` "
+        "WHERE STARTS_WITH(filename, @prefix) AND filename > @after "
+        "AND (@until IS NULL OR filename <= @until) "
+        "QUALIFY ROW_NUMBER() OVER (PARTITION BY filename ORDER BY created DESC) = 1) "
+        "WHERE deleted IS NOT TRUE AND created < @listed_at",
+        bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("prefix", "STRING", prefix),
+            bigquery.ScalarQueryParameter(
+                "after", "STRING", table_state.get("cursor") or ""),
+            bigquery.ScalarQueryParameter(
+                "until", "STRING", None if finished else last_name),
+            bigquery.ScalarQueryParameter("listed_at", "TIMESTAMP", now)]))
+    tombstones = [{"filename": row["filename"], "size": None,
+                   "created": now.isoformat(), "deleted": True}
+                  for row in recorded if row["filename"] not in listed]
+
+    rows = list(candidates.values()) + tombstones
+    if rows and not append_metadata_rows(table_name, rows):
+        return
+
+    if finished:
+        cycle_start = datetime.datetime.fromisoformat(table_state["cycle_start"])
+        table_state = {"watermark": (cycle_start - META_RECONCILE_LAG).isoformat()}
+    else:
+        table_state["cursor"] = last_name
+    state[table_name] = table_state
+    save_reconcile_state(state)
+    logger.info(
+        f"SUCCESS: Reconciled {table_name}, {len(candidates)} missing rows added, "
+        f"{len(tombstones)} deleted objects marked"
+        + ("" if finished else f", resuming after '{last_name}'"))
+
+
+async def metadata_handler(full_scan=False, job_id=None):
+    """Runs metadata reconciliation for each folder"""
+    await bq_writer.flush()
+    for table_name in META_TABLES:
+        if job_id is None:
+            await run_blocking(
+                reconcile_metadata, table_name,
+                None if full_scan else META_RECONCILE_PAGES, full_scan)
+            continue
+        with job_stage(job_id, table_name):
+            await run_blocking(
+                reconcile_metadata, table_name,
+                None if full_scan else META_RECONCILE_PAGES, full_scan)
+    report_cache.invalidate()
+
+
+async def run_metadata_job(record):
+    """Job handler for a manual metadata update"""
+    await metadata_handler(record["payload"].get("full_scan", False), record["id"])
+
+
+async def reconcile_metadata_periodically():
+    """Background reconciliation of the metadata tables"""
+    while True:
+        await asyncio.sleep(META_RECONCILE_SECONDS)
+        try:
+            await metadata_handler()
+        except Exception as e:
+            logger.error(f"CAUTION: Uploader script failed due to {e}")
 
 
 @app.patch("/update_metatables", tags=["Data Pipeline"], name="Manual Metadata Update")
-async def force_update_metadata():
+async def force_update_metadata(full_scan: bool = False):
     """Endpoint is useful for manual metadata updation"""
     try:
-        asyncio.create_task(metadata_handler())
+        job_id = start_background_job(
+            "metadata", "update_metatables", {"full_scan": full_scan})
         return {
-            "process": "Metadata handler enabled, BigQuery tables update started."}
+            "process": "Metadata handler enabled, BigQuery tables update started.",
+            "job_id": job_id}
     except Exception as e:
         logger.error(f"CAUTION: Error occured while metadata update: {e}")
         raise HTTPException(
@@ -383,16 +2997,130 @@ async def force_update_metadata():
             detail="Couldn't process request at this time. Please try again later")
 
 
+class ReportCache:
+    """TTL cache for reporting queries with stale-while-revalidate.
+
+    Fresh entries are served directly. Stale entries are served while one
+    background refresh runs, and concurrent misses for the same key share a
+    single query. Invalidation marks entries stale rather than dropping them.
+    """
+
+    def __init__(self, ttl, stale_ttl):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries = {}
+        self.inflight = {}
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0,
+                         "refreshes": 0, "invalidations": 0}
+
+    async def get(self, key, loader):
+        """Cached result of `loader()` for `key`"""
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry[1]
+            if age < self.ttl:
+                self.counters["hits"] += 1
+                return entry[0]
+            if age < self.ttl + self.stale_ttl:
+                self.counters["stale_hits"] += 1
+                self._load(key, loader)
+                return entry[0]
+        self.counters["misses"] += 1
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key, loader):
+        """Start a refresh for `key` unless one is already running"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(key, loader))
+            task.add_done_callback(self._log_failure)
+            self.inflight[key] = task
+        return task
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                f"CAUTION: Reporting query refresh failed: {task.exception()}")
+
+    async def _refresh(self, key, loader):
+        try:
+            self.counters["refreshes"] += 1
+            value = await loader()
+            self.entries[key] = (value, time.monotonic())
+            return value
+        finally:
+            del self.inflight[key]
+
+    def invalidate(self, *keys):
+        """Mark entries stale so the next request triggers a refresh"""
+        expired = time.monotonic() - self.ttl
+        for key in keys or list(self.entries):
+            if key in self.entries:
+                self.entries[key] = (self.entries[key][0], expired)
+        self.counters["invalidations"] += 1
+
+
+report_cache = ReportCache(REPORT_CACHE_TTL, REPORT_CACHE_STALE)
+
+
+def refresh_reporting_tables(since):
+    """Merge uploads and object writes from `since` onwards into the materialized file_status table.
+
+    Uploads from before `since` are updated too when their raw, processed
+    or deidentified objects were written since then.
+    """
+    with open(REPORTING_REFRESH_SQL, "r") as f:
+        query = f.read()
+    run_query(query, bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("since", "DATE", since)]))
+
+
+async def refresh_reporting(since=None):
+    """Refresh recent partitions of the reporting tables and the cached results"""
+    if since is None:
+        since = datetime.date.today() - datetime.timedelta(days=REPORTING_REFRESH_DAYS)
+    try:
+        await run_blocking(refresh_reporting_tables, since)
+        logger.info(f"SUCCESS: Reporting tables refreshed from {since}")
+        report_cache.invalidate()
+    except Exception as e:
+        logger.error(f"CAUTION: Couldn't refresh reporting tables: {e}")
+
+
+reporting_refresh = CoalescedTask(refresh_reporting, REPORTING_REFRESH_DEBOUNCE)
+
+
+def reporting_table_empty():
+    """Whether file_status has no rows yet, as when the schema job just created it"""
+    table = clients.bq.get_table(f"{PROJECT_ID}.{REPORTING_DATASET}.file_status")
+    return not table.num_rows
+
+
+def on_pipeline_rows_flushed(table_id):
+    """Reporting views read the metadata tables, refresh them after new rows land"""
+    table_name = table_id.split(".")[-1]
+    if table_name in META_TABLES or table_name == PRIMARY_BQ_TABLE:
+        report_cache.invalidate()
+        reporting_refresh.request()
+
+
+bq_writer.add_listener(on_pipeline_rows_flushed)
+
+
+@app.patch("/refresh_reporting", tags=["Data Pipeline"], name="Refresh Materialized Reporting Tables")
+async def force_refresh_reporting(since: Optional[datetime.date] = None):
+    """Endpoint is useful for backfilling the reporting tables from a given upload date"""
+    asyncio.create_task(refresh_reporting(since))
+    return {"process": "Reporting table refresh started.",
+            "since": str(since) if since else f"last {REPORTING_REFRESH_DAYS} days"}
+
+
 async def get_processed_status():
     """Function to get proccessed status from Big Query"""
-    query = f"SELECT * FROM `{PROJECT_ID}.{REPORTING_DATASET}.processed_view`"
-    results = bq_client.query(query)
-    processed_dict = dict()
-    for row in results:
-        processed_dict[row['file_name']] = row['size']
-    logger.info("SUCCESS: Prepared Dictionary for Processed View")
     query = f"SELECT * FROM `{PROJECT_ID}.{REPORTING_DATASET}.deidentified_view`"
-    results = bq_client.query(query)
+    results = await run_blocking(run_query, query)
     deidentified_dict = dict()
     for row in results:
         deidentified_dict[row['file_name']] = row['size']
@@ -407,7 +3135,7 @@ async def get_processed_status():
 async def fetch_processed_status():
     """Endpoint is useful for fetching list of files processed"""
     try:
-        result = await get_processed_status()
+        result = await report_cache.get("processed_status", get_processed_status)
         logger.info("SUCCESS: Processed File List Fetched")
         return result
     except Exception as e:
@@ -418,124 +3146,514 @@ async def fetch_processed_status():
             detail="Couldn't process request at this time. Please try again later")
 
 
-async def run_sql_file(sql_file):
-    """Define an async function to run a sql file in bigquery"""
+SQL_DEFINITION_PATTERN = re.compile(
+    r"CREATE\s+(?:OR\s+REPLACE\s+)?(?:TEMP\s+)?(?:MATERIALIZED\s+)?(?:TABLE|VIEW)"
+    r"(?:\s+IF\s+NOT\s+EXISTS)?\s+`?([\w.-]+)`?", re.IGNORECASE)
+SQL_REFERENCE_PATTERNS = [
+    re.compile(r"`([\w-]+(?:\.[\w-]+){1,2})`"),
+    re.compile(r"\b(?:FROM|JOIN)\s+([\w-]+(?:\.[\w-]+){1,2})\b", re.IGNORECASE),
+]
+
+
+def sql_object_name(name):
+    """Normalize a table reference to dataset.table"""
+    return ".".join(name.split(".")[-2:]).lower()
+
+
+def plan_sql_files(files):
+    """Order sql files into levels so each file runs after what it reads.
+
+    Returns the list of levels and a map of each file's dependencies.
+    """
+    definitions = {}
+    sources = {}
+    for sql_file in files:
+        with open(sql_file, "r") as f:
+            query = f.read()
+        sources[sql_file] = query
+        for name in SQL_DEFINITION_PATTERN.findall(query):
+            definitions[sql_object_name(name)] = sql_file
+    dependencies = {}
+    for sql_file, query in sources.items():
+        references = set()
+        for pattern in SQL_REFERENCE_PATTERNS:
+            references.update(sql_object_name(name)
+                              for name in pattern.findall(query))
+        dependencies[sql_file] = sorted(
+            {definitions[name] for name in references if name in definitions}
+            - {sql_file})
+    levels = []
+    remaining = dict(dependencies)
+    done = set()
+    while remaining:
+        level = sorted(f for f, deps in remaining.items() if done.issuperset(deps))
+        if not level:
+            raise ValueError(
+                f"Circular dependency between sql files: {sorted(remaining)}")
+        levels.append(level)
+        done.update(level)
+        for sql_file in level:
+            del remaining[sql_file]
+    return levels, dependencies
+
+
+def run_sql_file(sql_file):
+    """Run a sql file in bigquery and wait for it to finish"""
     with open(sql_file, "r") as f:
         query = f.read()
     logger.info(f"Now Running BigQuery Interactive Query File -> {sql_file}")
-    # Run the query asynchronously and return the job object
-    job = bq_client.query(query, job_config=bigquery.QueryJobConfig(
+    job = clients.bq.query(query, job_config=bigquery.QueryJobConfig(
         priority=bigquery.QueryPriority.INTERACTIVE))
-    return job
+    job.result()
+    return job.job_id
+
+
+schema_runs = []
+
+
+async def run_sql_plan(run, job_id=None):
+    """Run the planned levels in order, the files of each level in parallel"""
+    async def run_one(sql_file):
+        status = run["files"][sql_file]
+        if status["state"] == "done":
+            # Finished by an earlier attempt of the same job
+            return
+        failed = [dep for dep in status["depends_on"]
+                  if run["files"][dep]["state"] != "done"]
+        if failed:
+            status.update(state="skipped", error=f"Dependencies failed: {failed}")
+            return
+        status.update(state="running", started=str(datetime.datetime.now()))
+        start = time.monotonic()
+        try:
+            status["job_id"] = await run_blocking(run_sql_file, sql_file)
+            status["state"] = "done"
+        except Exception as e:
+            status.update(state="failed", error=str(e))
+            logger.error(f"CAUTION: BigQuery sql file {sql_file} failed: {e}")
+        status["seconds"] = round(time.monotonic() - start, 3)
+        if job_id is not None:
+            job_store.stage(job_id, sql_file, status["state"], status["seconds"])
+
+    start = time.monotonic()
+    for level in run["levels"]:
+        await asyncio.gather(*[run_one(sql_file) for sql_file in level])
+    run["seconds"] = round(time.monotonic() - start, 3)
+    states = [status["state"] for status in run["files"].values()]
+    run["state"] = "done" if all(state == "done" for state in states) else "failed"
+    logger.info(
+        f"BigQuery schema update {run['run_id']} finished: {run['state']} in {run['seconds']}s")
+    report_cache.invalidate()
+
+
+def new_schema_run(run_id, levels, dependencies):
+    """Status record of a schema update, as shown by /bq_schema_status"""
+    return {
+        "run_id": run_id,
+        "state": "running",
+        "started": str(datetime.datetime.now()),
+        "levels": levels,
+        "files": {sql_file: {"state": "pending", "level": number,
+                             "depends_on": dependencies[sql_file]}
+                  for number, level in enumerate(levels) for sql_file in level},
+    }
+
+
+async def run_schema_job(record):
+    """Job handler for a schema update, rerunning only the files not yet done"""
+    run = next((run for run in schema_runs if run["run_id"] == record["id"]), None)
+    if run is None:
+        payload = record["payload"]
+        run = new_schema_run(record["id"], payload["levels"], payload["dependencies"])
+        schema_runs.append(run)
+        del schema_runs[:-10]
+    run["state"] = "running"
+    # Records from job_store.due() carry no stages, read what earlier attempts finished
+    stored = await run_blocking(job_store.get, record["id"])
+    stages = stored["stages"] if stored else {}
+    for sql_file, status in run["files"].items():
+        stage = stages.get(sql_file)
+        if stage and stage["state"] == "done":
+            status["state"] = "done"
+        elif status["state"] != "done":
+            status.pop("error", None)
+            status["state"] = "pending"
+    await run_sql_plan(run, record["id"])
+    status = run["files"].get(REPORTING_TABLE_SQL)
+    if status and status["state"] == "done" and await run_blocking(reporting_table_empty):
+        # The views read only file_status, fill it with all uploads so far
+        await refresh_reporting(REPORTING_BACKFILL_SINCE)
+    if run["state"] != "done":
+        failed = sorted(f for f, status in run["files"].items()
+                        if status["state"] != "done")
+        raise RuntimeError(f"Sql files not applied: {failed}")
+
+
+JOB_HANDLERS = {"metadata": run_metadata_job, "schema": run_schema_job,
+                "ingest": run_ingest_job}
 
 
 @app.patch("/update_bq_schema", tags=["Data Pipeline"], name="Update/Fix Big Query View Schema")
 async def update_bq_schema():
-    """Define an endpoint to run all the sql files in parallel"""
-    tasks = [asyncio.create_task(run_sql_file(sql_file))
-             for sql_file in sql_files]
-    task_name = [{"task_id": task.get_name()} for task in tasks]
+    """Define an endpoint to run all the sql files in dependency order"""
+    if schema_runs and schema_runs[-1]["state"] == "running":
+        return {"process": "Schema update already running.",
+                "run_id": schema_runs[-1]["run_id"]}
+    try:
+        sql_files = sorted(glob.glob("./sql/*.sql"))
+        levels, dependencies = await run_blocking(plan_sql_files, sql_files)
+    except Exception as e:
+        logger.error(f"CAUTION: Couldn't plan schema update: {e}")
+        raise HTTPException(
+            status_code=412,
+            detail="Couldn't process request at this time. Please try again later")
+    run = new_schema_run(str(uuid.uuid4()), levels, dependencies)
+    schema_runs.append(run)
+    del schema_runs[:-10]
+    start_background_job("schema", "update_bq_schema",
+                         {"levels": levels, "dependencies": dependencies},
+                         job_id=run["run_id"])
     logger.info(
-        f"BigQuery Interactive SQL Update is processing -> {task_name}")
-    return {"process": "Schema update mechanism started. Please check status in sometime."}
+        f"BigQuery Interactive SQL Update is processing -> {levels}")
+    return {"process": "Schema update mechanism started. Please check status in sometime.",
+            "run_id": run["run_id"], "levels": levels}
+
+
+@app.get("/bq_schema_status", tags=["Data Pipeline"], name="Big Query Schema Update Status")
+async def fetch_bq_schema_status(run_id: Optional[str] = None):
+    """Endpoint is useful for checking per file status and timing of a schema update"""
+    for run in reversed(schema_runs):
+        if run_id is None or run["run_id"] == run_id:
+            return run
+    raise HTTPException(status_code=404, detail="No schema update found")
+
+
+def run_query(query, job_config=None):
+    """Run a BigQuery query and return its rows as a list"""
+    return list(clients.bq.query(query, job_config=job_config).result())
 
 
 def send_text_bq(filename, deidentified_text):
-    """Define a function that takes filename and deidentified text as input and inserts them into the table"""
+    """Define a function that takes filename and deidentified text as input and queues them for the table"""
     table_id = f"{PROJECT_ID}.{BQ_DATASET}.deidentified_text"
     # Create a row dictionary with the column names and values
+    encoded = deidentified_text.encode("utf-8")
     row = {"filename": filename, "deidentified_text": deidentified_text,
-           "recordstamp": str(datetime.datetime.now())}
-    # Insert the row into the table using the insert_rows_json method
-    errors = bq_client.insert_rows_json(table_id, [row])
-    # Check if there are any errors and print them
-    if errors:
+           "recordstamp": str(datetime.datetime.now()),
+           "text_hash": hashlib.sha256(encoded).hexdigest()}
+    if len(encoded) > TEXT_COMPRESS_BYTES:
+        # Large texts are stored compressed, base64 is how JSON rows carry BYTES
+        row["deidentified_text"] = None
+        row["compressed_text"] = base64.b64encode(zlib.compress(encoded)).decode("ascii")
+    # Rows are written in batches by the shared BigQuery writer
+    bq_writer.insert(table_id, row)
+
+
+def normalize_drug_text(text):
+    """Lowercase text and collapse whitespace and punctuation to single spaces.
+
+    Returns the normalized string and, for each of its characters, the index
+    of the character it came from in the original text.
+    """
+    chars = []
+    offsets = []
+    pending_space = False
+    for index, char in enumerate(text):
+        if char.isalnum():
+            if pending_space and chars:
+                chars.append(" ")
+                offsets.append(index - 1)
+            pending_space = False
+            chars.append(char.lower())
+            offsets.append(index)
+        else:
+            pending_space = True
+    return "".join(chars), offsets
+
+
+def drug_name_variants(name):
+    """Normalized spellings of a drug name, including salt synonyms"""
+    normalized, _ = normalize_drug_text(name)
+    if not normalized:
+        return set()
+    variants = {normalized}
+    words = normalized.split(" ")
+    for full, short in DRUG_SALT_ABBREVIATIONS.items():
+        if full in words:
+            variants.add(" ".join(short if w == full else w for w in words))
+    base = list(words)
+    while len(base) > 1 and base[-1] in DRUG_SALT_SUFFIXES:
+        base.pop()
+    # "sodium chloride" must not match a bare "sodium" on a lab panel
+    if not all(word in DRUG_SALT_SUFFIXES for word in base):
+        variants.add(" ".join(base))
+    return variants
+
+
+class DrugMatcher:
+    """Aho-Corasick automaton over normalized drug names and compositions"""
+
+    def __init__(self, entries=()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.canonical = []
+        self.lengths = []
+        patterns = {}
+        for pattern_name, canonical in entries:
+            for variant in drug_name_variants(pattern_name):
+                patterns.setdefault(variant, canonical)
+        for pattern, canonical in patterns.items():
+            self._add(pattern, canonical)
+        self._link()
+
+    def __len__(self):
+        return len(self.canonical)
+
+    def _add(self, pattern, canonical):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(len(self.canonical))
+        self.canonical.append(canonical)
+        self.lengths.append(len(pattern))
+
+    def _link(self):
+        """Compute failure links breadth first"""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] = (self.output[next_state]
+                                           + self.output[self.fail[next_state]])
+
+    def find(self, text):
+        """Return (start, end, canonical name) of whole-word matches in text.
+
+        Offsets refer to the original text. Overlapping matches are resolved
+        leftmost-longest so "metformin hydrochloride" wins over "metformin".
+        """
+        normalized, offsets = normalize_drug_text(text)
+        candidates = []
+        state = 0
+        for index, char in enumerate(normalized):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern_id in self.output[state]:
+                start = index - self.lengths[pattern_id] + 1
+                if start > 0 and normalized[start - 1] != " ":
+                    continue
+                if index + 1 < len(normalized) and normalized[index + 1] != " ":
+                    continue
+                candidates.append((start, index + 1, pattern_id))
+        matches = []
+        position = 0
+        for start, end, pattern_id in sorted(candidates,
+                                             key=lambda c: (c[0], -c[1])):
+            if start < position:
+                continue
+            matches.append((offsets[start], offsets[end - 1] + 1,
+                            self.canonical[pattern_id]))
+            position = end
+        return matches
+
+
+drug_matcher = DrugMatcher()
+drug_db_modified = None
+
+
+def load_drug_matcher():
+    """Compile the drug matcher from the drug database table when it has changed"""
+    global drug_matcher, drug_db_modified
+    table_id = f"{PROJECT_ID}.{BQ_DATASET}.{DRUG_DB_TABLE}"
+    modified = clients.bq.get_table(table_id).modified
+    if drug_matcher and modified == drug_db_modified:
+        return False
+    rows = run_query(
+        f"SELECT {DRUG_NAME_COLUMN}, {DRUG_COMPOSITION_COLUMN} FROM `{table_id}`")
+    entries = []
+    for row in rows:
+        name = row[DRUG_NAME_COLUMN]
+        if name:
+            entries.append((name, name))
+        composition = row[DRUG_COMPOSITION_COLUMN] or ""
+        for component in re.split(r"\s*[+,/;]\s*", composition):
+            base = " ".join(w.capitalize() for w in component.split())
+            if base:
+                entries.append((component, base))
+    drug_matcher = DrugMatcher(entries)
+    drug_db_modified = modified
+    logger.info(
+        f"SUCCESS: Drug matcher compiled with {len(drug_matcher)} patterns from {len(rows)} drugs")
+    return True
+
+
+async def refresh_drug_matcher():
+    """Keep the drug matcher in sync with the drug database table"""
+    while True:
+        try:
+            await run_blocking(load_drug_matcher)
+        except Exception as e:
+            logger.error(f"CAUTION: Couldn't load drug database: {e}")
+        await asyncio.sleep(DRUG_DB_REFRESH_SECONDS)
+
+
+def find_medicine_names(deidentified_text):
+    """Medicine names in a text with the codepoint offsets of their mentions.
+
+    Names come from the drug matcher, followed by any the NL API adds.
+    """
+    mentions = {}
+    for start, _, name in drug_matcher.find(deidentified_text):
+        mentions.setdefault(name, []).append(start)
+    if NL_SECOND_PASS or not drug_matcher:
+        from google.cloud import language_v1
+        document = language_v1.Document(
+            content=deidentified_text, type_=language_v1.Document.Type.PLAIN_TEXT)
+        response = governors["nl"].call_blocking(
+            clients.language.analyze_entities, request={
+                "document": document, "encoding_type": language_v1.EncodingType.UTF32})
+        known = {name.lower() for name in mentions}
+        for entity in response.entities:
+            if (entity.type == language_v1.Entity.Type.CONSUMER_GOOD
+                    and entity.name.lower() not in known):
+                known.add(entity.name.lower())
+                mentions[entity.name] = [mention.text.begin_offset
+                                         for mention in entity.mentions]
+    return mentions
+
+
+def medicine_records(mentions):
+    """Repeated medicines field of a document row"""
+    return [{"name": name, "count": len(offsets),
+             "offsets": sorted(offsets)[:MEDICINE_MAX_OFFSETS]}
+            for name, offsets in mentions.items()]
+
+
+extraction_watermark = None
+
+
+def extract_medicine_names():
+    """Find medicine names in new or changed deidentified texts.
+
+    Only documents past the recordstamp watermark whose text hash has no
+    row in the medicines table yet are analyzed. Each gets one row with its
+    medicines, their mention counts and offsets, and the hash of the text
+    they refer to, so work is proportional to what changed. Rows are only
+    appended, the medicines_found view reads the latest row of each document.
+    """
+    global extraction_watermark
+    # Define the output table ID
+    output_table_id = f"{PROJECT_ID}.{BQ_DATASET}.{MEDICINES_TABLE}"
+
+    if extraction_watermark is None:
+        rows = run_query(
+            f"SELECT MAX(recordstamp) AS watermark FROM `{output_table_id}`")
+        extraction_watermark = (rows[0]["watermark"]
+                                or datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc))
+    since = extraction_watermark - EXTRACTION_LAG
+
+    # Fetch the latest text of every document that changed since the watermark
+    input_table_query = f"""
+        SELECT d.filename, d.deidentified_text, d.compressed_text, d.recordstamp,
+            d.text_hash
+        FROM (
+            SELECT filename, deidentified_text, compressed_text, recordstamp,
+                IFNULL(text_hash, TO_HEX(SHA256(deidentified_text))) AS text_hash
+            FROM `{PROJECT_ID}.{BQ_DATASET}.deidentified_text`
+            WHERE recordstamp > @since
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY filename ORDER BY recordstamp DESC) = 1
+        ) d
+        LEFT JOIN (
+            SELECT filename, text_hash
+            FROM `{output_table_id}`
+            WHERE recordstamp > @since
+        ) m
+        ON d.filename = m.filename AND d.text_hash = m.text_hash
+        WHERE m.filename IS NULL
+    """
+    results = run_query(input_table_query, bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)]))
+    if not results:
+        logger.info("SUCCESS: No new documents for medicine name extraction.")
+        return
+
+    # One row per document, documents without medicines mark the text as analyzed
+    rows = []
+    extracted_at = str(datetime.datetime.now(datetime.timezone.utc))
+    for row in results:
+        text = row.deidentified_text
+        if text is None:
+            text = zlib.decompress(row.compressed_text).decode("utf-8")
+        rows.append({
+            "filename": row.filename,
+            "text_hash": row.text_hash,
+            "recordstamp": str(row.recordstamp),
+            "extracted_at": extracted_at,
+            "medicines": medicine_records(find_medicine_names(text)),
+        })
+
+    job_config = bigquery.LoadJobConfig(
+        schema=MEDICINES_SCHEMA,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+    )
+    # Load the rows into the table from JSON
+    load_job = clients.bq.load_table_from_json(
+        rows,
+        output_table_id,
+        job_config=job_config
+    )
+    load_job.result()  # Wait for the job to complete
+    if load_job.errors:
         logger.error(
-            f"CAUTION: Error occured while adding {filename} to BQ:", errors)
-    else:
-        logger.info(f"SUCCESS: Added deidentified text for {filename} to BQ")
+            f"CAUTION: Error occured while medicine name extraction: {load_job.errors}")
+        return
+
+    extraction_watermark = max(
+        extraction_watermark, max(row.recordstamp for row in results))
+    logger.info(
+        f"SUCCESS: Medicine Names have been extracted for {len(results)} documents.")
 
 
 async def analyze_and_insert_data():
+    """Runs medicine name extraction off the event loop"""
     try:
-        # Define the BigQuery table schema for the output table
-        output_table_schema = [
-            bigquery.SchemaField("filename", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("deidentified_text",
-                                 "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("medicine_name", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("recordstamp", "TIMESTAMP", mode="REQUIRED")
-        ]
-
-        # Define the output table ID
-        output_table_id = f"{PROJECT_ID}.{BQ_DATASET}.medicines_found"
-
-        # Define the SQL query to fetch filenames and text from the input table
-        input_table_query = f"""
-            SELECT filename, deidentified_text, recordstamp
-            FROM `{PROJECT_ID}.{BQ_DATASET}.deidentified_text`
-        """
-
-        # Perform the query to fetch filenames and text from the input table
-        query_job = bq_client.query(input_table_query)
-        results = query_job.result()
-
-        # Prepare the rows for insertion into the output table
-        rows = []
-        for row in results:
-            document = language_v1.Document(
-                content=row.deidentified_text, type_=language_v1.Document.Type.PLAIN_TEXT)
-            response = language_client.analyze_entities(
-                request={"document": document})
-            entities = response.entities
-            medicine_names = [
-                entity.name for entity in entities if entity.type == language_v1.Entity.Type.CONSUMER_GOOD]
-
-            for medicine_name in medicine_names:
-                rows.append({
-                    "filename": row.filename,
-                    "deidentified_text": row.deidentified_text,
-                    "medicine_name": medicine_name,
-                    "recordstamp": str(row.recordstamp)
-                })
-
-        # Define the job config with write disposition to overwrite existing data
-        job_config = bigquery.LoadJobConfig(
-            schema=output_table_schema,
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
-        )
-
-        # Load the rows into the output table from JSON
-        load_job = bq_client.load_table_from_json(
-            rows,
-            output_table_id,
-            job_config=job_config
-        )
-        load_job.result()  # Wait for the job to complete
-
-        if load_job.errors:
-            logger.error(
-                f"CAUTION: Error occured while medicine name extraction: {load_job.errors}")
-        else:
-            logger.info("SUCCESS: Medicine Names have been extracted.")
+        with stage_timer("medicine_extraction"):
+            await run_blocking(extract_medicine_names)
     except Exception as e:
         logger.error(
             f"CAUTION: Error occured while medicine name extraction: {e}")
 
 
+medicine_extraction = CoalescedTask(analyze_and_insert_data, EXTRACTION_DEBOUNCE)
+
+
 async def get_processed_count():
     """Function to get proccessed counts from Big Query"""
     query = f"SELECT * FROM `{PROJECT_ID}.{REPORTING_DATASET}.file_processed_dash`"
-    results = bq_client.query(query)
+    results = await run_blocking(run_query, query)
     output_dict = dict()
     unprocessed_dict = dict()
-    for row in results:
-        unprocessed_dict[row['Content_Type']] = row['Unprocessed_Count']
     processed_dict = dict()
-    for row in results:
-        processed_dict[row['Content_Type']] = row['Processed_Count']
     deidentified_dict = dict()
     for row in results:
+        unprocessed_dict[row['Content_Type']] = row['Unprocessed_Count']
+        processed_dict[row['Content_Type']] = row['Processed_Count']
         deidentified_dict[row['Content_Type']] = row['Deidentified_Count']
     output_dict["Unprocessed"] = unprocessed_dict
     output_dict["Processed"] = processed_dict
@@ -550,7 +3668,7 @@ async def get_processed_count():
 async def fetch_count_processed():
     """Endpoint is useful for fetching count of files processed"""
     try:
-        result = await get_processed_count()
+        result = await report_cache.get("processed_count", get_processed_count)
         logger.info("SUCCESS: Processed File Count Fetched")
         return result
     except Exception as e:
@@ -563,11 +3681,13 @@ async def fetch_count_processed():
 
 async def get_medical_files(filename):
     """Function to get proccessed status from Big Query"""
-    query = f"SELECT * FROM `{PROJECT_ID}.{REPORTING_DATASET}.medicines_found` where filename = '{filename}'"
-    results = bq_client.query(query)
+    query = (f"SELECT filename, medicine_names FROM `{PROJECT_ID}.{REPORTING_DATASET}.medicines_found`"
+             " WHERE filename = @filename")
+    results = await run_blocking(run_query, query, bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("filename", "STRING", filename)]))
     output_dict = dict()
     for row in results:
-        output_dict[row['filename']] = row['medicine_names']
+        output_dict[row['filename']] = list(row['medicine_names'])
     logger.info("SUCCESS: Prepared Dictionary for Medicine Related Files")
     return output_dict
 
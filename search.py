@@ -0,0 +1,710 @@
+"""Inverted index of deidentified text behind the /search endpoint.
+
+Documents are kept in immutable segment files that are memory-mapped and
+merged in tiers, with the newest documents in an in-memory memtable. numpy
+is imported on first use so it doesn't slow down the app's startup.
+"""
+import heapq
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import uuid
+import zlib
+from array import array
+
+from google.api_core.exceptions import NotFound
+
+SEARCH_FLUSH_DOCS = int(os.environ.get("SEARCH_FLUSH_DOCS", 500))  # Buffered documents per segment
+SEARCH_FLUSH_SECONDS = float(os.environ.get("SEARCH_FLUSH_SECONDS", 30))
+SEARCH_MERGE_FACTOR = 4  # Segments of the same size tier merged together
+SEARCH_SNIPPET_CHARS = 200
+SEARCH_COPY_CHUNK_SIZE = 1024 * 1024  # Bytes per read when restoring segments
+# Words, and DLP placeholders like [PERSON_NAME] as single terms
+SEARCH_TOKEN_PATTERN = re.compile(r"\[[A-Z_]+\]|[^\W_]+")
+SEARCH_QUERY_PATTERN = re.compile(r'-?"[^"]*"?|\(|\)|[^\s()"]+')
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_MAGIC = b"OBSIDX01"
+# term offset and length in the strings blob, document frequency, postings
+# offset, then the compressed length of the doc ids, term counts and positions
+SEARCH_TERM_ENTRY = struct.Struct("<IIIQIII")
+# doc id, text offset and length, filename offset and length in the strings blob
+SEARCH_DOC_ENTRY = struct.Struct("<IQIII")
+
+
+def search_terms(text):
+    """Positions of every lowercased term of `text`, keyed by term"""
+    terms = {}
+    for position, term in enumerate(SEARCH_TOKEN_PATTERN.findall(text)):
+        terms.setdefault(term.lower(), []).append(position)
+    return terms
+
+
+def delta_array(values):
+    """Gaps between ascending integers as an unsigned array"""
+    return array("I", [value - previous for previous, value
+                       in zip(itertools.chain((0,), values), values)])
+
+
+def unpack_array(data):
+    """Decompress an unsigned array written by write_search_segment"""
+    import numpy as np
+    return np.frombuffer(zlib.decompress(data), dtype="<u4")
+
+
+def position_keys(doc_ids, tfs, gaps):
+    """doc_id << 32 | position for every occurrence of a term.
+
+    Positions are stored as gaps that restart from zero in each document,
+    so the running total is rebased at the first position of each one.
+    """
+    import numpy as np
+    if not len(gaps):
+        return np.zeros(0, dtype=np.uint64)
+    totals = np.cumsum(gaps, dtype=np.uint64)
+    starts = np.cumsum(tfs, dtype=np.int64) - tfs
+    positions = totals - np.repeat(totals[starts] - gaps[starts], tfs)
+    return (np.repeat(doc_ids.astype(np.uint64), tfs) << np.uint64(32)) | positions
+
+
+def write_search_segment(path, postings, documents):
+    """Write a segment file.
+
+    `postings` yields (term, [(doc_id, positions)]) in term order and
+    `documents` yields (doc_id, filename, compressed_text) in doc id order.
+    Doc ids and positions are stored as zlib compressed gaps.
+    """
+    strings = bytearray()
+    term_table = bytearray()
+    doc_table = bytearray()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        offset = 0
+        for term, docs in postings:
+            gaps = array("I")
+            for _, positions in docs:
+                gaps.extend(delta_array(positions))
+            blobs = (zlib.compress(delta_array([doc_id for doc_id, _ in docs]).tobytes()),
+                     zlib.compress(array("I", [len(positions) for _, positions in docs]).tobytes()),
+                     zlib.compress(gaps.tobytes()))
+            encoded = term.encode("utf-8")
+            term_table += SEARCH_TERM_ENTRY.pack(
+                len(strings), len(encoded), len(docs), offset, *map(len, blobs))
+            strings += encoded
+            for blob in blobs:
+                f.write(blob)
+                offset += len(blob)
+        for doc_id, filename, text in documents:
+            encoded = filename.encode("utf-8")
+            doc_table += SEARCH_DOC_ENTRY.pack(
+                doc_id, offset, len(text), len(strings), len(encoded))
+            strings += encoded
+            f.write(text)
+            offset += len(text)
+        footer = {"strings": offset,
+                  "term_table": offset + len(strings),
+                  "terms": len(term_table) // SEARCH_TERM_ENTRY.size,
+                  "doc_table": offset + len(strings) + len(term_table),
+                  "docs": len(doc_table) // SEARCH_DOC_ENTRY.size}
+        footer = json.dumps(footer).encode("utf-8")
+        for section in (strings, term_table, doc_table, footer,
+                        struct.pack("<I", len(footer)), SEARCH_MAGIC):
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class SearchSegment:
+    """Immutable segment file of the search index, read through mmap.
+
+    Postings and compressed texts come first, then a strings blob of terms
+    and filenames, a fixed width term table sorted by term and a doc table
+    sorted by doc id, so both are binary searched in the mapped file.
+    Everything is copied out of the map before decoding, so closing it never
+    fails on arrays that still point into it.
+    """
+
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = len(self.data) - len(SEARCH_MAGIC) - 4
+        if self.data[end + 4:] != SEARCH_MAGIC:
+            self.data.close()
+            raise ValueError(f"{path} is not a search index segment")
+        footer_size, = struct.unpack_from("<I", self.data, end)
+        footer = json.loads(self.data[end - footer_size:end])
+        self.strings = footer["strings"]
+        self.term_table = footer["term_table"]
+        self.terms = footer["terms"]
+        self.doc_table = footer["doc_table"]
+        table = np.frombuffer(
+            self.data[self.doc_table:self.doc_table + footer["docs"] * SEARCH_DOC_ENTRY.size],
+            dtype="<u4").reshape(-1, SEARCH_DOC_ENTRY.size // 4)
+        self.doc_ids = table[:, 0].copy()
+
+    def _string(self, offset, length):
+        start = self.strings + offset
+        return self.data[start:start + length]
+
+    def _term(self, index):
+        return SEARCH_TERM_ENTRY.unpack_from(
+            self.data, self.term_table + index * SEARCH_TERM_ENTRY.size)
+
+    def _find(self, term):
+        key = term.encode("utf-8")
+        low, high = 0, self.terms
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._term(middle)
+            found = self._string(entry[0], entry[1])
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def _postings(self, entry):
+        """Doc ids, term counts and position gaps of a term"""
+        import numpy as np
+        start = entry[3]
+        doc_ids = np.cumsum(unpack_array(self.data[start:start + entry[4]]), dtype=np.uint32)
+        start += entry[4]
+        tfs = unpack_array(self.data[start:start + entry[5]])
+        start += entry[5]
+        return doc_ids, tfs, unpack_array(self.data[start:start + entry[6]])
+
+    def search_ids(self, term):
+        """Doc ids containing `term`"""
+        import numpy as np
+        entry = self._find(term)
+        if entry is None:
+            return np.zeros(0, dtype=np.uint32)
+        start = entry[3]
+        return np.cumsum(unpack_array(self.data[start:start + entry[4]]), dtype=np.uint32)
+
+    def position_keys(self, term):
+        """doc_id << 32 | position for every occurrence of `term`"""
+        import numpy as np
+        entry = self._find(term)
+        if entry is None:
+            return np.zeros(0, dtype=np.uint64)
+        return position_keys(*self._postings(entry))
+
+    def document(self, doc_id):
+        """(filename, text) of a doc id, or None when it isn't in this segment"""
+        import numpy as np
+        index = int(np.searchsorted(self.doc_ids, doc_id))
+        if index == len(self.doc_ids) or self.doc_ids[index] != doc_id:
+            return None
+        _, filename, text = self._document(index)
+        return filename, zlib.decompress(text).decode("utf-8")
+
+    def _document(self, index):
+        doc_id, text_offset, text_length, name_offset, name_length = \
+            SEARCH_DOC_ENTRY.unpack_from(
+                self.data, self.doc_table + index * SEARCH_DOC_ENTRY.size)
+        return (doc_id, self._string(name_offset, name_length).decode("utf-8"),
+                self.data[text_offset:text_offset + text_length])
+
+    def documents(self, alive=None):
+        """(doc_id, filename, compressed_text) in doc id order"""
+        for index, doc_id in enumerate(self.doc_ids.tolist()):
+            if alive is None or doc_id in alive:
+                yield self._document(index)
+
+    def entries(self, alive):
+        """(term, (doc_id, positions) of the live docs) in term order"""
+        for index in range(self.terms):
+            entry = self._term(index)
+            doc_ids, tfs, gaps = self._postings(entry)
+            docs = []
+            start = 0
+            for doc_id, tf in zip(doc_ids.tolist(), tfs.tolist()):
+                if doc_id in alive:
+                    docs.append((doc_id, list(itertools.accumulate(gaps[start:start + tf].tolist()))))
+                start += tf
+            if docs:
+                yield self._string(entry[0], entry[1]).decode("utf-8"), docs
+
+    def close(self):
+        self.data.close()
+
+
+class SearchMemtable:
+    """Documents added since the last flush, searchable like a segment"""
+
+    def __init__(self):
+        self.postings = {}
+        self.texts = {}
+        self.started = None
+
+    def add(self, doc_id, filename, text, terms):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.texts[doc_id] = (filename, text)
+        for term, positions in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = positions
+
+    def search_ids(self, term):
+        import numpy as np
+        docs = self.postings.get(term, {})
+        return np.fromiter(docs, dtype=np.uint32, count=len(docs))
+
+    def position_keys(self, term):
+        import numpy as np
+        return np.array([doc_id << 32 | position
+                         for doc_id, positions in self.postings.get(term, {}).items()
+                         for position in positions], dtype=np.uint64)
+
+    def document(self, doc_id):
+        return self.texts.get(doc_id)
+
+    def snapshot(self, terms):
+        """Copy of the texts and of the postings of `terms`, read without the lock"""
+        copy = SearchMemtable()
+        copy.texts = dict(self.texts)
+        copy.postings = {term: dict(self.postings[term])
+                         for term in terms if term in self.postings}
+        return copy
+
+    def entries(self):
+        for term in sorted(self.postings):
+            yield term, sorted(self.postings[term].items())
+
+    def documents(self):
+        for doc_id in sorted(self.texts):
+            filename, text = self.texts[doc_id]
+            yield doc_id, filename, zlib.compress(text.encode("utf-8"))
+
+
+def parse_search_query(query):
+    """Parse a query into ("term"|"phrase"|"and"|"or"|"not", ...) nodes.
+
+    Words are ANDed unless joined by OR, NOT or a leading - excludes a word
+    or phrase, parentheses group and double quotes match a phrase. Raises
+    ValueError for queries that don't parse.
+    """
+    tokens = SEARCH_QUERY_PATTERN.findall(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        token = peek()
+        position += 1
+        return token
+
+    def words(text):
+        # DLP placeholders are indexed in capitals, accept [age] for [AGE]
+        text = re.sub(r"\[\w+\]", lambda match: match.group().upper(), text)
+        terms = [term.lower() for term in SEARCH_TOKEN_PATTERN.findall(text)]
+        if not terms:
+            raise ValueError(f"Nothing to search for in {text!r}")
+        return ("term", terms[0]) if len(terms) == 1 else ("phrase", terms)
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() == "OR":
+            take()
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def parse_and():
+        children = []
+        while peek() not in (None, ")", "OR"):
+            if peek() == "AND":
+                take()
+                continue
+            children.append(parse_unary())
+        if not children:
+            raise ValueError("Expected a search term")
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def parse_unary():
+        token = take()
+        if token in ("NOT", "-"):
+            return ("not", parse_unary())
+        if token == "(":
+            node = parse_or()
+            if take() != ")":
+                raise ValueError("Unbalanced parentheses")
+            return node
+        if token is None or token == ")":
+            raise ValueError("Expected a search term")
+        if token.startswith("-"):
+            return ("not", words(token[1:].strip('"')))
+        return words(token.strip('"'))
+
+    tree = parse_or()
+    if position < len(tokens):
+        raise ValueError("Unbalanced parentheses")
+    return tree
+
+
+def query_terms(node):
+    """Terms a matching document contains, the ones worth highlighting"""
+    kind, value = node
+    if kind == "term":
+        return {value}
+    if kind == "phrase":
+        return set(value)
+    if kind == "not":
+        return set()
+    return set().union(*map(query_terms, value))
+
+
+def referenced_terms(node):
+    """Every term of a query, excluded ones included"""
+    kind, value = node
+    if kind == "term":
+        return {value}
+    if kind == "phrase":
+        return set(value)
+    if kind == "not":
+        return referenced_terms(value)
+    return set().union(*map(referenced_terms, value))
+
+
+def search_snippet(text, terms):
+    """A window of `text` around the first query term, with highlight offsets"""
+    start = None
+    end = SEARCH_SNIPPET_CHARS
+    highlights = []
+    for match in SEARCH_TOKEN_PATTERN.finditer(text):
+        if match.group().lower() not in terms:
+            continue
+        if start is None:
+            start = max(0, match.start() - SEARCH_SNIPPET_CHARS // 4)
+            # Don't cut the first word of the snippet in half
+            space = text.find(" ", start, match.start())
+            if start and space != -1:
+                start = space + 1
+            end = start + SEARCH_SNIPPET_CHARS
+        if match.end() > end:
+            break
+        highlights.append([match.start() - start, match.end() - start])
+    start = start or 0
+    return {"snippet": text[start:end], "highlights": highlights}
+
+
+class SearchIndex:
+    """Inverted index of deidentified text for boolean and phrase search.
+
+    Documents are buffered in a memtable that is flushed to an immutable
+    segment file every SEARCH_FLUSH_DOCS documents or SEARCH_FLUSH_SECONDS.
+    Segments are memory-mapped, merged in tiers of SEARCH_MERGE_FACTOR and
+    backed up under the `search/` prefix of the bucket, so a new instance
+    restores the index instead of rebuilding it. A file processed again
+    gets a new doc id, its old one is hidden at once and left out of the
+    next merge of its segment. Doc ids of deleted files are kept in the
+    manifest until they are merged away, so they stay hidden after a restart.
+
+    `bucket` is called for the bucket holding the backup.
+    """
+
+    def __init__(self, directory, prefix, bucket):
+        self.directory = directory
+        self.prefix = prefix
+        self.bucket = bucket
+        self.memtable = SearchMemtable()
+        self.flushing = []
+        self.segments = []
+        self.latest = {}
+        self.alive = None
+        self.pruned = set()
+        self.next_id = 0
+        self.ready = False
+        self.dirty = False
+        self.removed = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _mark(self, doc_id, alive):
+        import numpy as np
+        if doc_id >= len(self.alive):
+            grown = np.zeros(max(doc_id + 1, 2 * len(self.alive)), dtype=bool)
+            grown[:len(self.alive)] = self.alive
+            self.alive = grown
+        self.alive[doc_id] = alive
+
+    def open(self):
+        """Map the segments of the local manifest, restoring them from GCS when missing"""
+        import numpy as np
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self._load_manifest() or self._restore() or {"segments": [], "next_id": 0}
+        for entry in os.scandir(self.directory):
+            if entry.name != "manifest.json" and entry.name not in manifest["segments"]:
+                os.remove(entry.path)
+        segments = [SearchSegment(self._path(name)) for name in manifest["segments"]]
+        latest = {}
+        for segment in segments:
+            for doc_id, filename, _ in segment.documents():
+                latest[filename] = max(doc_id, latest.get(filename, -1))
+        # Only the latest doc of a file can have been pruned, older ones are hidden anyway
+        pruned = set(manifest.get("pruned", [])) & set(latest.values())
+        latest = {filename: doc_id for filename, doc_id in latest.items()
+                  if doc_id not in pruned}
+        alive = np.zeros(manifest["next_id"], dtype=bool)
+        alive[list(latest.values())] = True
+        with self._lock:
+            self.segments = segments
+            self.latest = latest
+            self.alive = alive
+            self.pruned = pruned
+            self.next_id = manifest["next_id"]
+            self.ready = True
+        self._save_manifest()
+        logger.info(
+            f"SUCCESS: Search index holds {len(latest)} documents in {len(segments)} segments")
+
+    def _load_manifest(self):
+        try:
+            with open(self._path("manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save_manifest(self):
+        with self._lock:
+            manifest = {"segments": [segment.name for segment in self.segments],
+                        "next_id": self.next_id, "pruned": sorted(self.pruned)}
+        tmp_path = self._path("manifest.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path("manifest.json"))
+        self.dirty = True
+
+    def _restore(self):
+        """Download the backed up segments, returns their manifest or None"""
+        bucket = self.bucket()
+        try:
+            manifest = json.loads(
+                bucket.blob(f"{self.prefix}manifest.json").download_as_bytes())
+        except NotFound:
+            return None
+        for name in manifest["segments"]:
+            with bucket.blob(f"{self.prefix}{name}").open("rb") as reader, \
+                    open(self._path(name), "wb") as f:
+                shutil.copyfileobj(reader, f, SEARCH_COPY_CHUNK_SIZE)
+        with open(self._path("manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        logger.info(f"SUCCESS: Restored {len(manifest['segments'])} search index segments")
+        return manifest
+
+    def add(self, filename, text, replace=True):
+        """Index the text of a file, replacing its earlier version unless `replace` is False"""
+        if not self.ready:
+            # Picked up by the backfill once the index is open
+            return
+        terms = search_terms(text)
+        with self._lock:
+            if not replace and filename in self.latest:
+                return
+            doc_id = self.next_id
+            self.next_id += 1
+            self.memtable.add(doc_id, filename, text, terms)
+            if filename in self.latest:
+                self._mark(self.latest[filename], False)
+            self.latest[filename] = doc_id
+            self._mark(doc_id, True)
+
+    def missing(self, filenames):
+        """The `filenames` that aren't indexed yet"""
+        with self._lock:
+            return [filename for filename in filenames if filename not in self.latest]
+
+    def prune(self, filenames):
+        """Drop the documents of files that are no longer in `filenames`"""
+        with self._write_lock:
+            with self._lock:
+                gone = self.latest.keys() - filenames
+                for filename in gone:
+                    doc_id = self.latest.pop(filename)
+                    self.alive[doc_id] = False
+                    self.pruned.add(doc_id)
+            if gone:
+                self._save_manifest()
+
+    def should_flush(self):
+        started = self.memtable.started
+        return started is not None and (
+            len(self.memtable.texts) >= SEARCH_FLUSH_DOCS
+            or time.monotonic() - started >= SEARCH_FLUSH_SECONDS)
+
+    def flush(self):
+        """Write buffered documents to a new segment"""
+        with self._write_lock:
+            with self._lock:
+                if self.memtable.texts:
+                    self.flushing.append(self.memtable)
+                    self.memtable = SearchMemtable()
+                pending = list(self.flushing)
+            for memtable in pending:
+                name = f"{uuid.uuid4().hex}.seg"
+                write_search_segment(self._path(name), memtable.entries(),
+                                     memtable.documents())
+                segment = SearchSegment(self._path(name))
+                with self._lock:
+                    self.segments.append(segment)
+                    self.flushing.remove(memtable)
+                self._save_manifest()
+
+    def merge(self):
+        """Merge one tier of similar sized segments, returns whether it merged"""
+        import numpy as np
+        with self._write_lock:
+            with self._lock:
+                segments = list(self.segments)
+                alive = self.alive.copy()
+            tiers = {}
+            group = None
+            for segment in segments:
+                live = int(np.count_nonzero(alive[segment.doc_ids]))
+                if live * 2 < len(segment.doc_ids):
+                    # Mostly replaced documents, rewrite it on its own
+                    group = [segment]
+                    break
+                tier = int(math.log(max(live, 1), SEARCH_MERGE_FACTOR))
+                tiers.setdefault(tier, []).append(segment)
+                if len(tiers[tier]) >= SEARCH_MERGE_FACTOR:
+                    group = tiers[tier]
+                    break
+            if group is None:
+                return False
+            merged = None
+            alive = {doc_id for segment in group
+                     for doc_id in segment.doc_ids[alive[segment.doc_ids]].tolist()}
+            if alive:
+                name = f"{uuid.uuid4().hex}.seg"
+                postings = ((term, sorted(itertools.chain.from_iterable(docs for _, docs in entries)))
+                            for term, entries in itertools.groupby(
+                                heapq.merge(*[segment.entries(alive) for segment in group],
+                                            key=lambda entry: entry[0]),
+                                key=lambda entry: entry[0]))
+                documents = heapq.merge(*[segment.documents(alive) for segment in group],
+                                        key=lambda document: document[0])
+                write_search_segment(self._path(name), postings, documents)
+                merged = SearchSegment(self._path(name))
+            with self._lock:
+                index = self.segments.index(group[0])
+                self.segments = [segment for segment in self.segments
+                                 if segment not in group]
+                if merged is not None:
+                    self.segments.insert(index, merged)
+                self.pruned -= {doc_id for segment in group
+                                for doc_id in segment.doc_ids.tolist()}
+            self._save_manifest()
+            # Searches may still read the old maps, they are closed with
+            # their last reference
+            for segment in group:
+                os.remove(segment.path)
+                self.removed.add(segment.name)
+            return True
+
+    def backup(self):
+        """Upload new segments and the manifest, deleting merged away segments"""
+        with self._write_lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            manifest = self._load_manifest()
+            bucket = self.bucket()
+            stored = {blob.name[len(self.prefix):]
+                      for blob in bucket.list_blobs(prefix=self.prefix)}
+            try:
+                for name in manifest["segments"]:
+                    if name not in stored:
+                        with open(self._path(name), "rb") as f:
+                            bucket.blob(f"{self.prefix}{name}").upload_from_file(f)
+                bucket.blob(f"{self.prefix}manifest.json").upload_from_string(
+                    json.dumps(manifest), content_type="application/json")
+                for name in self.removed & stored:
+                    bucket.blob(f"{self.prefix}{name}").delete()
+                self.removed.clear()
+            except Exception:
+                self.dirty = True
+                raise
+
+    def search(self, query, offset, limit):
+        """Newest first page of documents matching `query`, with snippets.
+
+        Only taking the snapshot of the sources holds the lock, so a slow
+        query doesn't hold up adding and pruning documents.
+        """
+        import numpy as np
+        tree = parse_search_query(query)
+        terms = query_terms(tree)
+        started = time.monotonic()
+        with self._lock:
+            sources = (self.segments + self.flushing
+                       + [self.memtable.snapshot(referenced_terms(tree))])
+            size = self.next_id
+            alive = self.alive[:size].copy()
+            indexed = len(self.latest)
+        matches = self._evaluate(tree, sources, size) & alive
+        page = []
+        for doc_id in np.flatnonzero(matches)[::-1][offset:offset + limit].tolist():
+            for source in sources:
+                document = source.document(doc_id)
+                if document is not None:
+                    page.append(document)
+                    break
+        results = [dict(search_snippet(text, terms), filename=filename)
+                   for filename, text in page]
+        return {"query": query, "total": int(np.count_nonzero(matches)),
+                "results": results, "indexed_documents": indexed,
+                "took_ms": round((time.monotonic() - started) * 1000, 3)}
+
+    def _evaluate(self, node, sources, size):
+        """Mask over doc ids of the documents matching a query node"""
+        import numpy as np
+        kind, value = node
+        if kind == "term":
+            found = np.zeros(size, dtype=bool)
+            for source in sources:
+                found[source.search_ids(value)] = True
+            return found
+        if kind == "phrase":
+            return self._phrase(value, sources, size)
+        if kind == "not":
+            return ~self._evaluate(value, sources, size)
+        found = [self._evaluate(child, sources, size) for child in value]
+        return np.logical_or.reduce(found) if kind == "or" else np.logical_and.reduce(found)
+
+    def _phrase(self, terms, sources, size):
+        """Mask over doc ids of the documents containing `terms` in order"""
+        import numpy as np
+        found = np.zeros(size, dtype=bool)
+        for source in sources:
+            # Position keys are sorted, so each later term is matched by
+            # binary search against the keys where the phrase can still start
+            keys = source.position_keys(terms[0])
+            for shift, term in enumerate(terms[1:], 1):
+                following = source.position_keys(term)
+                if not len(keys) or not len(following):
+                    keys = keys[:0]
+                    break
+                wanted = keys + np.uint64(shift)
+                index = np.searchsorted(following, wanted).clip(max=len(following) - 1)
+                keys = keys[following[index] == wanted]
+            found[(keys >> np.uint64(32)).astype(np.int64)] = True
+        return found
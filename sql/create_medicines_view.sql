@@ -1,9 +1,21 @@
 CREATE OR REPLACE VIEW `gcds-oht33219u9-2023.obscurer_reporting.medicines_found` AS
 SELECT
   filename,
-  STRING_AGG(medicine_name," ") AS medicine_names,
-  MAX(recordstamp) as recordstamp
-FROM
-  `gcds-oht33219u9-2023.obscurer_meta.medicines_found`
-GROUP BY
-  filename
\ No newline at end of file
+  ARRAY(
+  SELECT
+    medicine.name
+  FROM
+    UNNEST(medicines) AS medicine) AS medicine_names,
+  recordstamp
+FROM (
+  -- Extraction only appends, the latest row of each document is current
+  SELECT
+    *
+  FROM
+    `gcds-oht33219u9-2023.obscurer_meta.document_medicines`
+  WHERE
+    TRUE
+  QUALIFY
+    ROW_NUMBER() OVER (PARTITION BY filename ORDER BY recordstamp DESC, extracted_at DESC) = 1 )
+WHERE
+  ARRAY_LENGTH(medicines) > 0
\ No newline at end of file
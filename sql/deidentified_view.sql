@@ -7,4 +7,8 @@ SELECT
 FROM
   `gcds-oht33219u9-2023.obscurer_meta.deidentified_meta_direct`
 WHERE
-  filename LIKE 'deidentified%'
\ No newline at end of file
+  filename LIKE 'deidentified%'
+-- Latest row of each object, a deleted object ends with a `deleted` row
+QUALIFY
+  ROW_NUMBER() OVER (PARTITION BY filename ORDER BY created DESC) = 1
+  AND deleted IS NOT TRUE
\ No newline at end of file
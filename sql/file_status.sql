@@ -0,0 +1,18 @@
+CREATE TABLE IF NOT EXISTS
+  `gcds-oht33219u9-2023.obscurer_reporting.file_status` ( uuid STRING,
+    filename STRING,
+    content_type STRING,
+    size INTEGER,
+    upload_date DATE,
+    uploaded_at TIMESTAMP,
+    raw_created TIMESTAMP,
+    processed_created TIMESTAMP,
+    processed_size INTEGER,
+    deidentified_created TIMESTAMP,
+    deidentified_size INTEGER,
+    refreshed_at TIMESTAMP )
+PARTITION BY
+  upload_date
+CLUSTER BY
+  uuid,
+  filename
@@ -4,10 +4,10 @@ SELECT
   filename,
   content_type,
   size,
-  MAX(recordstamp) time_stamp
+  MAX(uploaded_at) time_stamp
 FROM
-  `gcds-oht33219u9-2023.obscurer_meta.raw_files`
+  `gcds-oht33219u9-2023.obscurer_reporting.file_status`
 GROUP BY
   filename,
   content_type,
-  size
\ No newline at end of file
+  size
@@ -1,16 +1,15 @@
 CREATE OR REPLACE VIEW
   `gcds-oht33219u9-2023.obscurer_reporting.processing_time_report` AS
 SELECT
-  processed_time.file_name,
-  content_type,
-  EXTRACT(second
-  FROM
-    processed_time.created-upload_time.time_stamp) AS processing_time_seconds,
+  CONCAT(filename,".txt") AS file_name,
+  mime_type AS content_type,
+  total_seconds AS processing_time_seconds,
+  queue_seconds,
+  docai_seconds,
+  dlp_seconds,
+  pages,
+  finished_at
 FROM
-  `gcds-oht33219u9-2023.obscurer_reporting.file_upload_record` upload_time
-LEFT JOIN
-  `gcds-oht33219u9-2023.obscurer_reporting.deidentified_view` processed_time
-ON
-  CONCAT(upload_time.filename,".txt") = processed_time.file_name
+  `gcds-oht33219u9-2023.obscurer_meta.file_timings`
 WHERE
-  processed_time.file_name IS NOT NULL
\ No newline at end of file
+  status = 'done'
@@ -1,9 +1,18 @@
 CREATE OR REPLACE VIEW
   `gcds-oht33219u9-2023.obscurer_reporting.raw_file_record` AS
 SELECT
-  *
+  * EXCEPT (deleted)
 FROM
   `gcds-oht33219u9-2023.obscurer_meta.raw_file_meta_direct`
 WHERE
   filename NOT LIKE 'processed%'
-  AND filename NOT LIKE 'deidentified%'
\ No newline at end of file
+  AND filename NOT LIKE 'deidentified%'
+  AND filename NOT LIKE 'cache/%'
+  AND filename NOT LIKE 'state/%'
+  AND filename NOT LIKE 'docai-batch/%'
+  AND filename NOT LIKE 'ingest/%'
+  AND filename NOT LIKE 'search/%'
+-- Latest row of each object, a deleted object ends with a `deleted` row
+QUALIFY
+  ROW_NUMBER() OVER (PARTITION BY filename ORDER BY created DESC) = 1
+  AND deleted IS NOT TRUE
\ No newline at end of file
@@ -0,0 +1,94 @@
+MERGE
+  `gcds-oht33219u9-2023.obscurer_reporting.file_status` status
+USING
+  (
+  SELECT
+    upload.uuid,
+    upload.filename,
+    upload.content_type,
+    upload.size,
+    DATE(upload.recordstamp) AS upload_date,
+    upload.recordstamp AS uploaded_at,
+    IF(raw.deleted, NULL, raw.created) AS raw_created,
+    IF(processed.deleted, NULL, processed.created) AS processed_created,
+    IF(processed.deleted, NULL, processed.size) AS processed_size,
+    IF(deidentified.deleted, NULL, deidentified.created) AS deidentified_created,
+    IF(deidentified.deleted, NULL, deidentified.size) AS deidentified_size,
+    CURRENT_TIMESTAMP() AS refreshed_at,
+    IFNULL(raw.deleted, FALSE) AS raw_deleted,
+    IFNULL(processed.deleted, FALSE) AS processed_deleted,
+    IFNULL(deidentified.deleted, FALSE) AS deidentified_deleted
+  FROM
+    `gcds-oht33219u9-2023.obscurer_meta.raw_files` upload
+  LEFT JOIN (
+    SELECT
+      filename,
+      created,
+      deleted
+    FROM
+      `gcds-oht33219u9-2023.obscurer_meta.raw_file_meta_direct`
+    WHERE
+      created >= TIMESTAMP(@since)
+    -- Latest row of each object, a deleted object ends with a `deleted` row
+    QUALIFY
+      ROW_NUMBER() OVER (PARTITION BY filename ORDER BY created DESC) = 1 ) raw
+  ON
+    upload.filename = raw.filename
+  LEFT JOIN (
+    SELECT
+      REGEXP_EXTRACT(filename, r"^processed/(.*)\.txt$") AS filename,
+      created,
+      size,
+      deleted
+    FROM
+      `gcds-oht33219u9-2023.obscurer_meta.processed_meta_direct`
+    WHERE
+      created >= TIMESTAMP(@since)
+    QUALIFY
+      ROW_NUMBER() OVER (PARTITION BY filename ORDER BY created DESC) = 1 ) processed
+  ON
+    upload.filename = processed.filename
+  LEFT JOIN (
+    SELECT
+      REGEXP_EXTRACT(filename, r"^deidentified/(.*)\.txt$") AS filename,
+      created,
+      size,
+      deleted
+    FROM
+      `gcds-oht33219u9-2023.obscurer_meta.deidentified_meta_direct`
+    WHERE
+      created >= TIMESTAMP(@since)
+    QUALIFY
+      ROW_NUMBER() OVER (PARTITION BY filename ORDER BY created DESC) = 1 ) deidentified
+  ON
+    upload.filename = deidentified.filename
+  WHERE
+    -- Uploads of the window, and earlier uploads whose objects were written in it
+    upload.recordstamp >= TIMESTAMP(@since)
+    OR raw.filename IS NOT NULL
+    OR processed.filename IS NOT NULL
+    OR deidentified.filename IS NOT NULL
+  QUALIFY
+    ROW_NUMBER() OVER (PARTITION BY upload.uuid ORDER BY upload.recordstamp DESC) = 1 ) latest
+ON
+  status.uuid = latest.uuid
+  -- Objects written before the window keep the times of an earlier refresh,
+  -- objects deleted in it are cleared
+  WHEN MATCHED THEN UPDATE SET raw_created = IF(latest.raw_deleted, NULL, COALESCE(latest.raw_created, status.raw_created)), processed_created = IF(latest.processed_deleted, NULL, COALESCE(latest.processed_created, status.processed_created)), processed_size = IF(latest.processed_deleted, NULL, COALESCE(latest.processed_size, status.processed_size)), deidentified_created = IF(latest.deidentified_deleted, NULL, COALESCE(latest.deidentified_created, status.deidentified_created)), deidentified_size = IF(latest.deidentified_deleted, NULL, COALESCE(latest.deidentified_size, status.deidentified_size)), refreshed_at = latest.refreshed_at
+  WHEN NOT MATCHED
+  THEN
+INSERT
+  (uuid,
+    filename,
+    content_type,
+    size,
+    upload_date,
+    uploaded_at,
+    raw_created,
+    processed_created,
+    processed_size,
+    deidentified_created,
+    deidentified_size,
+    refreshed_at)
+VALUES
+  (latest.uuid, latest.filename, latest.content_type, latest.size, latest.upload_date, latest.uploaded_at, latest.raw_created, latest.processed_created, latest.processed_size, latest.deidentified_created, latest.deidentified_size, latest.refreshed_at)
@@ -1,16 +1,14 @@
 CREATE OR REPLACE VIEW
   `gcds-oht33219u9-2023.obscurer_reporting.top_5_files` AS
 SELECT
-  deidentified.file_name,
-  unprocessed.content_type,
-  ROUND(SAFE_DIVIDE(unprocessed.size,1024),2) AS size
+  CONCAT(filename, ".txt") AS file_name,
+  content_type,
+  ROUND(SAFE_DIVIDE(size,1024),2) AS size
 FROM
-  `gcds-oht33219u9-2023.obscurer_reporting.deidentified_view` deidentified
-LEFT JOIN
-  `gcds-oht33219u9-2023.obscurer_reporting.file_upload_record` unprocessed
-ON
-  deidentified.file_name=CONCAT(unprocessed.filename,".txt")
+  `gcds-oht33219u9-2023.obscurer_reporting.file_status`
+WHERE
+  deidentified_created IS NOT NULL
 ORDER BY
   size DESC
 LIMIT
-  10
\ No newline at end of file
+  10
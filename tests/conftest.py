@@ -0,0 +1,13 @@
+"""Run the tests against the in-process fakes of bench/ instead of Google Cloud"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "bench"), ROOT]
+
+import fakes  # noqa: E402
+
+fakes.install()
+# The tests check behaviour, not timing, so the services answer at once
+for service in fakes.PROFILES:
+    fakes.configure(service, latency=0, per_mb=0)
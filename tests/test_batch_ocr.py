@@ -0,0 +1,30 @@
+import unittest
+from types import SimpleNamespace
+
+from google.cloud import documentai
+
+import fakes
+import main
+
+
+class BatchOcrTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+        main.clients.gcs.bucket(main.GCS_BUCKET).blob("scan.png").upload_from_string(
+            b"\x89PNG" + b"\0" * 64)
+        self.job = SimpleNamespace(filename="scan.png", mime_type="image/png", sha256="abc")
+
+    def test_stale_shards_are_not_read_back(self):
+        stale = documentai.Document(text="stale text", pages=[documentai.Document.Page()])
+        main.clients.gcs.bucket(main.GCS_BUCKET).blob(
+            f"{main.DOCAI_BATCH_PREFIX}abc/0/document-1.json").upload_from_string(
+            documentai.Document.to_json(stale).encode("utf-8"))
+
+        text, pages = main.run_batch_ocr(self.job)
+
+        self.assertNotIn("stale text", text)
+        self.assertEqual(pages, 1)
+        self.assertFalse([name for name in fakes.STORE
+                          if name.startswith(main.DOCAI_BATCH_PREFIX)])
+
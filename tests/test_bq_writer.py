@@ -0,0 +1,38 @@
+import threading
+import unittest
+
+import fakes
+import main
+
+
+class BigQueryWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(fakes.TABLES.clear)
+        self.writer = main.BigQueryWriter(100, 1024 * 1024, 60, load_job_rows=5,
+                                          max_retries=0)
+        self.writer.register_schema("project.dataset.loaded", main.META_SCHEMA)
+        writer = self.writer
+
+        class Counters(dict):
+            def __setitem__(self, key, value):
+                assert writer._lock.locked(), f"{key} updated without the lock"
+                super().__setitem__(key, value)
+
+        self.writer.counters = Counters(self.writer.counters)
+
+    def rows(self, count):
+        return [(str(number), {"filename": f"{number}.pdf"}) for number in range(count)]
+
+    def test_counters_from_concurrent_writes(self):
+        threads = [threading.Thread(target=self.writer._write, args=(table, self.rows(count)))
+                   for table, count in (("project.dataset.streamed", 2),
+                                        ("project.dataset.loaded", 5)) * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        status = self.writer.status()
+        self.assertEqual((status["rows"], status["insert_requests"], status["load_jobs"]),
+                         (28, 4, 4))
+        self.assertEqual(len(fakes.table_rows("streamed")), 8)
+        self.assertEqual(len(fakes.table_rows("loaded")), 20)
@@ -0,0 +1,55 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import main
+
+
+class ClientRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = main.ClientRegistry()
+
+    def test_client_is_created_once_on_first_use(self):
+        created = []
+
+        def factory():
+            created.append(1)
+            time.sleep(0.01)
+            return mock.Mock()
+
+        self.registry.register("gcs", factory)
+        self.assertEqual(self.registry.status()["gcs"]["ready"], False)
+        threads = [threading.Thread(target=self.registry.get, args=("gcs",))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIs(self.registry.gcs, self.registry.get("gcs"))
+        self.assertEqual(len(created), 1)
+        self.assertTrue(self.registry.status()["gcs"]["ready"])
+
+    def test_failed_creation_is_reported_and_retried(self):
+        factory = mock.Mock(side_effect=[RuntimeError("no credentials"), "client"])
+        self.registry.register("bq", factory)
+        with self.assertRaises(RuntimeError):
+            self.registry.bq
+        self.assertEqual(self.registry.status()["bq"]["error"], "no credentials")
+        self.assertEqual(self.registry.bq, "client")
+        self.assertIsNone(self.registry.status()["bq"]["error"])
+
+    def test_close_releases_created_clients(self):
+        client = mock.Mock()
+        grpc_client = mock.Mock(spec=["transport"])
+        self.registry.register("gcs", lambda: client)
+        self.registry.register("dlp", lambda: grpc_client)
+        self.registry.register("nl", mock.Mock())
+        self.registry.gcs
+        self.registry.dlp
+        self.registry.close()
+        client.close.assert_called_once_with()
+        grpc_client.transport.close.assert_called_once_with()
+        self.assertEqual(self.registry.clients, {})
+        with self.assertRaises(AttributeError):
+            self.registry.missing
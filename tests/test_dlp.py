@@ -0,0 +1,62 @@
+import asyncio
+import re
+import unittest
+from unittest import mock
+
+import main
+
+PHONE = re.compile(r"\d{3}-\d{3}-\d{4}")
+
+
+class SplitTextTest(unittest.TestCase):
+    def test_cores_cover_the_text_on_separators(self):
+        text = "Seen today. " * 50
+        ranges = main.split_text(text, 120, 10)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(text))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(text[end - 1], " ")
+        self.assertTrue(all(end - start <= 100 for start, end in ranges))
+
+    def test_overlapping_findings_are_replaced_once(self):
+        text = "Call Dr. John Smith at 555-123-4567"
+        findings = [(5, 19, "PERSON_NAME"), (9, 19, "LAST_NAME"),
+                    (23, 35, "PHONE_NUMBER")]
+        self.assertEqual(main.replace_findings(text, findings),
+                         "Call [PERSON_NAME] at [PHONE_NUMBER]")
+
+
+class DeidentifyLargeTextTest(unittest.TestCase):
+    def setUp(self):
+        self.max_findings = 3
+        self.windows = []
+
+        async def run_stage(stage, func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        def run_dlp_inspect(text):
+            self.windows.append(len(text))
+            findings = [(match.start(), match.end(), "PHONE_NUMBER")
+                        for match in PHONE.finditer(text)]
+            return findings[:self.max_findings], len(findings) > self.max_findings
+
+        for name, value in (("pipeline", mock.Mock(run_stage=run_stage)),
+                            ("run_dlp_inspect", run_dlp_inspect),
+                            ("DLP_BATCH_TEXT_BYTES", 10), ("DLP_MAX_REQUEST_BYTES", 100),
+                            ("DLP_CHUNK_CHARS", 400), ("DLP_CHUNK_OVERLAP", 10)):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_findings_of_every_chunk_are_replaced(self):
+        text = "Patient called from 555-123-4567 today. " * 20
+        result = asyncio.run(main.deidentify_text(text))
+        self.assertEqual(result, "Patient called from [PHONE_NUMBER] today. " * 20)
+        # Chunks over the findings limit were inspected again in halves
+        self.assertLess(min(self.windows), 400)
+
+    def test_range_too_small_to_split_fails(self):
+        self.max_findings = 0
+        with self.assertRaises(main.PermanentJobError):
+            asyncio.run(main.deidentify_text("Call 555-123-4567 now. " * 20))
@@ -0,0 +1,62 @@
+import hashlib
+import unittest
+from unittest import mock
+
+import fakes
+import main
+
+
+class DrugMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = main.DrugMatcher([
+            ("Sodium Chloride", "Sodium Chloride"),
+            ("Potassium Chloride", "Potassium Chloride"),
+            ("Magnesium Sulfate", "Magnesium Sulfate"),
+            ("Metformin Hydrochloride", "Metformin"),
+        ])
+
+    def names(self, text):
+        return [name for _, _, name in self.matcher.find(text)]
+
+    def test_lab_panel_cations_are_not_medicines(self):
+        self.assertEqual(
+            self.names("Labs: Sodium 140 mmol/L, Potassium 4.1, Magnesium 2.0"), [])
+
+    def test_salt_compositions_match_by_full_name(self):
+        self.assertEqual(
+            self.names("Given sodium chloride 0.9% and magnesium sulfate IV"),
+            ["Sodium Chloride", "Magnesium Sulfate"])
+
+    def test_salt_suffix_is_optional_for_drugs(self):
+        self.assertEqual(self.names("metformin 500 mg, Metformin HCl"),
+                         ["Metformin", "Metformin"])
+
+
+
+class MedicineExtractionTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(fakes.TABLES.clear)
+        for name, value in (("drug_matcher", main.DrugMatcher([("Metformin", "Metformin")])),
+                            ("extraction_watermark", None)):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def extract(self, text, recordstamp):
+        fakes.TABLES.setdefault("project.obscurer_meta.deidentified_text", []).append({
+            "filename": "a.pdf", "deidentified_text": text,
+            "recordstamp": recordstamp, "text_hash": hashlib.sha256(text.encode("utf-8")).hexdigest()})
+        main.extract_medicine_names()
+
+    def test_new_text_of_a_document_is_appended(self):
+        self.extract("takes metformin", "2024-01-01T00:00:00")
+        with mock.patch.object(main, "run_query", wraps=main.run_query) as run_query:
+            self.extract("no medicines now", "2024-01-02T00:00:00")
+        self.assertFalse(any("DELETE" in call.args[0] for call in run_query.call_args_list))
+
+        rows = fakes.table_rows("document_medicines")
+        self.assertEqual([len(row["medicines"]) for row in rows], [1, 0])
+        self.assertEqual(main.run_query(
+            "SELECT filename FROM medicines_found WHERE filename = @filename",
+            main.bigquery.QueryJobConfig(query_parameters=[
+                main.bigquery.ScalarQueryParameter("filename", "STRING", "a.pdf")])), [])
@@ -0,0 +1,61 @@
+import asyncio
+import hashlib
+import unittest
+from unittest import mock
+
+import fakes
+import main
+
+
+class CoalescedTaskTest(unittest.TestCase):
+    def test_bursts_fold_into_one_run_and_one_follow_up(self):
+        started = []
+
+        async def run():
+            started.append(1)
+            await asyncio.sleep(0.02)
+
+        async def check():
+            task = main.CoalescedTask(run, debounce=0.01)
+            for _ in range(5):
+                task.request()
+            while not started:
+                await asyncio.sleep(0.001)
+            # Requests during the run cause a single follow-up
+            for _ in range(5):
+                task.request()
+            while task.running:
+                await asyncio.sleep(0.01)
+            return task.runs
+
+        self.assertEqual(asyncio.run(check()), 2)
+        self.assertEqual(len(started), 2)
+
+
+class IncrementalExtractionTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(fakes.TABLES.clear)
+        for name, value in (("drug_matcher", main.DrugMatcher([("Metformin", "Metformin")])),
+                            ("extraction_watermark", None)):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_text(self, filename, text):
+        fakes.TABLES.setdefault("project.obscurer_meta.deidentified_text", []).append({
+            "filename": filename, "deidentified_text": text,
+            "recordstamp": "2024-01-01T00:00:00",
+            "text_hash": hashlib.sha256(text.encode("utf-8")).hexdigest()})
+
+    def test_only_new_texts_are_analyzed(self):
+        self.add_text("a.pdf", "takes metformin")
+        main.extract_medicine_names()
+        self.add_text("b.pdf", "metformin twice daily")
+        with mock.patch.object(main, "find_medicine_names",
+                               wraps=main.find_medicine_names) as find:
+            main.extract_medicine_names()
+            main.extract_medicine_names()
+        self.assertEqual([call.args[0] for call in find.call_args_list],
+                         ["metformin twice daily"])
+        self.assertEqual([row["filename"] for row in fakes.table_rows("document_medicines")],
+                         ["a.pdf", "b.pdf"])
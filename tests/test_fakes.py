@@ -0,0 +1,39 @@
+import io
+import random
+import unittest
+from unittest import mock
+
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+from pypdf import PdfReader
+
+import fakes
+import main
+
+
+class FakeServiceTest(unittest.TestCase):
+    def test_payload_limit_is_enforced(self):
+        with mock.patch.object(fakes.PROFILES["dlp"], "max_payload", 10):
+            with self.assertRaises(InvalidArgument):
+                main.run_dlp("Mr. John Smith called from 555-123-4567")
+
+    def test_quota_rejects_calls_over_the_rate(self):
+        self.addCleanup(fakes._recent_calls["nl"].clear)
+        with mock.patch.object(fakes.PROFILES["nl"], "quota", 60):
+            fakes.simulate("nl")
+            with self.assertRaises(ResourceExhausted):
+                fakes.simulate("nl")
+
+    def test_inspect_and_deidentify_agree(self):
+        text = "Mr. John Smith called from 555-123-4567 about Metformin SR"
+        findings, truncated = main.run_dlp_inspect(text)
+        self.assertFalse(truncated)
+        self.assertEqual(main.replace_findings(text, findings), main.run_dlp(text))
+        self.assertEqual(main.run_dlp(text),
+                         "[PERSON_NAME] called from [PHONE_NUMBER] about Metformin SR")
+
+    def test_scanned_pages_of_synthetic_pdfs_have_no_text_layer(self):
+        rng = random.Random(1)
+        for scanned, has_text in ((0.0, True), (1.0, False)):
+            reader = PdfReader(io.BytesIO(fakes.synthetic_pdf(rng, 2, scanned=scanned)))
+            self.assertEqual(len(reader.pages), 2)
+            self.assertEqual(bool(reader.pages[0].extract_text().strip()), has_text)
@@ -0,0 +1,67 @@
+import datetime
+import gzip
+import unittest
+from unittest import mock
+
+import fakes
+import main
+
+
+def put(name, data=b"text"):
+    fakes.STORE[name] = (data, datetime.datetime.now(datetime.timezone.utc))
+
+
+class FilenameIndexTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+        self.index = main.FilenameIndex("deidentified/", ".txt")
+
+    def test_lookup_matches_substrings(self):
+        for name in ("deidentified/john_smith.pdf.txt", "deidentified/jane_smith.pdf.txt",
+                     "deidentified/john_doe.png.txt", "deidentified/notes.pdf"):
+            self.index.add(name)
+        self.assertEqual(self.index.lookup("smith"),
+                         ["deidentified/jane_smith.pdf.txt",
+                          "deidentified/john_smith.pdf.txt"])
+        self.assertEqual(self.index.lookup("doe"), ["deidentified/john_doe.png.txt"])
+        self.assertEqual(len(self.index.lookup("j")), 3)
+        self.assertEqual(self.index.files(), {"john_smith.pdf", "jane_smith.pdf",
+                                              "john_doe.png"})
+
+    def test_paged_refresh_drops_deleted_objects(self):
+        for name in ("a.pdf", "b.pdf", "c.pdf"):
+            put(f"deidentified/{name}.txt")
+        self.index.refresh()
+        self.assertTrue(self.index.ready)
+
+        del fakes.STORE["deidentified/a.pdf.txt"]
+        put("deidentified/d.pdf.txt")
+        with mock.patch.object(fakes.FakePages, "page_size", 2):
+            self.assertFalse(self.index.refresh(max_pages=1))
+            self.assertIn("a.pdf", self.index.files())
+            self.assertTrue(self.index.refresh(max_pages=1))
+        self.assertEqual(self.index.files(), {"b.pdf", "c.pdf", "d.pdf"})
+
+
+class StreamMatchingTextsTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+        put("deidentified/a.pdf.txt", b"first text")
+        put("deidentified/b.pdf.txt", b"second text")
+        patcher = mock.patch.object(main, "DOWNLOAD_CHUNK_SIZE", 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_texts_are_streamed_in_chunks(self):
+        files = ["deidentified/a.pdf.txt", "deidentified/gone.pdf.txt",
+                 "deidentified/b.pdf.txt"]
+        pieces = list(main.stream_matching_texts(files))
+        self.assertEqual(b"".join(pieces), b"first text\nsecond text")
+        self.assertLessEqual(max(len(piece) for piece in pieces), 5)
+
+    def test_gzip_stream_decompresses_to_the_texts(self):
+        files = ["deidentified/a.pdf.txt", "deidentified/b.pdf.txt"]
+        data = b"".join(main.stream_matching_texts(files, compress=True))
+        self.assertEqual(gzip.decompress(data), b"first text\nsecond text")
@@ -0,0 +1,56 @@
+import asyncio
+import io
+import random
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import main
+
+
+def png(image, **params):
+    output = io.BytesIO()
+    image.save(output, format="PNG", **params)
+    return output.getvalue()
+
+
+def noisy_image(width, height):
+    rng = random.Random(1)
+    return Image.frombytes("RGB", (width, height), bytes(
+        rng.choice((0, 128, 255)) for _ in range(width * height * 3)))
+
+
+class ShrinkImageTest(unittest.TestCase):
+    def test_high_dpi_colour_scan_is_downscaled_to_grayscale(self):
+        content = png(noisy_image(400, 300), dpi=(600, 600))
+        shrunk, mime_type = main.shrink_image(content, "image/png")
+        self.assertEqual(mime_type, "image/png")
+        self.assertLess(len(shrunk), len(content))
+        with Image.open(io.BytesIO(shrunk)) as image:
+            self.assertEqual((image.mode, image.size), ("L", (200, 150)))
+
+    def test_image_that_doesnt_shrink_is_kept(self):
+        content = png(Image.new("L", (8, 8), 255))
+        self.assertEqual(main.shrink_image(content, "image/png"), (content, "image/png"))
+
+    def test_multi_page_tiff_is_kept(self):
+        output = io.BytesIO()
+        frames = [noisy_image(40, 40) for _ in range(2)]
+        frames[0].save(output, format="TIFF", save_all=True, append_images=frames[1:])
+        content = output.getvalue()
+        self.assertEqual(main.shrink_image(content, "image/tiff"), (content, "image/tiff"))
+
+
+class PreprocessImageTest(unittest.TestCase):
+    def job(self, mime_type, size):
+        return main.PipelineJob(filename="scan", content=b"x" * size, sha256="",
+                                mime_type=mime_type, size=size)
+
+    def test_small_images_and_documents_go_to_ocr_as_uploaded(self):
+        with mock.patch.object(main, "ProcessPoolExecutor") as pool:
+            for job in (self.job("image/png", main.IMAGE_MIN_BYTES - 1),
+                        self.job("application/pdf", main.IMAGE_MIN_BYTES * 2)):
+                self.assertEqual(asyncio.run(main.preprocess_image(job)),
+                                 (job.content, job.mime_type))
+        pool.assert_not_called()
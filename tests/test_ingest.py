@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import fakes
+import main
+
+
+class IngestBatchTest(unittest.TestCase):
+    def setUp(self):
+        for name, value in (("INGEST_BATCH_FILES", 10), ("INGEST_BATCH_BYTES", 100),
+                            ("pipeline", SimpleNamespace(queue_size=1000))):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_archive_members_are_cut_by_bytes(self):
+        files = iter([(f"{number}.txt", b"x" * 60, None) for number in range(5)])
+        self.assertEqual(len(main.next_ingest_batch(files)), 2)
+        self.assertEqual(len(main.next_ingest_batch(files)), 2)
+        self.assertEqual(len(main.next_ingest_batch(files)), 1)
+        self.assertEqual(main.next_ingest_batch(files), [])
+
+    def test_bucket_objects_are_cut_by_listed_size(self):
+        files = iter([(f"{number}.pdf", None, SimpleNamespace(size=60)) for number in range(5)])
+        self.assertEqual(len(main.next_ingest_batch(files)), 2)
+
+    def test_batch_is_cut_by_count(self):
+        files = iter([(f"{number}.txt", b"", None) for number in range(25)])
+        self.assertEqual(len(main.next_ingest_batch(files)), 10)
+
+
+class IngestJobTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+        self.addCleanup(fakes.TABLES.clear)
+        self.store = main.JobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+        self.store.open()
+        self.addCleanup(self.store.close)
+        self.submitted = []
+
+        async def run_stage(stage, func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        pipeline = mock.Mock(queue_size=1000, run_stage=run_stage,
+                             submit=self.submitted.append)
+        pipeline.try_reserve.return_value = True
+        self.run_query = mock.Mock(side_effect=main.run_query)
+        for name, value in (("job_store", self.store), ("pipeline", pipeline),
+                            ("run_query", self.run_query), ("INGEST_BATCH_FILES", 2),
+                            ("bq_writer", mock.Mock(flush=mock.AsyncMock()))):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def put(self, name, content):
+        fakes.STORE[name] = (content, datetime.datetime.now(datetime.timezone.utc))
+
+    def ingest(self):
+        job_id = self.store.create("ingest", "gs://source/backfill/", {
+            "source": "bucket", "bucket": "source", "prefix": "backfill/"})
+        asyncio.run(main.run_ingest_job(self.store.get(job_id)))
+        return self.store.get(job_id)["payload"]["progress"]
+
+    def test_known_files_are_loaded_once(self):
+        for number in range(5):
+            self.put(f"backfill/{number}.txt", f"note {number}".encode())
+        fakes.TABLES["project.meta.file_timings"] = [{
+            "filename": "backfill/0.txt", "status": "done", "size": 6,
+            "sha256": hashlib.sha256(b"note 0").hexdigest()}]
+
+        progress = self.ingest()
+
+        self.assertEqual((progress["queued"], progress["skipped"]), (4, 1))
+        self.assertEqual(self.run_query.call_count, 1)
+
+    def test_objects_with_a_known_name_and_size_are_not_downloaded(self):
+        self.put("backfill/same.txt", b"note 1")
+        self.put("backfill/changed.txt", b"note 22")
+        self.store.create("file", "backfill/same.txt", {"sha256": "old", "size": 6})
+        self.store.create("file", "backfill/changed.txt", {"sha256": "old", "size": 6})
+
+        with mock.patch.object(fakes.FakeBlob, "download_as_bytes", autospec=True,
+                               side_effect=fakes.FakeBlob.download_as_bytes) as download:
+            progress = self.ingest()
+
+        self.assertEqual([call.args[0].name for call in download.call_args_list],
+                         ["backfill/changed.txt"])
+        self.assertEqual((progress["queued"], progress["skipped"]), (1, 1))
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+
+
+class SchemaJobResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.store = main.JobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+        self.store.open()
+        self.addCleanup(self.store.close)
+        patcher = mock.patch.object(main, "job_store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(main.schema_runs.clear)
+
+    def test_resumed_job_skips_files_done_before_restart(self):
+        levels = [["a.sql", "b.sql"], ["c.sql"]]
+        dependencies = {"a.sql": [], "b.sql": [], "c.sql": ["a.sql", "b.sql"]}
+        job_id = self.store.create("schema", "update_bq_schema",
+                                   {"levels": levels, "dependencies": dependencies})
+        # The first process applied a.sql, then stopped
+        self.store.start(job_id)
+        self.store.stage(job_id, "a.sql", "done", 1.0)
+        self.store.stage(job_id, "b.sql", "running")
+
+        # A restarted process picks the job up from the store
+        record, = self.store.due()
+        ran = []
+        with mock.patch.object(main, "run_sql_file", side_effect=lambda f: ran.append(f) or f):
+            asyncio.run(main.run_background_job(record))
+
+        self.assertEqual(sorted(ran), ["b.sql", "c.sql"])
+        stored = self.store.get(job_id)
+        self.assertEqual(stored["state"], "done")
+        self.assertEqual({stage: status["state"] for stage, status in stored["stages"].items()},
+                         {"a.sql": "done", "b.sql": "done", "c.sql": "done"})
+
+
+
+class FileJobResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.store = main.JobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+        self.store.open()
+        self.addCleanup(self.store.close)
+        for name, value in (("job_store", self.store), ("pipeline", mock.Mock())):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        main.pipeline.run_stage = mock.AsyncMock(
+            side_effect=main.ServiceUnavailable("GCS is down"))
+
+    def test_failed_downloads_use_up_the_attempts(self):
+        job_id = self.store.create("file", "a.pdf", {"sha256": "0" * 64})
+        for _ in range(main.JOB_MAX_ATTEMPTS):
+            record = self.store.get(job_id)
+            asyncio.run(main.resume_file_job(record))
+        stored = self.store.get(job_id)
+        self.assertEqual((stored["state"], stored["attempts"]),
+                         ("failed", main.JOB_MAX_ATTEMPTS))
+        self.assertEqual(main.pipeline.release.call_count, main.JOB_MAX_ATTEMPTS)
+
+
+class JobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+        self.store = main.JobStore(self.path)
+        self.store.open()
+        self.addCleanup(self.store.close)
+
+    def test_failed_attempts_back_off_until_the_job_fails(self):
+        job_id = self.store.create("metadata", "update_metatables")
+        delays = []
+        for _ in range(main.JOB_MAX_ATTEMPTS):
+            self.store.start(job_id)
+            delays.append(self.store.fail(job_id, RuntimeError("BigQuery is down")))
+        self.assertIsNone(delays.pop())
+        for attempt, delay in enumerate(delays):
+            full = min(main.JOB_RETRY_BASE * 2 ** attempt, main.JOB_RETRY_MAX)
+            self.assertTrue(full / 2 <= delay <= full, (attempt, delay))
+        stored = self.store.get(job_id)
+        self.assertEqual((stored["state"], stored["error"]), ("failed", "BigQuery is down"))
+
+    def test_retries_wait_for_their_next_attempt(self):
+        job_id = self.store.create("metadata", "update_metatables")
+        self.store.start(job_id)
+        self.store.fail(job_id, RuntimeError("BigQuery is down"))
+        self.assertEqual(self.store.due(), [])
+        self.assertEqual(self.store.get(job_id)["state"], "retrying")
+
+    def test_permanent_errors_fail_at_once(self):
+        job_id = self.store.create("metadata", "update_metatables")
+        self.store.start(job_id)
+        self.assertIsNone(self.store.fail(job_id, ValueError("bad payload"), retryable=False))
+        self.assertEqual(self.store.get(job_id)["attempts"], 1)
+
+    def test_unfinished_jobs_survive_a_restart(self):
+        queued = self.store.create("metadata", "update_metatables", {"full_scan": True})
+        done = self.store.create("metadata", "update_metatables")
+        self.store.finish(done)
+        self.store.close()
+
+        reopened = main.JobStore(self.path)
+        reopened.open()
+        self.addCleanup(reopened.close)
+        record, = reopened.due()
+        self.assertEqual((record["id"], record["payload"]), (queued, {"full_scan": True}))
+        self.assertEqual(reopened.counts(), {"queued": 1, "done": 1})
@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import unittest
+from unittest import mock
+
+import fakes
+import main
+
+TABLE = "processed_meta_direct"
+
+
+def put(name, data=b"text"):
+    fakes.STORE[name] = (data, datetime.datetime.now(datetime.timezone.utc))
+
+
+def latest_rows():
+    latest = {}
+    for row in fakes.table_rows(TABLE):
+        latest[row["filename"]] = row
+    return latest
+
+
+class ReconcileMetadataTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(fakes.STORE.clear)
+        self.addCleanup(fakes.TABLES.clear)
+        put("processed/a.pdf.txt")
+        put("processed/b.pdf.txt")
+        put("processed/c.pdf.txt")
+
+    def test_unrecorded_objects_are_added_once(self):
+        main.reconcile_metadata(TABLE)
+        main.reconcile_metadata(TABLE, full_scan=True)
+        self.assertEqual(sorted(row["filename"] for row in fakes.table_rows(TABLE)),
+                         ["processed/a.pdf.txt", "processed/b.pdf.txt",
+                          "processed/c.pdf.txt"])
+
+    def test_deleted_objects_get_one_deleted_row(self):
+        main.reconcile_metadata(TABLE)
+        del fakes.STORE["processed/b.pdf.txt"]
+        main.reconcile_metadata(TABLE)
+        main.reconcile_metadata(TABLE)
+
+        rows = [row for row in fakes.table_rows(TABLE)
+                if row["filename"] == "processed/b.pdf.txt"]
+        self.assertEqual([row.get("deleted") for row in rows], [None, True])
+        self.assertNotIn("deleted", latest_rows()["processed/a.pdf.txt"])
+
+    def test_object_written_again_after_deletion_is_live(self):
+        main.reconcile_metadata(TABLE)
+        del fakes.STORE["processed/b.pdf.txt"]
+        main.reconcile_metadata(TABLE)
+        put("processed/b.pdf.txt")
+
+        async def record():
+            main.record_metadata(TABLE, fakes.FakeBlob("processed/b.pdf.txt"))
+            await main.bq_writer.flush()
+        asyncio.run(record())
+        main.reconcile_metadata(TABLE)
+        self.assertNotIn("deleted", latest_rows()["processed/b.pdf.txt"])
+
+    def test_rows_recorded_during_the_listing_are_kept(self):
+        later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=1)
+        fakes.TABLES[f"project.obscurer_meta.{TABLE}"] = [
+            {"filename": "processed/d.pdf.txt", "size": 4, "created": later.isoformat()}]
+        main.reconcile_metadata(TABLE)
+        self.assertNotIn("deleted", latest_rows()["processed/d.pdf.txt"])
+
+    def test_paged_passes_only_check_their_name_range(self):
+        put("processed/d.pdf.txt")
+        put("processed/e.pdf.txt")
+        main.reconcile_metadata(TABLE)
+        del fakes.STORE["processed/a.pdf.txt"]
+        del fakes.STORE["processed/e.pdf.txt"]
+        with mock.patch.object(fakes.FakePages, "page_size", 1):
+            main.reconcile_metadata(TABLE, max_pages=2)
+            self.assertTrue(latest_rows()["processed/a.pdf.txt"]["deleted"])
+            self.assertNotIn("deleted", latest_rows()["processed/e.pdf.txt"])
+            main.reconcile_metadata(TABLE, max_pages=2)
+        self.assertTrue(latest_rows()["processed/e.pdf.txt"]["deleted"])
+        self.assertNotIn("deleted", latest_rows()["processed/d.pdf.txt"])
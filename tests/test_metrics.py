@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import main
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(main, "METRICS", [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = main.Histogram("test_seconds", "Test", ("stage",), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, "ocr")
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{stage="ocr",le="0.1"} 1',
+            'test_seconds_bucket{stage="ocr",le="1"} 2',
+            'test_seconds_bucket{stage="ocr",le="+Inf"} 3',
+            'test_seconds_sum{stage="ocr"} 5.55',
+            'test_seconds_count{stage="ocr"} 3',
+        ])
+
+    def test_counter_series_per_label_set(self):
+        counter = main.Counter("test_total", "Test", ("mime_type", "status"))
+        counter.inc("application/pdf", "done")
+        counter.inc("application/pdf", "done", amount=2)
+        counter.inc("image/png", "failed")
+        self.assertEqual(counter.render()[2:], [
+            'test_total{mime_type="application/pdf",status="done"} 3',
+            'test_total{mime_type="image/png",status="failed"} 1',
+        ])
+
+    def test_endpoint_renders_every_metric(self):
+        main.Counter("test_total", "Test").inc()
+        main.Gauge("test_queued", "Test", (), lambda: {(): 4})
+        response = asyncio.run(main.fetch_metrics())
+        self.assertEqual(response.body.decode().splitlines(), [
+            "# HELP test_total Test", "# TYPE test_total counter", "test_total 1",
+            "# HELP test_queued Test", "# TYPE test_queued gauge", "test_queued 4",
+        ])
+
+
+class StageTimerTest(unittest.TestCase):
+    def test_repeated_stages_add_up_in_the_file_timings(self):
+        timings = {"docai": 1.0}
+        with main.stage_timer("docai", timings):
+            pass
+        self.assertGreaterEqual(timings["docai"], 1.0)
+        self.assertLess(timings["docai"], 1.5)
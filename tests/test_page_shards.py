@@ -0,0 +1,52 @@
+import asyncio
+import io
+import random
+import unittest
+from unittest import mock
+
+from pypdf import PdfReader
+
+import fakes
+import main
+
+
+def page_count(content):
+    return len(PdfReader(io.BytesIO(content)).pages)
+
+
+class PageShardTest(unittest.TestCase):
+    def setUp(self):
+        self.scanned = fakes.synthetic_pdf(random.Random(1), 5, words_per_page=40, scanned=1.0)
+        patcher = mock.patch.object(main, "DOCAI_SHARD_PAGES", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_scanned_pdf_is_split_into_page_shards(self):
+        pages, segments = main.split_document(self.scanned, "application/pdf")
+        self.assertEqual(pages, 5)
+        self.assertEqual([page_count(segment) for segment in segments], [2, 2, 1])
+
+    def test_unreadable_pdf_is_sent_whole(self):
+        self.assertEqual(main.split_document(b"%PDF-1.4 broken", "application/pdf"),
+                         (None, [b"%PDF-1.4 broken"]))
+
+    def test_shards_are_ocred_concurrently_and_joined_in_page_order(self):
+        calls = []
+
+        async def run_stage(stage, func, *args, **kwargs):
+            calls.append(stage)
+            # Later shards finish first
+            await asyncio.sleep(0.01 * (3 - len(calls)))
+            return func(*args)
+
+        def run_ocr(content, mime_type):
+            count = page_count(content)
+            return f"{count} pages", count
+
+        job = main.PipelineJob(filename="scan.pdf", content=self.scanned, sha256="",
+                               mime_type="application/pdf", size=len(self.scanned))
+        with mock.patch.object(main, "pipeline", mock.Mock(run_stage=run_stage)), \
+                mock.patch.object(main, "run_ocr", run_ocr):
+            text, pages = asyncio.run(main.ocr_document(job))
+        self.assertEqual((text, pages), ("2 pages\n2 pages\n1 pages", 5))
+        self.assertEqual(calls, ["docai"] * 3)
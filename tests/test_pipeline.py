@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import main
+
+
+class PipelineExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = main.PipelineExecutor(
+            workers=2, queue_size=3, threads=4, stage_limits={"gcs": 2})
+
+    def test_reserved_slots_bound_the_queue(self):
+        async def check():
+            await self.pipeline.start()
+            self.assertTrue(self.pipeline.try_reserve(2))
+            self.assertFalse(self.pipeline.try_reserve(2))
+            self.pipeline.release(1)
+            self.assertTrue(self.pipeline.try_reserve(2))
+            self.assertEqual(self.pipeline.free_slots(), 0)
+            await self.pipeline.stop()
+
+        asyncio.run(check())
+
+    def test_stage_limit_caps_concurrent_calls(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def call():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+        async def check():
+            await self.pipeline.start()
+            await asyncio.gather(*[self.pipeline.run_stage("gcs", call) for _ in range(6)])
+            await self.pipeline.stop()
+
+        asyncio.run(check())
+        self.assertEqual(max(peak), 2)
+
+    def test_workers_drain_the_queue_past_failures(self):
+        done = []
+
+        async def run_file_job(job):
+            if job.filename == "bad.pdf":
+                raise RuntimeError("OCR failed")
+            done.append(job.filename)
+
+        async def check():
+            await self.pipeline.start()
+            for name in ("a.pdf", "bad.pdf", "b.pdf"):
+                self.assertTrue(self.pipeline.try_reserve(1))
+                self.pipeline.submit(main.PipelineJob(
+                    filename=name, content=b"", sha256="", mime_type="application/pdf",
+                    size=0))
+            await self.pipeline.stop()
+
+        with mock.patch.object(main, "run_file_job", run_file_job):
+            asyncio.run(check())
+        self.assertEqual(sorted(done), ["a.pdf", "b.pdf"])
+        self.assertEqual(self.pipeline.status()["reserved"], 0)
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+
+from google.api_core.exceptions import ResourceExhausted
+
+import main
+
+
+class RateGovernorTest(unittest.TestCase):
+    def run_calls(self, governor, durations, throttle_every=0):
+        limits = []
+
+        async def call(index, duration):
+            async def run():
+                await asyncio.sleep(duration)
+                if throttle_every and index % throttle_every == 0:
+                    raise ResourceExhausted("quota")
+                limits.append(governor.limit)
+            try:
+                await governor.call(run)
+            except ResourceExhausted:
+                pass
+
+        async def go():
+            governor.start()
+            await asyncio.gather(*[call(index, duration)
+                                   for index, duration in enumerate(durations)])
+
+        asyncio.run(go())
+        return limits
+
+    def test_mixed_payload_latency_keeps_concurrency(self):
+        governor = main.RateGovernor("docai", 60000, 4)
+        limits = self.run_calls(governor, [0.005, 0.05] * 60)
+        self.assertEqual(min(limits), 4)
+        self.assertEqual(governor.limit, 4)
+
+    def test_throttling_cuts_rate(self):
+        governor = main.RateGovernor("docai", 60000, 4)
+        original = main.API_RETRIES
+        main.API_RETRIES = 0
+        try:
+            self.run_calls(governor, [0.01] * 40, throttle_every=3)
+        finally:
+            main.API_RETRIES = original
+        self.assertLess(governor.rate, governor.quota)
+        self.assertLess(governor.ceiling, governor.quota)
+
@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import main
+
+
+class ReportCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    async def loader(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return self.calls
+
+    def test_concurrent_misses_share_one_query(self):
+        async def check():
+            cache = main.ReportCache(ttl=60, stale_ttl=60)
+            first = await asyncio.gather(*[cache.get("count", self.loader) for _ in range(3)])
+            return first, await cache.get("count", self.loader)
+
+        self.assertEqual(asyncio.run(check()), ([1, 1, 1], 1))
+        self.assertEqual(self.calls, 1)
+
+    def test_invalidated_entries_are_served_while_refreshing(self):
+        async def check():
+            cache = main.ReportCache(ttl=60, stale_ttl=60)
+            await cache.get("count", self.loader)
+            cache.invalidate("count")
+            stale = await cache.get("count", self.loader)
+            await asyncio.gather(*cache.inflight.values())
+            return stale, await cache.get("count", self.loader), cache.counters
+
+        stale, fresh, counters = asyncio.run(check())
+        self.assertEqual((stale, fresh), (1, 2))
+        self.assertEqual((counters["stale_hits"], counters["hits"], counters["refreshes"]),
+                         (1, 1, 2))
+
+    def test_expired_entries_wait_for_the_query(self):
+        async def check():
+            cache = main.ReportCache(ttl=0, stale_ttl=0)
+            await cache.get("count", self.loader)
+            return await cache.get("count", self.loader)
+
+        self.assertEqual(asyncio.run(check()), 2)
+
+
+class PipelineInvalidationTest(unittest.TestCase):
+    def test_metadata_rows_invalidate_the_reports(self):
+        cache = main.ReportCache(ttl=60, stale_ttl=60)
+        cache.entries["count"] = (1, float("inf"))
+        refresh = mock.Mock()
+        with mock.patch.object(main, "report_cache", cache), \
+                mock.patch.object(main, "reporting_refresh", refresh):
+            main.on_pipeline_rows_flushed(f"project.{main.BQ_DATASET}.{main.TIMINGS_TABLE}")
+            self.assertEqual(cache.counters["invalidations"], 0)
+            main.on_pipeline_rows_flushed(f"project.{main.BQ_DATASET}.raw_file_meta_direct")
+        self.assertEqual(cache.counters["invalidations"], 1)
+        refresh.request.assert_called_once_with()
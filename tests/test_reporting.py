@@ -0,0 +1,41 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import fakes
+import main
+
+
+class ReportingBackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.store = main.JobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+        self.store.open()
+        self.addCleanup(self.store.close)
+        self.addCleanup(main.schema_runs.clear)
+        self.addCleanup(fakes.TABLES.clear)
+        self.refresh = mock.AsyncMock()
+        for name, value in (("job_store", self.store), ("refresh_reporting", self.refresh),
+                            ("run_sql_file", lambda sql_file: sql_file)):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_schema_job(self):
+        levels = [[main.REPORTING_TABLE_SQL], ["./sql/file_upload_record.sql"]]
+        dependencies = {main.REPORTING_TABLE_SQL: [],
+                        "./sql/file_upload_record.sql": [main.REPORTING_TABLE_SQL]}
+        self.store.create("schema", "update_bq_schema",
+                          {"levels": levels, "dependencies": dependencies})
+        asyncio.run(main.run_background_job(self.store.due()[0]))
+
+    def test_new_file_status_table_is_backfilled(self):
+        self.run_schema_job()
+        self.refresh.assert_awaited_once_with(main.REPORTING_BACKFILL_SINCE)
+
+    def test_filled_file_status_table_is_left_alone(self):
+        fakes.TABLES["project.obscurer_reporting.file_status"] = [{"uuid": "a"}]
+        self.run_schema_job()
+        self.refresh.assert_not_awaited()
+
@@ -0,0 +1,72 @@
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+import fakes
+import main
+
+
+def new_cache(max_bytes=1024):
+    return main.ResultCache(tempfile.mkdtemp(), max_bytes, "cache/", "v1")
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+
+    def test_other_instances_read_from_the_bucket(self):
+        new_cache().put("abc", "ocr", "Takes metformin")
+        cache = new_cache()
+        self.assertEqual(cache.get("abc", "ocr"), "Takes metformin")
+        self.assertEqual(cache.get("abc", "ocr"), "Takes metformin")
+        self.assertIsNone(cache.get("abc", "dlp"))
+        stats = cache.stats()
+        self.assertEqual((stats["gcs_hits"], stats["local_hits"], stats["misses"]), (1, 1, 1))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = new_cache(max_bytes=10)
+        cache.put("a", "ocr", "12345")
+        cache.put("b", "ocr", "12345")
+        cache.get("a", "ocr")
+        cache.put("c", "ocr", "12345")
+        self.assertEqual(list(cache.entries), ["v1-a-ocr", "v1-c-ocr"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+class CachedStageTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+
+        async def run_stage(stage, func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        for name, value in (("pipeline", mock.Mock(run_stage=run_stage)),
+                            ("result_cache", new_cache())):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_duplicates_share_one_computation(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "text"
+
+        async def process():
+            jobs = [main.PipelineJob(filename=f"{number}.pdf", content=b"", sha256="abc",
+                                     mime_type="application/pdf", size=0)
+                    for number in range(3)]
+            first = await asyncio.gather(*[main.cached_stage(job, "ocr", compute)
+                                           for job in jobs])
+            again = await main.cached_stage(jobs[0], "ocr", compute)
+            return first, again
+
+        first, again = asyncio.run(process())
+        self.assertEqual((first, again), (["text"] * 3, "text"))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(main.result_cache.stats()["coalesced"], 2)
@@ -0,0 +1,112 @@
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import fakes
+import search
+
+
+def open_index(directory=None):
+    index = search.SearchIndex(directory or tempfile.mkdtemp(), "search/",
+                               lambda: fakes.FakeBucket("bucket"))
+    index.open()
+    return index
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+        self.index = open_index()
+        self.index.add("a.pdf", "Aged [AGE], takes metformin daily")
+        self.index.add("b.pdf", "Aged [AGE], metformin, reports chest pain")
+        self.index.add("c.pdf", "Takes metformin, pain in the chest")
+
+    def filenames(self, query, index=None):
+        return [result["filename"]
+                for result in (index or self.index).search(query, 0, 10)["results"]]
+
+    def test_readme_query(self):
+        self.assertEqual(self.filenames('metformin AND [AGE] -"chest pain"'), ["a.pdf"])
+
+    def test_negated_phrase_forms(self):
+        self.assertEqual(self.filenames('metformin - "chest pain"'), ["c.pdf", "a.pdf"])
+        self.assertEqual(self.filenames('metformin NOT "chest pain"'), ["c.pdf", "a.pdf"])
+
+    def test_phrase_and_flushed_segments(self):
+        self.index.flush()
+        self.assertEqual(self.filenames('"chest pain"'), ["b.pdf"])
+        self.assertEqual(self.filenames("chest pain"), ["c.pdf", "b.pdf"])
+
+    def test_invalid_queries(self):
+        for query in ("-", "(metformin", "metformin)", "OR"):
+            with self.assertRaises(ValueError):
+                self.index.search(query, 0, 10)
+
+    def test_snippet_highlights_query_terms(self):
+        result = self.index.search("chest", 0, 10)["results"][0]
+        snippet = result["snippet"]
+        self.assertEqual([snippet[start:end] for start, end in result["highlights"]],
+                         ["chest"])
+
+    def test_reprocessed_file_replaces_its_document(self):
+        self.index.flush()
+        self.index.add("a.pdf", "Takes insulin now")
+        self.assertEqual(self.filenames("metformin"), ["c.pdf", "b.pdf"])
+        self.assertEqual(self.filenames("insulin"), ["a.pdf"])
+
+    def test_merge_keeps_live_documents(self):
+        self.index.flush()
+        for number in range(search.SEARCH_MERGE_FACTOR - 1):
+            self.index.add(f"new{number}.pdf", "metformin again")
+            self.index.flush()
+        self.index.add("a.pdf", "Takes insulin now")
+        self.index.flush()
+        while self.index.merge():
+            pass
+        self.assertLess(len(self.index.segments), search.SEARCH_MERGE_FACTOR)
+        self.assertEqual(sorted(self.filenames("metformin")),
+                         ["b.pdf", "c.pdf", "new0.pdf", "new1.pdf", "new2.pdf"])
+        self.assertEqual(self.filenames("insulin"), ["a.pdf"])
+
+    def test_pruned_files_stay_hidden_after_restart(self):
+        self.index.flush()
+        self.index.prune({"a.pdf", "c.pdf"})
+        self.assertEqual(self.filenames("metformin"), ["c.pdf", "a.pdf"])
+
+        reopened = open_index(self.index.directory)
+        self.assertEqual(self.filenames("metformin", reopened), ["c.pdf", "a.pdf"])
+        self.assertEqual(reopened.missing(["a.pdf", "b.pdf"]), ["b.pdf"])
+
+    def test_backup_restores_on_a_new_instance(self):
+        self.index.flush()
+        self.index.prune({"b.pdf", "c.pdf"})
+        self.index.backup()
+
+        restored = open_index()
+        self.assertEqual(self.filenames("metformin", restored), ["c.pdf", "b.pdf"])
+
+    def test_queries_dont_block_writes(self):
+        evaluating = threading.Event()
+        release = threading.Event()
+        evaluate = self.index._evaluate
+
+        def slow_evaluate(*args):
+            evaluating.set()
+            release.wait(5)
+            return evaluate(*args)
+
+        with mock.patch.object(self.index, "_evaluate", slow_evaluate):
+            query = threading.Thread(target=self.index.search, args=("metformin", 0, 10))
+            query.start()
+            self.assertTrue(evaluating.wait(5))
+            writer = threading.Thread(target=self.index.add, args=("d.pdf", "metformin"))
+            writer.start()
+            writer.join(2)
+            blocked = writer.is_alive()
+            release.set()
+            query.join()
+            writer.join()
+        self.assertFalse(blocked)
+        self.assertIn("d.pdf", self.filenames("metformin"))
@@ -0,0 +1,44 @@
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+import fakes
+import main
+
+
+class SearchBackfillTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+        self.addCleanup(main.search_backfill_misses.clear)
+        self.index = main.SearchIndex(tempfile.mkdtemp(), main.SEARCH_PREFIX,
+                                      lambda: main.clients.gcs.bucket(main.GCS_BUCKET))
+        self.index.open()
+        self.index.add("old.pdf", "Takes metformin")
+        self.filenames = main.FilenameIndex("deidentified/", ".txt")
+
+        async def run_stage(stage, func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        for name, value in (("search_index", self.index), ("filename_index", self.filenames),
+                            ("pipeline", mock.Mock(run_stage=run_stage))):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def backfill(self):
+        async def run():
+            pending = await main.search_backfill_pending()
+            return sorted(pending), await main.backfill_search_index(pending)
+        return asyncio.run(run())
+
+    def test_prunes_and_remembers_missing_objects(self):
+        main.clients.gcs.bucket(main.GCS_BUCKET).blob(
+            "deidentified/new.pdf.txt").upload_from_string("Aged [AGE]")
+        self.filenames.add("deidentified/new.pdf.txt")
+        self.filenames.add("deidentified/gone.pdf.txt")
+
+        self.assertEqual(self.backfill(), (["gone.pdf", "new.pdf"], 1))
+        self.assertEqual(self.index.missing(["old.pdf", "new.pdf"]), ["old.pdf"])
+        self.assertEqual(self.backfill(), ([], 0))
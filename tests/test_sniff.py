@@ -0,0 +1,26 @@
+import unittest
+
+import main
+
+
+class SniffMimeTypeTest(unittest.TestCase):
+    def test_signatures(self):
+        self.assertEqual(main.sniff_mime_type(b"\x89PNG\r\n\x1a\n"), "image/png")
+        self.assertEqual(main.sniff_mime_type(b"%PDF-1.7\n"), "application/pdf")
+        self.assertEqual(main.sniff_mime_type(b"\xff\xd8\xff\xe0"), "image/jpeg")
+        self.assertEqual(main.sniff_mime_type(b"RIFF\0\0\0\0WEBPVP8 "), "image/webp")
+
+    def test_bmp_needs_a_dib_header(self):
+        header = b"BM" + (70).to_bytes(4, "little") + b"\0" * 8 + (40).to_bytes(4, "little")
+        self.assertEqual(main.sniff_mime_type(header, "scan"), "image/bmp")
+
+    def test_text_starting_with_bm_is_text(self):
+        note = b"BMI 31.2, BP 130/85, advised metformin 500 mg"
+        self.assertEqual(main.sniff_mime_type(note, "note.txt"), "text/plain")
+        self.assertEqual(main.sniff_mime_type(note, "note"), "text/plain")
+
+    def test_extension_then_text_fallback(self):
+        self.assertEqual(main.sniff_mime_type(b"\0\1\2", "scan.TIF"), "image/tiff")
+        self.assertEqual(main.sniff_mime_type("café".encode()[:4], "x"), "text/plain")
+        self.assertEqual(main.sniff_mime_type(b"\xff\xfe\0\x81", "x"),
+                         "application/octet-stream")
@@ -0,0 +1,60 @@
+import asyncio
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql")
+
+
+def write_sql(directory, name, query):
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        f.write(query)
+    return path
+
+
+class PlanSqlFilesTest(unittest.TestCase):
+    def test_repository_views_run_after_what_they_read(self):
+        levels, dependencies = main.plan_sql_files(
+            sorted(glob.glob(os.path.join(SQL_DIR, "*.sql"))))
+        level_of = {os.path.basename(sql_file): number
+                    for number, level in enumerate(levels) for sql_file in level}
+        for before, after in (("file_status.sql", "file_upload_record.sql"),
+                              ("deidentified_view.sql", "healthcare_data.sql"),
+                              ("create_medicines_view.sql", "healthcare_data.sql"),
+                              ("file_processed_summary.sql", "file_processed_dash.sql")):
+            self.assertLess(level_of[before], level_of[after], (before, after))
+        for sql_file, depends_on in dependencies.items():
+            self.assertNotIn(sql_file, depends_on)
+
+    def test_circular_dependencies_are_rejected(self):
+        directory = tempfile.mkdtemp()
+        files = [write_sql(directory, "a.sql",
+                           "CREATE OR REPLACE VIEW `p.d.a` AS SELECT * FROM `p.d.b`"),
+                 write_sql(directory, "b.sql",
+                           "CREATE OR REPLACE VIEW `p.d.b` AS SELECT * FROM d.a")]
+        with self.assertRaises(ValueError):
+            main.plan_sql_files(files)
+
+
+class RunSqlPlanTest(unittest.TestCase):
+    def test_files_after_a_failure_are_skipped(self):
+        levels = [["a.sql", "b.sql"], ["c.sql", "d.sql"]]
+        dependencies = {"a.sql": [], "b.sql": [], "c.sql": ["a.sql"], "d.sql": ["b.sql"]}
+        run = main.new_schema_run("run", levels, dependencies)
+
+        def run_sql_file(sql_file):
+            if sql_file == "a.sql":
+                raise RuntimeError("Syntax error")
+            return sql_file
+
+        with mock.patch.object(main, "run_sql_file", run_sql_file):
+            asyncio.run(main.run_sql_plan(run))
+        self.assertEqual({sql_file: status["state"] for sql_file, status in run["files"].items()},
+                         {"a.sql": "failed", "b.sql": "done", "c.sql": "skipped",
+                          "d.sql": "done"})
+        self.assertEqual(run["state"], "failed")
@@ -0,0 +1,14 @@
+import unittest
+from unittest import mock
+
+import main
+
+
+class MetadataTablesTest(unittest.TestCase):
+    def test_medicines_table_exists_before_extraction(self):
+        with mock.patch.object(main, "ensure_table") as ensure_table:
+            main.create_metadata_tables()
+        tables = {call.args[0].rsplit(".", 1)[1]: call.args[1]
+                  for call in ensure_table.call_args_list}
+        self.assertIs(tables[main.MEDICINES_TABLE], main.MEDICINES_SCHEMA)
+
@@ -0,0 +1,66 @@
+import asyncio
+import io
+import random
+import unittest
+from unittest import mock
+
+from pypdf import PdfReader, PdfWriter
+
+import fakes
+import main
+
+
+def mixed_pdf(kinds):
+    """PDF with a text page for each "t" and a scanned page for each "s" in `kinds`"""
+    rng = random.Random(1)
+    writer = PdfWriter()
+    for kind in kinds:
+        source = fakes.synthetic_pdf(rng, 1, words_per_page=40,
+                                     scanned=1.0 if kind == "s" else 0.0)
+        writer.add_page(PdfReader(io.BytesIO(source)).pages[0])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class TextLayerTest(unittest.TestCase):
+    def setUp(self):
+        self.ocr = mock.Mock(side_effect=lambda content, mime_type: (
+            "OCR TEXT", len(PdfReader(io.BytesIO(content)).pages)))
+
+        async def run_stage(stage, func, *args, **kwargs):
+            return func(*args)
+
+        for name, value in (("pipeline", mock.Mock(run_stage=run_stage)),
+                            ("run_ocr", self.ocr), ("DOCAI_SHARD_PAGES", 2)):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ocr_document(self, content):
+        job = main.PipelineJob(filename="note.pdf", content=content, sha256="",
+                               mime_type="application/pdf", size=len(content))
+        return asyncio.run(main.ocr_document(job))
+
+    def test_born_digital_pdf_skips_ocr(self):
+        text, pages = self.ocr_document(mixed_pdf("ttt"))
+        self.assertEqual(pages, 3)
+        self.assertIn("patient", text)
+        self.ocr.assert_not_called()
+
+    def test_scanned_pages_between_text_pages_are_ocred_in_place(self):
+        pages, segments = main.split_document(mixed_pdf("tssst"), "application/pdf")
+        self.assertEqual(pages, 5)
+        self.assertEqual([type(segment) for segment in segments],
+                         [str, bytes, bytes, str])
+
+        text, pages = self.ocr_document(mixed_pdf("tssst"))
+        self.assertEqual(pages, 5)
+        self.assertIn("\nOCR TEXT\nOCR TEXT\n", text)
+        self.assertEqual(text.count("OCR TEXT"), 2)
+        self.assertEqual(self.ocr.call_count, 2)
+
+    def test_text_layer_can_be_turned_off(self):
+        with mock.patch.object(main, "PDF_TEXT_LAYER", False):
+            text, pages = self.ocr_document(mixed_pdf("tt"))
+        self.assertEqual((text, pages), ("OCR TEXT", 2))
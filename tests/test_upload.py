@@ -0,0 +1,50 @@
+import asyncio
+import hashlib
+import io
+import unittest
+from unittest import mock
+
+from starlette.datastructures import UploadFile
+
+import fakes
+import main
+
+
+class StreamUploadTest(unittest.TestCase):
+    def setUp(self):
+        fakes.STORE.clear()
+        self.addCleanup(fakes.STORE.clear)
+        self.stages = []
+
+        async def run_stage(stage, func, *args, **kwargs):
+            self.stages.append((getattr(func, "__name__", None), len(args[0]) if args else 0))
+            return func(*args, **kwargs)
+
+        for name, value in (("pipeline", mock.Mock(run_stage=run_stage)),
+                            ("UPLOAD_CHUNK_SIZE", 4), ("record_upload", mock.Mock())):
+            patcher = mock.patch.object(main, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload(self, data, size):
+        file = UploadFile(io.BytesIO(data), size=size, filename="note.txt")
+        return asyncio.run(main.stream_upload(file))
+
+    def test_chunks_go_to_gcs_and_the_job(self):
+        data = b"BMI 31.2, metformin 500 mg"
+        job = self.upload(data, len(data))
+        self.assertEqual(bytes(job.content), data)
+        self.assertEqual((job.size, job.mime_type), (len(data), "text/plain"))
+        self.assertEqual(job.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(fakes.STORE["note.txt"][0], data)
+        writes = [size for name, size in self.stages if name == "write"]
+        self.assertEqual(writes, [4] * 6 + [2])
+
+    def test_wrong_declared_size(self):
+        data = b"metformin 500 mg"
+        for size in (None, 3, 100):
+            self.assertEqual(bytes(self.upload(data, size).content), data)
+
+    def test_empty_upload(self):
+        job = self.upload(b"", 0)
+        self.assertEqual((bytes(job.content), job.size), (b"", 0))